@@ -0,0 +1,59 @@
+"""
+Per-record overhead of the gin configured cleaning path against the compiled ExecutionPlan.
+
+> python -m benchmarks.plan_overhead
+"""
+import timeit
+
+import gin
+
+import pipelines.cleaner as dc
+import pipelines.text_processors  # registers the text processes used by CONFIGS
+import pipelines.validation as val
+from pipelines.advertise import Advertise
+from pipelines.plan import build_clean_plan
+
+CONFIGS = {
+    "dispatch only": """
+        clean_base_advertise.process_pipeline = (@create_clean_text_field, @create_clean_text_field_inverted)
+        create_clean_text_field.text_process_pipeline = ()
+        create_clean_text_field_inverted.text_process_pipeline = ()
+    """,
+    "main_config text pipes": """
+        valid_advertise.category = "celular-e-telefone"
+        clean_base_advertise.process_pipeline = (@create_clean_text_field, @create_clean_text_field_inverted)
+        create_clean_text_field.text_process_pipeline = (@full_default_process_dedup, )
+        create_clean_text_field_inverted.text_process_pipeline = (@full_default_process_dedup, )
+    """,
+}
+
+
+def build_advertise() -> Advertise:
+    return Advertise(url="https://produto.mercadolivre.com.br/MLB-1", id="1", market="MercadoLivre",
+                     category="celular-e-telefone", price=1200.0, region="sp",
+                     title="Iphone 8 Plus 64GB Dourado",
+                     detail="Aparelho novo, na caixa, com nota fiscal e garantia de 1 ano. Acompanha carregador.")
+
+
+def gin_path(advertise):
+    if val.valid_advertise(advertise):
+        return dc.clean_base_advertise(advertise)
+
+
+def main(number: int = 20000):
+    for name, config in CONFIGS.items():
+        gin.clear_config()
+        gin.parse_config(config)
+        plan = build_clean_plan()
+        advertise = build_advertise()
+
+        assert gin_path(build_advertise()).to_dict() == plan.run(build_advertise()).to_dict()
+
+        before = min(timeit.repeat(lambda: gin_path(advertise), number=number, repeat=3)) / number
+        after = min(timeit.repeat(lambda: plan.run(advertise), number=number, repeat=3)) / number
+        print("{0:>24}: gin {1:8.2f} us/record | plan {2:8.2f} us/record | saved {3:8.2f} us/record".format(
+            name, before * 1e6, after * 1e6, (before - after) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
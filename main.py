@@ -5,10 +5,12 @@ from typing import List
 import gin
 import numpy as np
 
-import pipelines.cleaner as dc
 import pipelines.data_source as ds
+import pipelines.text_processors as tp
 import pipelines.utils as sc
 from pipelines.parser import Parser
+from pipelines.plan import build_clean_plan
+from pipelines.vocabulary import export_binary_maps
 
 
 def argument_parser():
@@ -18,63 +20,131 @@ def argument_parser():
     return parser
 
 
+def build_parser(enc_client: "pipelines.encoder.BaseEncoder", field_projection: bool = True) -> Parser:
+    """
+    Builds the parser for a given encoder, checking that every schema field the encoder
+    reads is produced by the parser.
+    :param enc_client: encoder instance
+    :param field_projection: only parse the ML fields declared by the encoder
+    :return: Parser
+    """
+    parser = Parser()
+    if field_projection and enc_client.schema_fields is not None:
+        parser.project(enc_client.schema_fields)
+    return parser
+
+
 @gin.configurable("base_pipeline")
-def base(files: List[str], encoder: "pipelines.encoder.BaseEncoder"=None):
+def base(files: List[str], encoder: "pipelines.encoder.BaseEncoder"=None, field_projection: bool = True,
+         batch_size: int = None):
     """
     Base pipeline method to be used @pararell_processing
     :param files: file paths to be processed
     :param encoder: encoder class defined @config.gin
+    :param field_projection: parse only the ML fields consumed by the encoder
+    :param batch_size: clean and encode advertises in batches of batch_size (record by record if None)
     """
     try:
         if not encoder:
             raise ValueError("Encoder cannot be None. PLz Specificy a encoder @gin.config!")
 
         # Initialization
-        generator = ds.build_advertise_generator(files)
-        parser = Parser()
         enc_client = encoder()
+        parser = build_parser(enc_client, field_projection)
+        plan = build_clean_plan(parser)
 
         # Source generator, clean and encode advertise
-        for line in generator:
-            try:
-                ad = dc.clean_raw_advertise(line, parser)
-                if ad:
-                    enc_client.encode_advertise(ad)
-            except Exception as err:
-                sc.message(err)
+        if batch_size:
+            for batch in ds.build_advertise_batch_generator(files, batch_size):
+                try:
+                    enc_client.encode_batch(plan.run_batch(batch))
+                except Exception as err:
+                    sc.message(err)
+        else:
+            for line in ds.build_advertise_generator(files):
+                try:
+                    ad = plan.run(line)
+                    if ad:
+                        enc_client.encode_advertise(ad)
+                except Exception as err:
+                    sc.message(err)
 
         enc_client.save_maps()
+        sc.message("Parser shape cache: {}".format(parser.shape_cache_info()))
+        sc.message("Token cache: {}".format(tp.token_cache_info()))
+        sc.message("Encoder cache: {}".format(enc_client.cache_info()))
 
     except Exception as erro:
         sc.message(erro)
 
 
 @gin.configurable("clean_pipeline")
-def clean(files: List[str], encoder: "pipelines.encoder.BaseEncoder"=None):
+def clean(files: List[str], encoder: "pipelines.encoder.BaseEncoder"=None, batch_size: int = None):
     """
     Data pipeline method to be used @pararell_processing when data is already clean
     So, no parser is needed.
     :param files: file paths to be processed
     :param encoder: encoder class defined @config.gin
+    :param batch_size: encode advertises in batches of batch_size (record by record if None)
     """
     try:
         if not encoder:
             raise ValueError("Encoder cannot be None. PLz Specificy a encoder @gin.config!")
 
-        generator = ds.build_advertise_generator(files)
         enc_client = encoder()
 
-        for ad in generator:
-            try:
-                enc_client.encode_advertise(ad)
-            except Exception as err:
-                sc.message(err)
+        if batch_size:
+            for batch in ds.build_advertise_batch_generator(files, batch_size):
+                try:
+                    enc_client.encode_batch(batch)
+                except Exception as err:
+                    sc.message(err)
+        else:
+            for ad in ds.build_advertise_generator(files):
+                try:
+                    enc_client.encode_advertise(ad)
+                except Exception as err:
+                    sc.message(err)
 
         enc_client.save_maps()
+        sc.message("Encoder cache: {}".format(enc_client.cache_info()))
     except Exception as erro:
         sc.message(erro)
 
 
+def query_binding(selector: str, default=None):
+    """
+    Value bound to @selector (i.e. "NEREncoder.maps_folder") in the parsed gin config, @default if unbound.
+    """
+    try:
+        return gin.query_parameter(selector)
+    except ValueError:
+        return default
+
+
+def share_maps():
+    """
+    Writes the binary maps of the configured encoder once, before the workers are spawned.
+    Workers with frozen maps (update_maps=False) memory-map them read only: the pages are shared
+    through the page cache and nothing is deserialized, instead of a json copy per worker.
+    """
+    pipeline = query_binding("parallel_process.pipeline")
+    encoder = query_binding("{}.encoder".format(pipeline.selector)) if pipeline else None
+    if not encoder:
+        return
+
+    maps_folder = query_binding("{}.maps_folder".format(encoder.selector))
+    if not maps_folder or query_binding("{}.update_maps".format(encoder.selector), False):
+        return
+
+    try:
+        written = export_binary_maps(maps_folder)
+        sc.message("Shared maps @{0}: {1} binary maps written".format(maps_folder, len(written)))
+    except Exception as err:
+        # Workers fall back to their own json maps
+        sc.message(err)
+
+
 @gin.configurable
 def parallel_process(pipeline, dataset_path, workers: int, reducer=None):
     """
@@ -91,6 +161,8 @@ def parallel_process(pipeline, dataset_path, workers: int, reducer=None):
 
     print(workers_files)
 
+    share_maps()
+
     with Pool(processes=workers) as pool:
         pool.map(pipeline, workers_files)
 
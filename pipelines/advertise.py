@@ -0,0 +1,93 @@
+from collections.abc import MutableMapping
+from typing import Dict, Any, Iterator
+
+SCHEMA_FIELDS = ("url", "id", "market", "region", "title", "detail", "price", "dt_publish", "datetime",
+                 "category", "clean_text", "clean_text_invert", "NER")
+_SCHEMA_SET = frozenset(SCHEMA_FIELDS)
+# Market extras are iterated between these schema fields, as Parser.get_general_schema adds them
+_HEAD_FIELDS = SCHEMA_FIELDS[:3]
+_TAIL_FIELDS = SCHEMA_FIELDS[3:]
+
+
+class Advertise(MutableMapping):
+    """
+    Compact advertise record with fixed schema fields and an overflow dict for market extras
+    (i.e. ML 'product_full_attributes'). It behaves as a dict for the encoders.
+
+    Ownership rule: a record belongs to the pipeline stage currently processing it. Stages
+    (cleaner processes, text fields, NER tagging) update it in place and hand it to the next
+    stage, so no stage copies it. Whoever needs to keep a record after passing it along must
+    take a @copy.
+    Keys iterate in a fixed order: url, id, market, the market extras (in insertion order), then the
+    remaining schema fields. This is the order the parser and the cleaner stages build a record in,
+    so serialized records keep the key order of the dicts they replaced.
+    """
+    __slots__ = SCHEMA_FIELDS + ("extras",)
+
+    def __init__(self, *args, **kwargs):
+        self.extras = None
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _SCHEMA_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extras is None:
+            raise KeyError(key)
+        return self.extras[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in _SCHEMA_SET:
+            setattr(self, key, value)
+        else:
+            if self.extras is None:
+                self.extras = dict()
+            self.extras[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in _SCHEMA_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self.extras is None:
+            raise KeyError(key)
+        else:
+            del self.extras[key]
+
+    def __iter__(self) -> Iterator[str]:
+        for field in _HEAD_FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self.extras:
+            yield from self.extras
+        for field in _TAIL_FIELDS:
+            if hasattr(self, field):
+                yield field
+
+    def __len__(self) -> int:
+        size = len(self.extras) if self.extras else 0
+        return size + sum(1 for field in SCHEMA_FIELDS if hasattr(self, field))
+
+    def __contains__(self, key: Any) -> bool:
+        if key in _SCHEMA_SET:
+            return hasattr(self, key)
+        return self.extras is not None and key in self.extras
+
+    def __repr__(self) -> str:
+        return "Advertise({})".format(self.to_dict())
+
+    def copy(self) -> "Advertise":
+        tmp_ad = Advertise()
+        for field in SCHEMA_FIELDS:
+            if hasattr(self, field):
+                setattr(tmp_ad, field, getattr(self, field))
+        if self.extras:
+            tmp_ad.extras = self.extras.copy()
+        return tmp_ad
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: self[k] for k in self}
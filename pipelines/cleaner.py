@@ -1,10 +1,13 @@
 
-from typing import Dict, Any, Tuple, Callable
+import functools
+from typing import Dict, Any, Tuple, Callable, List, Optional, Union
 
 import gin
+import pandas as pd
 
 import pipelines.validation as val
-from pipelines.text_processors import full_default_process
+from pipelines import utils as sc
+from pipelines.text_processors import full_default_process, batch_process
 
 
 def clean_raw_advertise(raw_advertise: Dict[str, Any], parser: "pipelines.parser.Parser"):
@@ -15,7 +18,11 @@ def clean_raw_advertise(raw_advertise: Dict[str, Any], parser: "pipelines.parser
 
 @gin.configurable(blacklist=['base_advertise'])
 def clean_base_advertise(base_advertise: Dict[str, Any], process_pipeline: Tuple[Callable]):
-    tmp_advertise = base_advertise.copy()
+    """
+    Applies the process pipeline to the advertise. Processes update the record in place
+    (see pipelines.advertise.Advertise ownership rule) and return it.
+    """
+    tmp_advertise = base_advertise
     if process_pipeline:
         for process in process_pipeline:
             tmp_advertise = process(tmp_advertise)
@@ -36,7 +43,7 @@ def generate_clean_text(raw_text: str, process_pipeline: Tuple[Callable]):
 
 @gin.configurable(blacklist=["advertise"])
 def create_clean_text_field(advertise, text_process_pipeline=None):
-    tmp_ad = advertise.copy()
+    tmp_ad = advertise
     field_name = "clean_text"
 
     txt_input = build_model_input(advertise, invert=False)
@@ -50,7 +57,7 @@ def create_clean_text_field(advertise, text_process_pipeline=None):
 
 @gin.configurable(blacklist=["advertise"])
 def create_clean_text_field_inverted(advertise, text_process_pipeline=None):
-    tmp_ad = advertise.copy()
+    tmp_ad = advertise
     field_name = "clean_text_invert"
 
     txt_input = build_model_input(advertise, invert=True)
@@ -96,3 +103,98 @@ def build_model_input(advertise, invert=False):
             return advertise["title"]
     else:
         raise Exception("Not enough fields in advertise!")
+
+
+def to_advertise_list(advertises: Union[List[Dict[str, Any]], pd.DataFrame]) -> List[Dict[str, Any]]:
+    if isinstance(advertises, pd.DataFrame):
+        return advertises.to_dict("records")
+    return list(advertises)
+
+
+def build_model_input_batch(advertises: List[Dict[str, Any]], invert=False) -> List[Optional[str]]:
+    """
+    Vectorized @build_model_input over a batch of advertises.
+    :return: model inputs (None for advertises without title)
+    """
+    frame = pd.DataFrame({"title": [advertise.get("title") for advertise in advertises],
+                          "detail": [advertise.get("detail") for advertise in advertises]}, dtype=object)
+    titles, details = frame["title"], frame["detail"]
+    title_len = titles.str.len().fillna(0)
+    detail_len = details.str.len().fillna(0)
+    has_detail = detail_len > 0
+
+    if invert:
+        long_input = has_detail & (title_len + detail_len > 200)
+        inputs = (details + " " + titles).where(has_detail, titles)
+        if long_input.any():
+            cut_details = pd.Series([detail[0:int(d_len - t_len)] for detail, d_len, t_len in
+                                     zip(details[long_input], detail_len[long_input], title_len[long_input])],
+                                    index=details[long_input].index, dtype=object)
+            inputs[long_input] = (cut_details + " " + titles[long_input]).str.slice(0, 200)
+    else:
+        inputs = (titles + " " + details).str.slice(0, 200).where(has_detail, titles)
+
+    return inputs.where(title_len > 0, None).tolist()
+
+
+def create_text_field_batch(advertises: List[Dict[str, Any]], field_name: str, invert: bool,
+                            text_process_pipeline=None) -> List[Dict[str, Any]]:
+    """
+    Batch version of @create_clean_text_field. Advertises that lack fields are dropped.
+    """
+    tmp_ads, txt_inputs = [], []
+    for advertise, txt_input in zip(advertises, build_model_input_batch(advertises, invert=invert)):
+        if txt_input is None:
+            sc.message("{}: Not enough fields in advertise!".format(advertise.get("id")))
+        else:
+            tmp_ads.append(advertise)
+            txt_inputs.append(txt_input)
+
+    if text_process_pipeline:
+        for process in text_process_pipeline:
+            txt_inputs = batch_process(txt_inputs, process)
+
+    for advertise, txt_input in zip(tmp_ads, txt_inputs):
+        advertise[field_name] = txt_input
+    return tmp_ads
+
+
+def create_clean_text_field_batch(advertises, text_process_pipeline=None):
+    return create_text_field_batch(to_advertise_list(advertises), "clean_text", False, text_process_pipeline)
+
+
+def create_clean_text_field_inverted_batch(advertises, text_process_pipeline=None):
+    return create_text_field_batch(to_advertise_list(advertises), "clean_text_invert", True, text_process_pipeline)
+
+
+def clean_base_advertise_batch(advertises, process_pipeline: Tuple[Callable] = None):
+    """
+    Batch version of @clean_base_advertise. Processes with a batch version (see BATCH_PROCESSES)
+    run once over the whole batch, the others record by record.
+    :param advertises: list or DataFrame of advertises
+    :param process_pipeline: per record processes (as configured for @clean_base_advertise)
+    :return: list of clean advertises
+    """
+    tmp_advertises = to_advertise_list(advertises)
+    if process_pipeline:
+        for process in process_pipeline:
+            tmp_advertises = batch_stage(process)(tmp_advertises)
+    return tmp_advertises
+
+
+def batch_stage(process: Callable) -> Callable:
+    """
+    Returns the batch version of a (maybe bound) per record process.
+    """
+    raw_process = getattr(process, "func", process)
+    raw_process = getattr(raw_process, "__wrapped__", raw_process)
+    if raw_process in BATCH_PROCESSES:
+        return functools.partial(BATCH_PROCESSES[raw_process], **getattr(process, "keywords", {}))
+
+    def stage(advertises):
+        return [advertise for advertise in map(process, advertises) if advertise is not None]
+    return stage
+
+
+BATCH_PROCESSES = {create_clean_text_field.__wrapped__: create_clean_text_field_batch,
+                   create_clean_text_field_inverted.__wrapped__: create_clean_text_field_inverted_batch}
@@ -1,5 +1,6 @@
 import os
 from collections import deque
+from itertools import islice
 from typing import List
 import gin
 import pipelines.utils as sc
@@ -42,6 +43,18 @@ def build_advertise_generator(files: List[str]):
     return None
 
 
+def build_advertise_batch_generator(files: List[str], batch_size: int):
+    """
+    Groups the advertises from @build_advertise_generator into lists of @batch_size.
+    """
+    generator = build_advertise_generator(files)
+    while True:
+        batch = list(islice(generator, batch_size))
+        if not batch:
+            return None
+        yield batch
+
+
 @gin.configurable(blacklist=["folder_path"])
 def get_file_paths(folder_path: str, market: str = None, category: str = None) -> List[str]:
     """
@@ -1,37 +1,86 @@
 import abc
+from itertools import islice
+from typing import List, Any, Dict, Tuple
 
 import gin
 import secrets
 
+from pipelines import utils as sc
+
+# Training dataset formats written by the sequence encoders
+OUTPUT_FORMATS = ("jsonl", "npy", "tfrecord")
+
+
+def build_dataset_writer(output_format: str, folder: str, fields: Dict[str, Tuple[str, Tuple[int, ...]]]):
+    """
+    Builds the binary dataset writer of an output format (None for jsonl, written by the encoder).
+    :param output_format: one of OUTPUT_FORMATS
+    :param folder: worker output folder
+    :param fields: {name: (dtype, row shape)} of the encoded arrays
+    :return: writer with write(**arrays) and close()
+    """
+    if output_format == "npy":
+        from pipelines.shards import NpyDataset
+        return NpyDataset(folder, fields)
+    if output_format == "tfrecord":
+        from pipelines.tfrecords import TFRecordShardWriter
+        return TFRecordShardWriter(folder, fields)
+    return None
+
+
 class BaseEncoder(object, metaclass=abc.ABCMeta):
+    # ML schema fields read by the encoder (None means every field is consumed)
+    schema_fields = None
 
     def __init__(self, debug=False):
         self.maps = None
         self.id: str = str(secrets.token_hex(nbytes=16))
         self.debug = debug
 
+    @staticmethod
+    def check_output_format(output_format: str) -> str:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("Unknown output format {0}! Known formats: {1}".format(output_format, OUTPUT_FORMATS))
+        return output_format
+
     @abc.abstractmethod
     def encode_advertise(self, advertise):
         raise NotImplementedError('User must define specific encoding method !')
 
+    def encode_batch(self, advertises: List[Any]) -> int:
+        """
+        Encodes a batch of advertises. Encoders with a vectorized path override it.
+        A failing advertise is skipped without dropping the rest of the batch.
+        :param advertises: list of clean advertises
+        :return: number of encoded advertises
+        """
+        encoded = 0
+        for advertise in advertises:
+            try:
+                self.encode_advertise(advertise)
+                encoded += 1
+            except Exception as err:
+                sc.message(err)
+        return encoded
+
     @gin.configurable
     def batch_encode_stream(self, advertise_generator, batch: int = None):
         if batch:
-            try:
-                batch_data = []
-                for data in advertise_generator:
-                    batch_data.append(self.encode_advertise(data))
-                    if len(batch_data) % batch:
-                        yield batch_data
-                        batch_data = []
-            except StopIteration:
-                return None
+            advertise_generator = iter(advertise_generator)
+            while True:
+                batch_data = list(islice(advertise_generator, batch))
+                if not batch_data:
+                    return None
+                yield self.encode_batch(batch_data)
         else:
-            try:
-                for data in advertise_generator:
-                    yield self.encode_advertise(data)
-            except StopIteration:
-                return None
+            for data in advertise_generator:
+                yield self.encode_advertise(data)
+
+    def cache_info(self) -> Dict[str, Any]:
+        """
+        Encoding cache stats reported by the pipeline drivers (empty for encoders without caches).
+        """
+        return dict()
 
     @abc.abstractmethod
     def save_encoded_data(self):
@@ -1,46 +1,54 @@
 import json
 import os
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Optional
 
 import gin
 
 from pipelines import utils as sc
 from pipelines.encoder import BaseEncoder
+from pipelines.sketches import TokenCounter, build_counter
+from pipelines.vocab_shards import VocabularyReducer, counts_path, write_counts_shard
+from pipelines.vocabulary import Vocabulary
 
 
 @gin.configurable
 class MappingEncoder(BaseEncoder):
-    def __init__(self, seq_max_len: int = 50, max_len_char: int = 10, model_folder: str = None):
+    schema_fields = ()
+
+    def __init__(self, seq_max_len: int = 50, max_len_char: int = 10, model_folder: str = None,
+                 sketch_size: Optional[int] = None):
         super().__init__()
         self.seq_max_len = seq_max_len
         self.max_len_char = max_len_char
         self.model_folder = sc.check_folder(os.path.join(model_folder, str(datetime.date(datetime.utcnow()))))
         self.model_folder = sc.check_folder(os.path.join(self.model_folder, self.id))
+        self.sketch_size = sketch_size
         self.preload_maps()
         self.advertise_counter = 0
 
     def encode_advertise(self, advertise):
-        char2idx = self.maps["char2idx"]
-        word2idx = self.maps["word2idx"]
+        char_counts = self.counts["char2idx"]
+        word_counts = self.counts["word2idx"]
 
         terms = advertise["clean_text"]
         tmp_seq = self.pad_term_sequence(self.tokenize_sentence(terms), max_len=self.seq_max_len)
 
-        word2idx = self.build_word_representations(tmp_seq, word2idx)
-        char2idx = self.build_char_representations(tmp_seq, char2idx)
+        self.build_word_representations(tmp_seq, word_counts)
+        self.build_char_representations(tmp_seq, char_counts)
 
-        # Update maps
-        self.maps["char2idx"] = char2idx
-        self.maps["word2idx"] = word2idx
         self.advertise_counter += 1
         sc.get_notice(self.advertise_counter, 5000, msg_text="ads processed!")
 
     def save_maps(self, *maps):
         sc.message("Saving Maps...")
         if self.model_folder:
-            for k, map in self.maps.items():
-                sc.save_dict_2json(os.path.join(self.model_folder, "{}.json".format(k)), map)
+            for k, counts in self.counts.items():
+                # Ids in first seen order (exact counts) and the token sorted counts merged by the reducer
+                vocabulary = Vocabulary.base(unk=k != "tag2idx")
+                vocabulary.update_from(token for token, _ in counts.items())
+                vocabulary.to_json(os.path.join(self.model_folder, "{}.json".format(k)))
+                write_counts_shard(counts_path(self.model_folder, k), counts.items())
         else:
             # TODO: implement saving in DataStorage
             raise NotImplementedError("Saving outside a local folder path is not implemented yet!")
@@ -61,41 +69,32 @@ class MappingEncoder(BaseEncoder):
             raise NotImplementedError("Saving outside a local folder path is not implemented yet!")
 
     def preload_maps(self, folder: str= None):
-        if not folder:
-            self.maps = {"char2idx": {"__PAD__": 0, "UNK": 1}, "word2idx": {"__PAD__": 0, "UNK": 1}}
-        else:
-            self.maps = {"char2idx": sc.load_pickle(os.path.join(folder, "char_dict.pckl")),
-                         "word2idx": sc.load_pickle(os.path.join(folder, "word_dict.pckl"))}
+        """
+        Token counters of each map (SpaceSaving sketches of sketch_size tokens if set).
+        Pickled maps from @folder seed the counters with zero counts, keeping their ids.
+        """
+        self.counts = {"char2idx": build_counter(self.sketch_size),
+                       "word2idx": build_counter(self.sketch_size)}
+        if folder:
+            self.counts["char2idx"].update(dict.fromkeys(sc.load_pickle(os.path.join(folder, "char_dict.pckl")), 0))
+            self.counts["word2idx"].update(dict.fromkeys(sc.load_pickle(os.path.join(folder, "word_dict.pckl")), 0))
 
     @staticmethod
     def tokenize_sentence(sentence: str):
         return sentence.split()
 
-    def build_char_representations(self, sentence: List[str], charidx: Dict[str, int]):
-        charidxer = charidx.copy()
-
+    def build_char_representations(self, sentence: List[str], char_counts: TokenCounter) -> TokenCounter:
         while '' in sentence:
             sentence.remove('')
 
-        for i in range(self.seq_max_len):
-            for j in range(self.max_len_char):
-                try:
-                    idx = charidxer.get(sentence[i][j])
-                    if not idx:
-                        charidxer[sentence[i][j]] = len(charidxer.keys()) + 1
-                except:
-                    pass
-
-        return charidxer
+        for word in sentence[:self.seq_max_len]:
+            char_counts.update(word[:self.max_len_char])
 
-    def build_word_representations(self, sentence: List[str], wordidx: Dict[str, int]):
-        wordidxer = wordidx.copy()
+        return char_counts
 
-        for w in sentence:
-            if w not in wordidxer.keys():
-                wordidxer[w] = len(wordidxer.keys()) + 1
-
-        return wordidxer
+    def build_word_representations(self, sentence: List[str], word_counts: TokenCounter) -> TokenCounter:
+        word_counts.update(sentence)
+        return word_counts
 
     @staticmethod
     def pad_term_sequence(sequence: List[str], max_len: int) -> List[str]:
@@ -113,3 +112,12 @@ class MappingEncoder(BaseEncoder):
                 padded_sequence.append("__PAD__")
 
         return padded_sequence
+
+
+@gin.configurable
+class MappingReducer(VocabularyReducer):
+
+    def __init__(self, main_folder: str, output_folder: str, debug: bool = False, min_count: int = 1,
+                 max_vocab: Optional[int] = None, binary_maps: bool = True):
+        super().__init__(main_folder, output_folder, "mapping", maps=("char2idx", "word2idx"),
+                         min_count=min_count, max_vocab=max_vocab, binary_maps=binary_maps, debug=debug)
@@ -0,0 +1,3 @@
+from pipelines.markets.registry import MarketParser, UNKNOWN_MARKET, register_market, get_market_parser, get_market_by_name, \
+    extra_fields
+from pipelines.markets import olx, mercadolivre, enjoei
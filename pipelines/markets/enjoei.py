@@ -0,0 +1,8 @@
+from pipelines.markets.registry import MarketParser, register_market
+
+
+@register_market
+class EnjoeiParser(MarketParser):
+    name = "Enjoei"
+    domains = ("enjoei.com.br", "enjoei.com")
+    url_keyword = "enjoei"
@@ -0,0 +1,237 @@
+import re
+from typing import List, Dict, Union, Any, Optional, Tuple
+
+from pipelines.markets.registry import MarketParser, register_market
+
+ML_FIELDS = ("post_category", "user_medals", "product_full_attributes",
+             "comments_html", "product_installment", "questions_text")
+
+SPACES_2_RGX = re.compile('[ \t]{2,}')
+SPACES_3_RGX = re.compile('[ \t]{3,}')
+BLANKS_2_RGX = re.compile('[ \t\n]{2,}')
+NON_DIGITS_RGX = re.compile(r"\D+")
+NON_WORD_RGX = re.compile(r'[^\w\s]')
+COMMENT_END_RGX = re.compile(r"de \d{4,}")  # matches 'de 2018' that signals the end of comment
+
+
+@register_market
+class MercadoLivreParser(MarketParser):
+    name = "MercadoLivre"
+    domains = ("mercadolivre.com.br",)
+    url_keyword = "mercadolivre"
+    extra_fields = ML_FIELDS
+
+    def __init__(self):
+        self.parsers = {"post_category": self.parse_post_category,
+                        "user_medals": self.parse_user_medals,
+                        "product_full_attributes": self.parse_product_full_attributes,
+                        "comments_html": self.parse_comments_html,
+                        "product_installment": self.parse_product_installment,
+                        "questions_text": self.parse_questions_text}
+
+    def parse_advertise(self, advertise: Dict[str, Any], fields: Tuple[str, ...] = ML_FIELDS) -> Dict[str, Any]:
+        """
+        Parses relevant fields from ML advertise in place.
+        :param advertise: ML advertise dict.
+        :param fields: ML fields to be parsed, the others are dropped
+        :return: (parsed) ML advertise dict.
+        """
+        for field in ML_FIELDS:
+            if field in advertise.keys():
+                if field in fields:
+                    advertise[field] = self.parsers[field](advertise)
+                else:
+                    advertise.pop(field)
+
+        return advertise
+
+    @staticmethod
+    def remove_noise_terms(terms: List[str], noise_terms: List[str]) -> List[str]:
+        """
+        Remove noise terms from terms list.
+        :param terms:
+        :param noise_terms:
+        :return:
+        """
+        if '' in terms:
+            terms.remove('')
+
+        cp_terms = terms.copy()
+        for term in cp_terms:
+            for noise in noise_terms:
+                if noise in term.lower():
+                    terms.remove(term)
+                    break
+
+        return terms
+
+    @staticmethod
+    def parse_post_category(advertise: Dict[str, Any]) -> Optional[List[str]]:
+        """
+        Parse 'post_category' field from ML advertise.
+        :param advertise: advertise dict from ML
+        :return: ['Celulares e Telefones', 'Celulares e Smartphones', 'iPhone', 'iPhone 8 Plus', '64GB']
+        """
+
+        noise_terms: List[str] = ["voltar"]
+
+        if "post_category" in advertise.keys():
+            tmp: List[str] = SPACES_2_RGX.split(advertise["post_category"])
+            tmp = MercadoLivreParser.remove_noise_terms(tmp, noise_terms)
+            return tmp
+
+    @staticmethod
+    def parse_user_medals(advertise: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Parse user medals field from ML advertise.
+        :param advertise: ML advertise dict
+        :return: None or {'reviews': 153, 'rank': 'mercadolider', 'customer_support': 1, 'good_delivery': 1,
+        'sell_freq': 121.75}
+        """
+        noise_terms: List[str] = ['ver mais dados', 'informação', 'vermelho', 'laranja', 'amarelo', 'verde']
+
+        if "user_medals" in advertise:
+            tmp_dict: Dict[str, Any] = {"reviews": None, "rank": None, "customer_support": None, "good_delivery": None}
+            tmp: List[str] = SPACES_2_RGX.split(advertise["user_medals"])
+
+            if str(tmp[0].strip()).isdigit() and "opini" in tmp[1]:
+                tmp_dict["reviews"]: int = int(tmp[0].strip())
+
+            tmp = MercadoLivreParser.remove_noise_terms(tmp, noise_terms)
+
+            for term in tmp:
+
+                if "vendas" in term.lower():  # Seller frequency per month
+                    seller_freq_term = term
+                    seller_freq_ls = NON_DIGITS_RGX.split(seller_freq_term)
+                    if '' in seller_freq_ls:
+                        seller_freq_ls.remove('')
+                    if len(seller_freq_ls) == 2 and seller_freq_ls[0].isdigit() and seller_freq_ls[1].isdigit():
+                        if "anos" in seller_freq_term:
+                            tmp_dict["sell_freq"] = int(seller_freq_ls[0]) / (int(seller_freq_ls[1]) * 12)
+                        else:
+                            tmp_dict["sell_freq"] = int(seller_freq_ls[0]) / int(seller_freq_ls[1])
+
+                if "MercadoLíder" in term:  # TODO: PROCESS BATCH OF FILES TO GET ALL CASES
+                    tmp_dict["rank"] = "mercadolider"
+
+                if "presta um bom atendimento" in term.lower():
+                    tmp_dict["customer_support"] = 1
+
+                if "entrega os produtos dentro" in term.lower():
+                    tmp_dict["good_delivery"] = 1
+
+            return tmp_dict
+
+    @staticmethod
+    def parse_product_full_attributes(advertise: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Parse 'product_full_attributes' from ML advertise.
+        :param advertise: ML advertise dict
+        :return: None or {"Marca": "LG", "Tipo de tela": "Plasma", "Tamanho da tela": "50 in"}
+        """
+        if "product_full_attributes" in advertise.keys():
+
+            tmp_dict: Dict[str, Any] = dict()
+            tmp: List[str] = SPACES_3_RGX.split(advertise["product_full_attributes"])
+
+            for term in tmp:
+                key_val: List[str] = SPACES_2_RGX.split(term)
+                if '' in key_val:
+                    key_val.remove('')
+                if len(key_val) == 2:
+                    tmp_dict[NON_WORD_RGX.sub('', key_val[0]).strip()] = key_val[1]
+
+            return tmp_dict
+
+    @staticmethod
+    def parse_comments_html(advertise: Dict[str, Any]) -> Optional[List[str]]:
+        """
+        Parse 'comments_html' field from ML advertise.
+        :param advertise: ML advertise dict
+        :return: List<str>
+        """
+        if "comments_html" in advertise.keys():
+
+            filtred_comments: str = advertise["comments_html"][200::]
+
+            tmp: List[str] = BLANKS_2_RGX.split(filtred_comments)
+            if '' in tmp:
+                tmp.remove('')
+
+            # Breaking comments
+            master: List[List[str]] = []
+            tmp_vec: List[str] = []
+            for line in tmp:
+
+                if COMMENT_END_RGX.search(line):
+                    master.append(tmp_vec)
+                    tmp_vec = []
+                else:
+                    tmp_vec.append(line)
+
+            # Cleaning comments
+            for comment in master:
+                if "..." in comment:
+                    comment.remove("...")
+                if "O usuário contratou o serviço em" in comment:
+                    comment.remove("O usuário contratou o serviço em")
+
+            return [" ".join(m) for m in master]
+
+    @staticmethod
+    def parse_product_installment(advertise: Dict[str, Any]) -> Optional[Dict[str, Union[float, int]]]:
+        """
+        Parses product installment field from ML ads.
+        :param advertise: dict(ad)
+        :return: {"price":333.2, "parcell": 12, "no_interest": 1}
+        """
+        if "product_installment" in advertise.keys():
+
+            tmp_dict = {"parcell": None, "price": None, "no_interest": None}
+            tmp: List[str] = SPACES_2_RGX.split(advertise["product_installment"])
+
+            for term in tmp:
+                if "x" in term:
+                    tmp_vec = term.split()
+                    if tmp_vec[0].isnumeric():
+                        tmp_dict["parcell"] = int(tmp_vec[0])
+                    continue
+                if "R$" in term:
+                    tmp_vec = term.split()
+                    if "R$" in tmp_vec:
+                        tmp_vec.remove("R$")
+                    if all([term.isnumeric() for term in tmp_vec]):
+                        tmp_dict["price"] = float(".".join(tmp_vec))
+                    continue
+                if "sem juros" in term:
+                    tmp_dict["no_interest"] = 1
+                    continue
+            return tmp_dict
+
+    @staticmethod
+    def parse_questions_text(advertise: Dict[str, Any]) -> Optional[List[str]]:
+        """
+        Parses 'questions_text' field from ML advertise.
+        :param advertise: ML advertise dict.
+        :return: List of string from questions/answers
+        """
+        if "questions_text" in advertise.keys():
+
+            tmp: List[str] = advertise["questions_text"].split("Denunciar")
+            excepts: List[str] = []
+
+            for part in tmp:
+
+                tmp_vec: List[str] = BLANKS_2_RGX.split(part)
+                if '' in tmp_vec:
+                    tmp_vec.remove('')
+
+                excepts.extend(tmp_vec)
+
+            excepts = set(excepts)
+
+            if '' in excepts:
+                excepts.remove('')
+
+            return list(excepts)
@@ -0,0 +1,36 @@
+import datetime
+import re
+from functools import lru_cache
+
+from pipelines.markets.registry import MarketParser, register_market, SOLR_DATE_FORMAT
+
+BR_MONTHS = {'Janeiro': 1, 'Fevereiro': 2, 'Março': 3, 'Abril': 4, 'Maio': 5, 'Junho': 6, 'Julho': 7,
+             'Agosto': 8, 'Setembro': 9, 'Outubro': 10, 'Novembro': 11, 'Dezembro': 12}
+
+DAY_MONTH_RGX = re.compile(r'([0-9]+).(' + str.join('|', BR_MONTHS.keys()) + ')')
+HOUR_MIN_RGX = re.compile(r"([0-9]+):([0-9]+)")
+
+
+@lru_cache(maxsize=4096)
+def parse_olx_date(datestr: str, year: int) -> str:
+    """
+    Parses OLX date field.
+    :param datestr: "Inserido em: 15 Março às 09:41"
+    :param year: year of the advertise (OLX omits it)
+    :return: (string) datetime UTC format
+    """
+    daymonth = DAY_MONTH_RGX.search(datestr)
+    hourmin = HOUR_MIN_RGX.search(datestr)
+    date = datetime.datetime(year, BR_MONTHS[daymonth.group(2)], int(daymonth.group(1)),
+                             hour=int(hourmin.group(1)), minute=int(hourmin.group(2)))
+    return date.strftime(SOLR_DATE_FORMAT)
+
+
+@register_market
+class OLXParser(MarketParser):
+    name = "OLX"
+    domains = ("olx.com.br",)
+    url_keyword = "olx"
+
+    def parse_date(self, datestr: str) -> str:
+        return parse_olx_date(datestr, datetime.datetime.utcnow().year)
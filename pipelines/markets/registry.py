@@ -0,0 +1,106 @@
+import datetime
+import logging
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple, List
+from urllib.parse import urlparse
+
+SOLR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+_MARKETS: List["MarketParser"] = []
+
+
+class MarketParser(object):
+    """
+    Base market plugin. Subclasses set the market @name, the url @domains they serve, the @url_keyword
+    matched anywhere in urls of other hosts and the @extra_fields they add to the general schema,
+    overriding @parse_date / @parse_advertise when needed.
+    """
+    name: str = None
+    domains: Tuple[str, ...] = ()
+    url_keyword: str = None
+    extra_fields: Tuple[str, ...] = ()
+
+    def parse_date(self, datestr: str) -> str:
+        raise ValueError("Market parser not found! Please set a date parser for maket {}.".format(self.name))
+
+    def parse_advertise(self, advertise: Dict[str, Any], fields: Tuple[str, ...]) -> Dict[str, Any]:
+        """
+        Parses market specific @fields from raw advertise, updating it in place.
+        :param advertise: raw advertise dict
+        :param fields: extra fields to be parsed
+        :return: advertise dict
+        """
+        return advertise
+
+    def date(self, datestr: str) -> str:
+        """
+        Parses datetime scrap field to solr datetime, using UTC NOW when it cannot be parsed.
+        :param datestr: (string) datetime string field
+        :return: (string) datetime UTC format
+        """
+        try:
+            return self.parse_date(datestr)
+        except (ValueError, AttributeError, KeyError, TypeError) as err:
+            logging.debug("Could not parse date for {0} .Using UTC NOW... Error:{1}".format(self.name, str(err)))
+            return datetime.datetime.utcnow().strftime(SOLR_DATE_FORMAT)
+
+
+UNKNOWN_MARKET = MarketParser()
+
+
+def register_market(cls):
+    """
+    Class decorator that registers a market plugin.
+    """
+    _MARKETS.append(cls())
+    get_market_by_host.cache_clear()
+    return cls
+
+
+@lru_cache(maxsize=1024)
+def get_market_by_host(host: str) -> Optional[MarketParser]:
+    for market in _MARKETS:
+        if any(host == domain or host.endswith("." + domain) for domain in market.domains):
+            return market
+    return None
+
+
+def get_market_by_keyword(url: str) -> Optional[MarketParser]:
+    """
+    Substring dispatch (i.e. 'olx' in url), for hosts missing from the market domains
+    (regional, mobile or mirror hosts). Markets are tried in registration order.
+    """
+    for market in _MARKETS:
+        if market.url_keyword and market.url_keyword in url:
+            return market
+    return None
+
+
+def get_market_parser(url: str) -> Optional[MarketParser]:
+    """
+    Dispatches the market plugin by the advertise url host, falling back to the url keywords.
+    :param url: advertise url
+    :return: MarketParser or None for unknown markets
+    """
+    host = urlparse(url).hostname
+    market = get_market_by_host(host) if host else None
+    if market is None:
+        market = get_market_by_keyword(url)
+    return market
+
+
+def get_market_by_name(name: str) -> Optional[MarketParser]:
+    for market in _MARKETS:
+        if market.name == name:
+            return market
+    return None
+
+
+def extra_fields() -> Tuple[str, ...]:
+    """
+    All extra schema fields the registered markets can produce.
+    """
+    fields = []
+    for market in _MARKETS:
+        fields.extend(field for field in market.extra_fields if field not in fields)
+    return tuple(fields)
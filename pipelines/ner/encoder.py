@@ -1,102 +1,225 @@
 import json
 import os
 from datetime import datetime
-from shutil import copy
-from typing import List, Dict
+from glob import glob
+from shutil import copy, copyfileobj
+from typing import List, Tuple, Dict, Any, Optional
 
 import gin
-from keras.preprocessing.sequence import pad_sequences
+import numpy as np
 
 from pipelines import utils as sc
-from pipelines.encoder import BaseEncoder
+from pipelines.encoder import BaseEncoder, build_dataset_writer
+from pipelines.sinks import AsyncLineSink
 from pipelines.reducer import Reducer
+from pipelines.shards import shard_fields, shard_path, concatenate_shards
+from pipelines.vocabulary import Vocabulary, HashedVocabulary, WordCache, PAD_TOKEN, encode_word_batch, \
+    encode_char_batch, load_vocabulary
 
 
 @gin.configurable
 class NEREncoder(BaseEncoder):
+    """
+    Encodes NER sequences with the word/char/tag maps of a mapping pass (maps_folder), or in a single
+    pass with hashed word/char ids when hash_buckets is set (tag ids then come from tags or maps_folder).
+    """
+    schema_fields = ()
+
     def __init__(self, seq_max_len: int = 50, max_len_char: int = 10,
                  model_folder: str = None, maps_folder: str = None,
-                 update_maps: bool = False, debug: bool = True):
+                 update_maps: bool = False, debug: bool = True, output_format: str = "jsonl",
+                 word_cache_size: int = 1 << 20, hash_buckets: Optional[int] = None, char_hash_buckets: int = 1024,
+                 tags: Optional[Tuple[str, ...]] = None, collision_report: bool = False,
+                 test_perc: Optional[float] = 0.05):
         super().__init__()
         self.seq_max_len = seq_max_len
         self.max_len_char = max_len_char
         self.model_folder = sc.check_folder(os.path.join(model_folder, str(datetime.date(datetime.utcnow()))))
         self.model_folder = sc.check_folder(os.path.join(self.model_folder, self.id))
+        self.update_maps = update_maps
+        self.hash_buckets = hash_buckets
+        self.char_hash_buckets = char_hash_buckets
+        self.tags = tags
+        self.collision_report = collision_report
         self.preload_maps(maps_folder)
+        self.word_cache = None
+        if word_cache_size:
+            self.word_cache = WordCache(self.maps["word2idx"], self.maps["char2idx"], max_len_char, word_cache_size)
         self.advertise_counter = 0
         self.processed_counter = 0
-        self.update_maps = update_maps
         self.debug = debug
+        self.output_format = self.check_output_format(output_format)
+        # Train/test split at write time (train/ and test/ worker folders), decided by hash_split of the ad id
+        self.test_perc = test_perc
+        if test_perc:
+            self.outputs = {split: self.build_output(sc.check_folder(os.path.join(self.model_folder, split)))
+                            for split in ("train", "test")}
+        else:
+            self.outputs = {None: self.build_output(self.model_folder)}
 
-    def encode_advertise(self, advertise):
-        x_char, x_word, y_tag = [], [], []
-        char2idx = self.maps["char2idx"]
-        word2idx = self.maps["word2idx"]
-        tag2idx = self.maps["tag2idx"]
+    def build_output(self, folder: str):
+        """
+        Dataset writer of @folder: binary shards, or an async jsonl sink for the jsonl format.
+        :return: (shards, sink)
+        """
+        shards = build_dataset_writer(self.output_format, folder,
+                                      {"x_word": ("int32", (self.seq_max_len,)),
+                                       "x_char": ("int32", (self.seq_max_len, self.max_len_char)),
+                                       "y_tag": ("int32", (self.seq_max_len,))})
+        sink = AsyncLineSink(os.path.join(folder, "dataset.jsonl")) if shards is None else None
+        return shards, sink
 
-        terms = advertise["NER"]
-        terms_words = [token[0] for token in terms]
-        terms_tags = [token[1] for token in terms]
+    def is_test(self, advertise) -> bool:
+        key = advertise.get("id") or json.dumps(advertise["NER"])
+        return sc.hash_split(str(key), self.test_perc)
 
-        tmp_seq_words = self.pad_term_sequence(terms_words, max_len=self.seq_max_len)
-        tmp_seq_tags = self.pad_term_sequence(terms_tags, max_len=self.seq_max_len)
+    def encode_advertise(self, advertise):
+        tmp_seq_words, tmp_seq_tags = self.build_sequences(advertise)
+        x_word, x_char, y_tag = self.encode_sequences([tmp_seq_words], [tmp_seq_tags])
+        if self.test_perc:
+            self.save_encoded_data(x_word, x_char, y_tag, np.array([self.is_test(advertise)]))
+        else:
+            self.save_encoded_data(x_word, x_char, y_tag)
 
-        w_rep, word2idx = self.build_word_representations(tmp_seq_words, word2idx)
-        t_rep, tag2idx = self.build_word_representations(tmp_seq_tags, tag2idx)
+        self.advertise_counter += 1
+        sc.get_notice(self.advertise_counter, 5000, msg_text="ads processed!")
 
-        x_word.append(pad_sequences(maxlen=self.seq_max_len, sequences=[w_rep], value=word2idx["__PAD__"],
-                                    padding='post', truncating='post').tolist())
-        y_tag.append(pad_sequences(maxlen=self.seq_max_len, sequences=[t_rep], value=tag2idx["__PAD__"],
-                                   padding='post', truncating='post').tolist())
+    def encode_batch(self, advertises: List[Dict[str, Any]]) -> int:
+        """
+        Vectorized encoding of a batch of advertises (single kernel call and dataset write).
+        Falls back to record by record encoding if the batch fails (i.e. unknown tag with frozen maps).
+        :param advertises: list of clean advertises
+        :return: number of encoded advertises
+        """
+        word_sequences, tag_sequences, batch = [], [], []
+        for advertise in advertises:
+            try:
+                tmp_seq_words, tmp_seq_tags = self.build_sequences(advertise)
+            except Exception as err:
+                sc.message(err)
+                continue
+            word_sequences.append(tmp_seq_words)
+            tag_sequences.append(tmp_seq_tags)
+            batch.append(advertise)
+
+        if not batch:
+            return 0
+        try:
+            x_word, x_char, y_tag = self.encode_sequences(word_sequences, tag_sequences)
+        except Exception as err:
+            sc.message("Batch encoding failed ({}), encoding record by record...".format(err))
+            return super().encode_batch(batch)
+        if self.test_perc:
+            self.save_encoded_data(x_word, x_char, y_tag, np.array([self.is_test(advertise) for advertise in batch]))
+        else:
+            self.save_encoded_data(x_word, x_char, y_tag)
 
-        representation, char2idx = self.build_char_representations(tmp_seq_words, char2idx)
-        x_char.append(representation)
+        self.advertise_counter += len(batch)
+        sc.get_notice_step(self.advertise_counter - len(batch), self.advertise_counter, 5000, msg_text="ads processed!")
+        return len(batch)
 
-        self.save_encoded_data(x_word, x_char, y_tag)
+    def build_sequences(self, advertise) -> Tuple[List[str], List[str]]:
+        """
+        Padded word and tag sequences of an advertise NER field.
+        """
+        terms = advertise["NER"]
+        tmp_seq_words = self.pad_term_sequence([token[0] for token in terms], max_len=self.seq_max_len)
+        tmp_seq_tags = self.pad_term_sequence([token[1] for token in terms], max_len=self.seq_max_len)
+        return tmp_seq_words, tmp_seq_tags
 
-        # Update maps
-        if self.update_maps:
-            self.maps["char2idx"] = char2idx
-            self.maps["word2idx"] = word2idx
-            self.maps["tag2idx"] = tag2idx
+    def encode_sequences(self, word_sequences: List[List[str]],
+                         tag_sequences: List[List[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Encodes padded word/tag sequences with the encoder maps.
+        :param word_sequences: pad_term_sequence outputs of words
+        :param tag_sequences: pad_term_sequence outputs of tags
+        :return: x_word, x_char and y_tag int32 arrays
+        """
+        if self.word_cache:
+            x_word, x_char = self.word_cache.encode_batch(word_sequences, self.seq_max_len)
+        else:
+            x_word = encode_word_batch(word_sequences, self.maps["word2idx"], self.seq_max_len)
+            x_char = encode_char_batch(word_sequences, self.maps["char2idx"], self.seq_max_len, self.max_len_char)
+        y_tag = encode_word_batch(tag_sequences, self.maps["tag2idx"], self.seq_max_len)
+        return x_word, x_char, y_tag
 
-        self.advertise_counter += 1
-        sc.get_notice(self.advertise_counter, 5000, msg_text="ads processed!")
+    def cache_info(self) -> Dict[str, Any]:
+        return {"word_cache": self.word_cache.cache_info()} if self.word_cache else dict()
 
     def save_maps(self, *maps):
+        for shards, sink in self.outputs.values():
+            if shards:
+                shards.close()
+            if sink:
+                sink.close()
         sc.message("Saving Maps...")
         if self.model_folder:
             for k, map in self.maps.items():
+                if isinstance(map, HashedVocabulary):
+                    map.to_json(os.path.join(self.model_folder, "{}.hashing.json".format(k)))
+                    report = map.collision_report()
+                    if report:
+                        sc.message("{0} collisions: {1}".format(k, report))
+                        sc.save_dict_2json(os.path.join(self.model_folder, "{}.collisions.json".format(k)), report)
+                    continue
                 # TODO: may get too big, write as txt
-                sc.save_dict_2json(os.path.join(self.model_folder, "{}.json".format(k)), map)
+                map.to_json(os.path.join(self.model_folder, "{}.json".format(k)))
         else:
             # TODO: implement saving in DataStorage
             raise NotImplementedError("Saving outside a local folder path is not implemented yet!")
 
     def save_encoded_data(self, *data):
-        if self.model_folder:
-            dataset_name = "dataset.jsonl"
-            dataset_path = os.path.join(self.model_folder, dataset_name)
-
-            with open(dataset_path, "a", encoding="utf-8") as js:
-                x_word, x_char, y_price = data
-                for word, char, price in zip(x_word, x_char, y_price):
-                    js.write(json.dumps({"x_word": word, "x_char": char, "y_tag": price}) + "\n")
-                    self.processed_counter += 1
-                    sc.get_notice(self.processed_counter, msg_text="training obs processed!")
+        """
+        Writes encoded rows (x_word, x_char, y_tag). With test_perc, a 4th test mask sends rows to the test output.
+        """
+        x_word, x_char, y_tag = data[:3]
+        previous = self.processed_counter
+        if self.test_perc:
+            test_mask = data[3]
+            for split, rows in (("train", ~test_mask), ("test", test_mask)):
+                if rows.any():
+                    self.write_rows(self.outputs[split], x_word[rows], x_char[rows], y_tag[rows])
         else:
-            # TODO: implement saving in DataStorage
-            raise NotImplementedError("Saving outside a local folder path is not implemented yet!")
+            self.write_rows(self.outputs[None], x_word, x_char, y_tag)
+        sc.get_notice_step(previous, self.processed_counter, msg_text="training obs processed!")
+
+    def write_rows(self, output, x_word: np.ndarray, x_char: np.ndarray, y_tag: np.ndarray):
+        shards, sink = output
+        if shards:
+            self.processed_counter += shards.write(x_word=x_word, x_char=x_char, y_tag=y_tag)
+        else:
+            # x_word/y_tag rows keep the [[...]] nesting of the former keras pad_sequences output
+            for word, char, tag in zip(x_word.tolist(), x_char.tolist(), y_tag.tolist()):
+                sink.write(json.dumps({"x_word": [word], "x_char": char, "y_tag": [tag]}) + "\n")
+                self.processed_counter += 1
 
     def preload_maps(self, folder: str= None):
-        if not folder:
-            self.maps = {"char2idx": {"__PAD__": 0, "UNK": 1},
-                         "word2idx": {"__PAD__": 0, "UNK": 1},
-                         "tag2idx": {"__PAD__": 0}}
+        frozen = not self.update_maps
+        if self.hash_buckets:
+            self.maps = {"char2idx": HashedVocabulary(self.char_hash_buckets, track_collisions=self.collision_report),
+                         "word2idx": HashedVocabulary(self.hash_buckets, track_collisions=self.collision_report),
+                         "tag2idx": self.build_tag_map(folder)}
+        elif not folder:
+            self.maps = {"char2idx": Vocabulary.base(frozen=frozen),
+                         "word2idx": Vocabulary.base(frozen=frozen),
+                         "tag2idx": Vocabulary.base(unk=False, frozen=frozen)}
         else:
-            self.maps = {"char2idx": sc.load_json(os.path.join(folder, "char2idx.json")),
-                         "word2idx": sc.load_json(os.path.join(folder, "word2idx.json")),
-                         "tag2idx": sc.load_json(os.path.join(folder, "tag2idx.json")),}
+            self.maps = {"char2idx": load_vocabulary(folder, "char2idx", frozen=frozen),
+                         "word2idx": load_vocabulary(folder, "word2idx", frozen=frozen),
+                         "tag2idx": load_vocabulary(folder, "tag2idx", frozen=frozen)}
+
+    def build_tag_map(self, folder: str = None) -> Vocabulary:
+        """
+        Frozen tag map of the hashed mode, identical in every worker: {__PAD__: 0} followed by the
+        configured tags, or the tag2idx map of @folder.
+        """
+        if self.tags:
+            tag_map = {PAD_TOKEN: 0}
+            tag_map.update((tag, idx) for idx, tag in enumerate(self.tags, start=1))
+            return Vocabulary(tag_map, frozen=True)
+        if folder:
+            return load_vocabulary(folder, "tag2idx", frozen=True)
+        raise ValueError("Hashed encoding needs NEREncoder.tags or a maps_folder with tag2idx!")
 
     @staticmethod
     def tokenize_sentence(sentence: str):
@@ -119,53 +242,18 @@ class NEREncoder(BaseEncoder):
 
         return padded_sequence
 
-    def build_char_representations(self, sentence: List[str], charidx: Dict[str, int]):
-        charidxer = charidx.copy()
-
-        while '' in sentence:
-            sentence.remove('')
-
-        sent_seq = []
-        for i in range(self.seq_max_len):
-            word_seq = []
-            for j in range(self.max_len_char):
-                try:
-                    idx = charidxer.get(sentence[i][j])
-                    if idx:
-                        word_seq.append(idx)
-                    else:
-                        if self.update_maps:
-                            charidxer[sentence[i][j]] = len(charidxer.keys()) + 1
-                            word_seq.append(charidxer.get(sentence[i][j]))
-                        else:
-                            word_seq.append(charidxer.get("UNK"))
-                except:
-                    word_seq.append(charidxer.get("__PAD__"))
-            sent_seq.append(word_seq)
-
-        return sent_seq, charidxer
-
-    def build_word_representations(self, sentence: List[str], wordidx: Dict[str, int]):
-        wordidxer = wordidx.copy()
-        sentence_w = []
-
-        for w in sentence:
-            if w in wordidxer.keys():
-                sentence_w.append(wordidxer[w])
-            else:
-                if self.update_maps:
-                    wordidxer[w] = len(wordidxer.keys()) + 1
-                    sentence_w.append(wordidxer[w])
-                else:
-                    sentence_w.append(wordidxer["UNK"])
-
-        return sentence_w, wordidxer
 
 @gin.configurable
 class NERReducer(Reducer):
-    def __init__(self, main_folder: str, output_folder: str, test_perc: float = 0.05):
+    """
+    Gathers the workers' train/ and test/ datasets, split at write time by NEREncoder.test_perc
+    (stable hash of the ad id, the same split for every output format), into the train/test folders.
+    Unsplit worker datasets (written without test_perc) cannot be reduced: the encoded rows no longer
+    carry the ad id the split is decided by, so they have to be encoded again with test_perc.
+    """
+
+    def __init__(self, main_folder: str, output_folder: str):
         super().__init__(main_folder, output_folder)
-        self.test_perc = test_perc
 
     def reduce_process(self):
         workers_folder = [os.path.join(self.main_folder, folder) for folder in os.listdir(self.main_folder)]
@@ -173,31 +261,46 @@ class NERReducer(Reducer):
         sc.message("Processing files")
         print(workers_folder)
 
+        if not all(os.path.isdir(os.path.join(folder, "train")) for folder in workers_folder):
+            raise ValueError("Workers wrote unsplit datasets! Set NEREncoder.test_perc to split them at write time.")
+
         reduced_folder = sc.check_folder(os.path.join(self.output_folder, "ner_encoded"))
         train_folder = sc.check_folder(os.path.join(reduced_folder, "train"))
         test_folder = sc.check_folder(os.path.join(reduced_folder, "test"))
-        total_ads = 0
-
-        # Count lines
-        for dataset_folder in workers_folder:
-            for line in open(os.path.join(dataset_folder, "dataset.jsonl"), "r", encoding="utf-8"):
-                total_ads += 1
 
-        test_size = int(total_ads * self.test_perc)
-        train_size = total_ads - test_size
-        total_ads = 0
-
-        # Save train/test set
-        for dataset_folder in workers_folder:
-            for line in open(os.path.join(dataset_folder, "dataset.jsonl"), "r", encoding="utf-8"):
-                save_folder = train_folder if total_ads < train_size else test_folder
-                with open(os.path.join(save_folder, "dataset.jsonl"), "a", encoding="utf-8") as js:
-                    js.write(line)
-                    total_ads += 1
+        for split, save_folder in (("train", train_folder), ("test", test_folder)):
+            self.merge_split([os.path.join(folder, split) for folder in workers_folder], save_folder)
 
         # Copy maps
-        maps_path = [os.path.join(workers_folder[0], file_name) for file_name in os.listdir(workers_folder[0]) if "dataset" not in file_name]
+        maps_path = [os.path.join(workers_folder[0], file_name) for file_name in os.listdir(workers_folder[0])
+                     if "dataset" not in file_name and not file_name.endswith((".npy", ".tfrecord"))]
+        maps_path = [path for path in maps_path if os.path.isfile(path)]
         for map in maps_path:
             copy(map, reduced_folder)
 
         sc.message("DONE! Save @{}".format(reduced_folder))
+
+    def merge_split(self, split_folders: List[str], save_folder: str):
+        """
+        Concatenates the workers' outputs of a split made at write time (no decoding).
+        The output format is detected over every worker, and workers without files for the split are
+        skipped: a split may have no rows in a worker, and TFRecord shards are only created on write.
+        """
+        npy_folders = [folder for folder in split_folders if shard_fields(folder)]
+        tfrecord_folders = [folder for folder in split_folders if glob(os.path.join(folder, "*.tfrecord"))]
+        jsonl_folders = [folder for folder in split_folders if os.path.isfile(os.path.join(folder, "dataset.jsonl"))]
+        if npy_folders:
+            for field in shard_fields(npy_folders[0]):
+                concatenate_shards([shard_path(folder, field) for folder in npy_folders], shard_path(save_folder, field))
+        elif tfrecord_folders:
+            for folder in tfrecord_folders:
+                worker_id = os.path.basename(os.path.dirname(folder))
+                for path in sorted(glob(os.path.join(folder, "*.tfrecord"))):
+                    copy(path, os.path.join(save_folder, "{0}-{1}".format(worker_id, os.path.basename(path))))
+        elif jsonl_folders:
+            with open(os.path.join(save_folder, "dataset.jsonl"), "ab") as js:
+                for folder in jsonl_folders:
+                    with open(os.path.join(folder, "dataset.jsonl"), "rb") as worker_js:
+                        copyfileobj(worker_js, js)
+        else:
+            sc.message("No rows to merge into {}".format(save_folder))
@@ -1,23 +1,32 @@
 import json
 import os
 import re
+from collections import Counter
 from datetime import datetime
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, Set, Optional
 
 import gin
 import numpy as np
 
 from pipelines import utils as sc
 from pipelines.encoder import BaseEncoder
+from pipelines.sketches import TokenCounter, build_counter
 from pipelines.text_processors import clean_text
 from pipelines.reducer import Reducer
 
 @gin.configurable
 class SchemaEncoder(BaseEncoder):
-    def __init__(self, model_folder: str = None, debug: bool = False):
+    """
+    Counts the values of each product attribute (value -> count per property, bounded by a SpaceSaving
+    sketch of sketch_size values when set) and the number of ads having each property.
+    """
+    schema_fields = ("product_full_attributes",)
+
+    def __init__(self, model_folder: str = None, debug: bool = False, sketch_size: Optional[int] = None):
         super().__init__()
         self.model_folder = sc.check_folder(os.path.join(model_folder, str(datetime.date(datetime.utcnow()))))
         self.model_folder = sc.check_folder(os.path.join(self.model_folder, self.id))
+        self.sketch_size = sketch_size
         self.preload_maps()
         self.advertise_counter = 0
         self.debug = debug
@@ -30,8 +39,9 @@ class SchemaEncoder(BaseEncoder):
     def save_maps(self, *maps):
         sc.message("Saving Maps...")
         if self.model_folder:
-            for k, map in self.maps.items():
-                sc.save_dict_2json(os.path.join(self.model_folder, "{}.json".format(k)), map)
+            schema_counts = {prop: dict(counts.items()) for prop, counts in self.maps["schema_counts"].items()}
+            sc.save_dict_2json(os.path.join(self.model_folder, "schema_counts.json"), schema_counts)
+            sc.save_dict_2json(os.path.join(self.model_folder, "schema_counter.json"), self.maps["schema_counter"])
         else:
             # TODO: implement saving in DataStorage
             raise NotImplementedError("Saving outside a local folder path is not implemented yet!")
@@ -44,32 +54,34 @@ class SchemaEncoder(BaseEncoder):
 
     def preload_maps(self, folder: str= None):
         if not folder:
-            self.maps = {"general_schema": dict(), "schema_counter": dict()}
+            self.maps = {"schema_counts": dict(), "schema_counter": dict()}
         else:
             raise NotImplementedError("Cannot load preloaded schemas...")
 
     def update_schema_dist(self, advertise):
-        general_schema = self.maps["general_schema"]
-        schema_counter = self.maps["schema_counter"]
+        schema_counts: Dict[str, TokenCounter] = self.maps["schema_counts"]
+        schema_counter: Dict[str, int] = self.maps["schema_counter"]
 
         if "product_full_attributes" in advertise.keys():
-            for prop in advertise["product_full_attributes"].keys():
-                if prop in general_schema.keys():
-                    general_schema[prop].append(advertise["product_full_attributes"][prop])
-                    schema_counter[prop] += 1
-                else:
-                    general_schema[prop] = [advertise["product_full_attributes"][prop]]
-                    schema_counter[prop] = 1
-
-        self.maps["general_schema"] = general_schema
-        self.maps["schema_counter"] = schema_counter
+            for prop, value in advertise["product_full_attributes"].items():
+                if prop not in schema_counts:
+                    schema_counts[prop] = build_counter(self.sketch_size)
+                    schema_counter[prop] = 0
+                schema_counts[prop].update((value,))
+                schema_counter[prop] += 1
 
 
 @gin.configurable
 class SchemaReducer(Reducer):
-    def __init__(self, main_folder: str, output_folder: str, debug: bool=False):
+    """
+    Merges the workers' value -> count maps of each property (bounded by a SpaceSaving sketch of
+    sketch_size values when set), so memory does not grow with the number of attribute occurrences.
+    """
+
+    def __init__(self, main_folder: str, output_folder: str, debug: bool=False, sketch_size: Optional[int] = None):
         super().__init__(main_folder, output_folder, debug)
-        self.unified_general = dict()
+        self.sketch_size = sketch_size
+        self.unified_general: Dict[str, TokenCounter] = dict()
         self.unified_counter = dict()
         self.general_counter = dict()
         self.reg_rules = [re.compile(r'[^\w\s]'), re.compile('\([^)]*\)')]
@@ -78,14 +90,13 @@ class SchemaReducer(Reducer):
         workers_folder = [os.path.join(self.main_folder, folder) for folder in os.listdir(self.main_folder)]
 
         for folder in workers_folder:
-            g_schema = sc.load_json(os.path.join(folder, "general_schema.json"))
+            g_schema = self.load_schema_counts(folder)
             c_schema = sc.load_json(os.path.join(folder, "schema_counter.json"))
 
-            for k,v in g_schema.items():
-                if k in self.unified_general.keys():
-                    self.unified_general[k].extend(v)
-                else:
-                    self.unified_general[k] = v
+            for k, counts in g_schema.items():
+                if k not in self.unified_general:
+                    self.unified_general[k] = build_counter(self.sketch_size)
+                self.unified_general[k].update(counts)
 
             for k,v in c_schema.items():
                 self.unified_counter[k] = self.unified_counter[k] + v if k in self.unified_counter.keys() else v
@@ -94,23 +105,23 @@ class SchemaReducer(Reducer):
         self.get_general_dist()
         self.save_ner_schema()
 
+    @staticmethod
+    def load_schema_counts(folder: str) -> Dict[str, Dict[str, int]]:
+        """
+        Value -> count maps of a worker. Folders written before counts were kept have the raw
+        value lists of general_schema.json instead.
+        """
+        counts_file = os.path.join(folder, "schema_counts.json")
+        if os.path.exists(counts_file):
+            return sc.load_json(counts_file)
+        return {k: Counter(values) for k, values in sc.load_json(os.path.join(folder, "general_schema.json")).items()}
 
     def get_general_dist(self):
         """
-        To be executed after full general_schema is built.
+        To be executed after the workers' counts are merged.
         :return:
         """
-        general_counter = dict()
-        for k, lsval in self.unified_general.items():
-            counter = dict()
-            for val in lsval:
-                if val in counter.keys():
-                    counter[val] += 1
-                else:
-                    counter[val] = 1
-            general_counter[k] = counter
-
-        self.general_counter = general_counter
+        self.general_counter = {k: dict(counts.items()) for k, counts in self.unified_general.items()}
 
 
     def cutoff_schema(self, schema_counter: Dict[str, int], ctoff: int) -> List[str]:
@@ -160,8 +171,9 @@ class SchemaReducer(Reducer):
         :param tol_percentile: percentile to cut-off
         :return: set of tags
         """
-        if len(list(tags_distribution.values())) > 100:
-            top_percentile = np.percentile(list(tags_distribution.values()), tol_percentile)
+        counts = list(tags_distribution.values())
+        if len(counts) > 100:
+            top_percentile = np.percentile(counts, tol_percentile)
             return {k for k, v in tags_distribution.items() if v > top_percentile}
         else:
             return {k for k, v in tags_distribution.items()}
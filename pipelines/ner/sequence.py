@@ -1,9 +1,11 @@
 
 from pipelines.encoder import BaseEncoder
+from pipelines.phrases import AhoCorasick, leftmost_longest, mark_spans
 from pipelines.reducer import Reducer
+from pipelines.sinks import AsyncLineSink
 import os
 import re
-from typing import Dict,Set, Optional,List, Any
+from typing import Dict,Set, Optional,List, Any, Tuple, Union
 import pipelines.utils as sc
 import random
 from datetime import datetime
@@ -12,16 +14,139 @@ import gin
 from pprint import pprint
 
 
+class MeasureRules(object):
+    """
+    Legacy measure property rules (SequenceEncoder.legacy_measure_rules), as the schema used to build them:
+    " {value} {unit} " or " {value}+{unit} " for every value x unit of the property (values and units are used
+    as regexes, so " 644gb " matches 64 gb). A term is tagged once per matching rule. The rules are combined in
+    a single precompiled alternation and only run one by one for the (few) terms it matches.
+    """
+
+    def __init__(self, units: Set[str], values: Set[str]):
+        self.units = sorted(units)
+        self.rules = [re.compile("( {1} {0} )|( {1}+{0} )".format(unit, value))
+                      for unit in self.units for value in sorted(values)]
+        self.regex = re.compile("|".join("(?:{})".format(rule.pattern) for rule in self.rules)) if self.rules else None
+
+    def count(self, term: str) -> int:
+        if self.regex is None or not self.regex.fullmatch(term):
+            return 0
+        return sum(1 for rule in self.rules if rule.fullmatch(term))
+
+    def __repr__(self):
+        return "MeasureRules({0}, {1} rules)".format(self.units, len(self.rules))
+
+
+class MeasureGrammar(object):
+    """
+    Measure property grammar (the default): " {number} {unit} " or " {number}{unit} " with the property units,
+    and the number optionally restricted to a whitelist checked after the match. A single compiled regex
+    per property, whatever the number of distinct values of the schema. A term is tagged once.
+    """
+
+    def __init__(self, units: Set[str], numbers: Optional[Set[str]] = None):
+        # Longest units first, so a unit is never cut by one of its prefixes
+        self.units = sorted(units, key=lambda unit: (-len(unit), unit))
+        self.numbers = numbers
+        self.regex = re.compile(r" (\d+) ?(?:{}) ".format("|".join(re.escape(unit) for unit in self.units)))
+
+    def accepts(self, match) -> bool:
+        return self.numbers is None or match.group(1) in self.numbers
+
+    def count(self, term: str) -> int:
+        match = self.regex.fullmatch(term)
+        return int(bool(match) and self.accepts(match))
+
+    def __repr__(self):
+        return "MeasureGrammar({0}, {1} numbers)".format(self.units, "any" if self.numbers is None else len(self.numbers))
+
+
+Measure = Union[MeasureRules, MeasureGrammar]
+
+
+class TermTagger(object):
+    """
+    SequenceEncoder tagging rules compiled once: a term -> tags hash index of the non measure values
+    and one Measure (MeasureRules or MeasureGrammar) per measure tag, prefiltered by their combined regex.
+    Tags of a term follow measure_map order (each tag Measure.count times), then non_measure_map order.
+    Measure terms come from measure_spans, without their trailing space.
+    """
+
+    def __init__(self, measure_map: Dict[str, Measure], non_measure_map: Dict[str, List[str]],
+                 cache_size: int = 1 << 16):
+        self.measure_map = {tag: measure for tag, measure in measure_map.items() if measure.regex is not None}
+        patterns = ["(?:{})".format(measure.regex.pattern) for measure in self.measure_map.values()]
+        self.any_measure = re.compile("|".join(patterns)) if patterns else None
+
+        self.term_index: Dict[str, Tuple[str, ...]] = dict()
+        for tag, terms in non_measure_map.items():
+            for term in set(terms):
+                self.term_index[term] = self.term_index.get(term, ()) + (tag,)
+
+        self.cache: Dict[str, Tuple[str, ...]] = dict()
+        self.cache_size = cache_size
+
+    def tags(self, term: str) -> Tuple[str, ...]:
+        try:
+            return self.cache[term]
+        except KeyError:
+            pass
+
+        tags: Tuple[str, ...] = ()
+        measure_term = term + " "
+        if self.any_measure and self.any_measure.fullmatch(measure_term):
+            for tag, measure in self.measure_map.items():
+                tags += (tag,) * measure.count(measure_term)
+        tags += self.term_index.get(term, ())
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[term] = tags
+        return tags
+
+    def measure_spans(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Spans of @text accepted by some measure (one scan of the combined measure regex).
+        A span leaves out its trailing space and the scan resumes on it, since it is also the leading
+        space of a back-to-back measure (" 64gb 16gb "). A rejected match (i.e. number out of the
+        whitelists) does not consume its surrounding spaces either.
+        """
+        spans: List[Tuple[int, int]] = []
+        if not self.any_measure:
+            return spans
+        measures = list(self.measure_map.values())
+        pos = 0
+        while True:
+            match = self.any_measure.search(text, pos)
+            if not match:
+                return spans
+            if any(measure.count(match.group()) for measure in measures):
+                spans.append((match.start(), match.end() - 1))
+                pos = match.end() - 1
+            else:
+                pos = match.start() + 1
+
+
 @gin.configurable
 class SequenceEncoder(BaseEncoder):
-    def __init__(self, output_folder: str, properties_path: str, measure_exceptions: List[str],  debug: bool = False):
+    # The whole record is written to sequence_enriched.jsonl, so no field projection
+    schema_fields = None
+
+    def __init__(self, output_folder: str, properties_path: str, measure_exceptions: List[str],  debug: bool = False,
+                 measure_whitelist: bool = True, legacy_measure_rules: bool = False):
         super().__init__(debug=debug)
+        self.measure_whitelist = measure_whitelist
+        self.legacy_measure_rules = legacy_measure_rules
         self.output_folder = sc.check_folder(os.path.join(output_folder, str(datetime.date(datetime.utcnow()))))
         self.output_folder = sc.check_folder(os.path.join(self.output_folder, self.id))
         self.ner_dict: Dict[str, Set[str]] = self.preload_maps(folder=properties_path)
         self.reg_rules = self.build_regex()
         self.measure_map = self.generate_measure_map(self.ner_dict, measure_exceptions)
         self.non_measure_map = self.generate_non_measure_map()
+        self.tagger = TermTagger(self.measure_map, self.non_measure_map)
+        self.phrase_matcher = AhoCorasick(value for values in self.non_measure_map.values() for value in values
+                                          if len(value.split()) > 1)
+        self.sink = AsyncLineSink(os.path.join(self.output_folder, "sequence_enriched.jsonl"))
         if self.debug:
             pprint(self.measure_map)
             pprint(self.non_measure_map)
@@ -39,9 +164,7 @@ class SequenceEncoder(BaseEncoder):
 
     def save_encoded_data(self, *data):
         ad_dict = data
-        file_name = os.path.join(self.output_folder, "sequence_enriched.jsonl")
-        with open(file_name, "a", encoding="utf-8") as js:
-            js.write(json.dumps(ad_dict[0]) + "\n")
+        self.sink.write(json.dumps(dict(ad_dict[0])) + "\n")
 
     def preload_maps(self, folder: str = None):
         if folder:
@@ -54,7 +177,7 @@ class SequenceEncoder(BaseEncoder):
             raise ValueError("Parsed properties path cannot be None! Run schema pipe to build parsed props!")
 
     def save_maps(self):
-        pass
+        self.sink.close()
 
     def build_regex(self):
         return {"ngram_rgx": re.compile(r"(\w+|(\*\*[ \w]+\*\*))"),  # match words and **{...}**
@@ -69,16 +192,7 @@ class SequenceEncoder(BaseEncoder):
         model_input = []
 
         for term in terms_input:
-            tmp_tp: List[str] = []
-
-            for tag, regex_rule_list in self.measure_map.items():
-                for regex_rule in regex_rule_list:
-                    if re.fullmatch(regex_rule, term):
-                        tmp_tp.append(tag)
-
-            for tag, specific_term_list in self.non_measure_map.items():
-                if term in specific_term_list:
-                    tmp_tp.append(tag)
+            tmp_tp: List[str] = list(self.tagger.tags(term))
 
             cleaned_term = term.strip()
 
@@ -96,13 +210,12 @@ class SequenceEncoder(BaseEncoder):
         By default, it randomizes on conflict naming entities. One can provide a resolution dictionary
         that avoids randomization on pre-defined solutions.
         Debug mode prints the relevant parts and break the code for the first two observations.
-        :return: None
+        The 'NER' field is set in place on the advertise.
+        :return: advertise
         """
-        tmp_ad = advertise.copy()
+        tmp_ad = advertise
         full_str: str = sc.debug_print(
-            self.splitting_marking(text_input=tmp_ad["clean_text"],
-                                   ner_map=self.non_measure_map,
-                                   measure_map=self.measure_map), self.debug)
+            self.splitting_marking(text_input=tmp_ad["clean_text"]), self.debug)
 
         terms_input: List[str] = sc.debug_print(
             [self.reg_rules["ngram_clear_rgx"].sub("", word[0])
@@ -127,7 +240,8 @@ class SequenceEncoder(BaseEncoder):
         tmp_ad["NER"] = clean_inputs
         return tmp_ad
 
-    def generate_measure_map(self, ner_mapper: Dict[str, Set[str]], fields_exceptions: List[str]) -> Dict[str, Set[str]]:
+    def generate_measure_map(self, ner_mapper: Dict[str, Set[str]],
+                             fields_exceptions: List[str]) -> Dict[str, Measure]:
         new_mapper = dict()
         for key, values in ner_mapper.items():
             if self.check_measure_fields(values) and key not in fields_exceptions:
@@ -156,11 +270,12 @@ class SequenceEncoder(BaseEncoder):
         else:
             return False
 
-    def get_measure_regex(self, values: Set[str]) -> Set[str]:
+    def get_measure_regex(self, values: Set[str]) -> Measure:
         """
-        Get measure regex rule from measure set.
+        Get measure grammar from measure set: its units and, with measure_whitelist, its numbers
+        (or, with legacy_measure_rules, its value x unit rules).
         :param values: set of values
-        :return: {"(\d+gb)|(\d+ gb)"}
+        :return: MeasureRules or MeasureGrammar matching " 64 gb " and " 64gb "
         """
         measures: Set[str] = set()
         vals = set()
@@ -168,42 +283,23 @@ class SequenceEncoder(BaseEncoder):
         for value in values:
             tmp = value.split()
             if len(tmp) == 2:
-                measures.add(tmp[1])
+                measures.add(tmp[1].lower().strip())
                 vals.add(tmp[0])
-        rules = set()
-        for measure in measures:
-            for val in vals:
-                rules.add("( {1} {0} )|( {1}+{0} )".format(measure.lower().strip(), val))
-        # return {"( \d+ {0} )|( \d+{0} )".format(measure.lower().strip()) for measure in measures}
-        return rules
-
-    def splitting_marking(self, text_input: str, ner_map: Dict[str, List[str]], measure_map: Dict[str, Set[str]] = None) -> str:
-        new_txt: str = text_input
+        if self.legacy_measure_rules:
+            return MeasureRules(measures, vals)
+        return MeasureGrammar(measures, vals if self.measure_whitelist else None)
 
-        for _, values in ner_map.items():
-            for value in values:
-                if len(value.split()) > 1:
-                    new_txt = re.sub(value, "**{0}**".format(value), new_txt)
-
-        if measure_map:
-            pure_match = set()
-            for _, values in measure_map.items():
-                for rgx in values:
-                    matches = re.findall(rgx, new_txt)
-                    for match in matches:
-                        tmp_ls = list(match)
-
-                        for result in tmp_ls:
-                            if result != '':
-                                pure_match.add(result)
-
-            if '' in pure_match:
-                pure_match.remove('')
-
-            for element in pure_match:
-                new_txt = re.sub(element, "**{0}**".format(element), new_txt)
-
-        return new_txt
+    def splitting_marking(self, text_input: str) -> str:
+        """
+        Marks the multi-word non measure values and the measure matches of @text_input as **{...}**,
+        so they are kept as a single term. Phrases are found in one pass of the Aho-Corasick matcher and
+        measures in one scan of the combined measure regex; overlaps resolve leftmost-longest.
+        :param text_input: clean text
+        :return: marked text
+        """
+        spans = list(self.phrase_matcher.finditer(text_input))
+        spans.extend(self.tagger.measure_spans(text_input))
+        return mark_spans(text_input, leftmost_longest(spans))
 
 @gin.configurable
 class SequenceReducer(Reducer):
@@ -1,26 +1,65 @@
-import datetime
 import hashlib
-import logging
 import re
-from typing import List, Dict, Union, Any, Optional
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 
 import gin
 
 from pipelines import utils as sc
+from pipelines.advertise import Advertise
 from pipelines.clients import CategoryModel
+from pipelines.markets import UNKNOWN_MARKET, get_market_parser, get_market_by_name, extra_fields
 import pipelines.cleaner as dc
 
+FIELD_ALIASES = {"region": ("geo_city", "city"),
+                 "title": ("post_title", "title"),
+                 "detail": ("detail", "post_description"),
+                 "price": ("product_price", "price"),
+                 "datetime": ("post_dt_publish", "dt_publish")}
+
 
 @gin.configurable
 class Parser:
-    def __init__(self, category_model_path: str = None, unique_ids: bool = True, debug: bool = False):
+    def __init__(self, category_model_path: str = None, unique_ids: bool = True, debug: bool = False,
+                 fields: Optional[Tuple[str, ...]] = None, shape_cache_size: int = 1024):
         self.category_model = self.load_category_model(category_model_path)
         self.price_regx = re.compile("\d+(\.\d+|\,\d+)*")
         self.debug = debug
+        self.fields = self.check_fields(fields)
+        self.shape_cache: Dict[Tuple[str, ...], Dict[str, Optional[str]]] = OrderedDict()
+        self.shape_cache_size = shape_cache_size
+        self.shape_hits = 0
+        self.shape_misses = 0
         self.seen_ids = None
         if unique_ids:
             self.seen_ids = set()
 
+    @staticmethod
+    def check_fields(fields: Optional[Tuple[str, ...]]) -> Tuple[str, ...]:
+        """
+        Validates the projection of market extra fields the parser should produce.
+        :param fields: extra fields to be parsed (None means all of them)
+        :return: tuple of extra fields
+        """
+        known_fields = extra_fields()
+        if fields is None:
+            return known_fields
+
+        unknown = [field for field in fields if field not in known_fields]
+        if unknown:
+            raise ValueError("Parser cannot produce fields {0}! Known fields: {1}".format(unknown, known_fields))
+        return tuple(field for field in known_fields if field in fields)
+
+    def project(self, fields: Tuple[str, ...]) -> None:
+        """
+        Restricts parsing to the extra fields consumed downstream.
+        :param fields: extra fields required by the encoder
+        """
+        missing = [field for field in fields if field not in self.fields]
+        if missing:
+            raise ValueError("Fields {} are required downstream but Parser was configured to skip them!".format(missing))
+        self.fields = self.check_fields(fields)
+
     def load_category_model(self, folder_path: str):
         if folder_path:
             return CategoryModel(folder_path)
@@ -36,243 +75,15 @@ class Parser:
             return float(self.price_regx.search(trim_price).group())
 
     @staticmethod
-    def date_parser(market, datestr):
+    def date_parser(market: Optional[str], datestr: str) -> str:
         """
         Parses datetime scrap field to solr datetime
         :param market: (string) website name (i.e 'OLX')
         :param datestr: (string) datetime string field
         :return: (string) datetime UTC format
         """
-        brmonths = {'Janeiro': 1, 'Fevereiro': 2, 'Março': 3, 'Abril': 4, 'Maio': 5, 'Junho': 6, 'Julho': 7,
-                    'Agosto': 8, 'Setembro': 9, 'Outubro': 10, 'Novembro': 11, 'Dezembro': 12}
-        year = datetime.datetime.utcnow().year
-        solrdateformat = '%Y-%m-%dT%H:%M:%SZ'
-
-        try:
-            if market is "olx":
-                # target format: "Inserido em: 15 Março às 09:41"
-                daymonth = re.search(r'([0-9]+).(' + str.join('|', brmonths.keys()) + ')', datestr)
-                hourmin = re.search(r"([0-9]+):([0-9]+)", datestr)
-                date = datetime.datetime(year, brmonths[daymonth.group(2)], int(daymonth.group(1)),
-                                         hour=int(hourmin.group(1)), minute=int(hourmin.group(2)))
-                return date.strftime(solrdateformat)
-            else:
-                raise ValueError("Market parser not found! Please set a date parser for maket {}.".format(market))
-        except ValueError as err:
-            logging.debug("Could not parse date for {0} .Using UTC NOW... Error:{1}".format(market, str(err)))
-            return datetime.datetime.utcnow().strftime(solrdateformat)
-
-    @staticmethod
-    def remove_noise_terms(terms: List[str], noise_terms: List[str]) -> List[str]:
-        """
-        Remove noise terms from terms list.
-        :param terms:
-        :param noise_terms:
-        :return:
-        """
-        if '' in terms:
-            terms.remove('')
-
-        cp_terms = terms.copy()
-        for term in cp_terms:
-            for noise in noise_terms:
-                if noise in term.lower():
-                    terms.remove(term)
-                    break
-
-        return terms
-
-    @staticmethod
-    def parse_post_category(advertise: Dict[str, Any]) -> Optional[List[str]]:
-        """
-        Parse 'post_category' field from ML advertise.
-        :param advertise: advertise dict from ML
-        :return: ['Celulares e Telefones', 'Celulares e Smartphones', 'iPhone', 'iPhone 8 Plus', '64GB']
-        """
-
-        noise_terms: List[str] = ["voltar"]
-
-        if "post_category" in advertise.keys():
-            tmp: List[str] = re.split('[ \t]{2,}', advertise["post_category"])
-            tmp = Parser.remove_noise_terms(tmp, noise_terms)
-            return tmp
-
-    @staticmethod
-    def parse_user_medals(advertise: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """
-        Parse user medals field from ML advertise.
-        :param advertise: ML advertise dict
-        :return: None or {'reviews': 153, 'rank': 'mercadolider', 'customer_support': 1, 'good_delivery': 1,
-        'sell_freq': 121.75}
-        """
-        noise_terms: List[str] = ['ver mais dados', 'informação', 'vermelho', 'laranja', 'amarelo', 'verde']
-
-        if "user_medals" in advertise:
-            tmp_dict: Dict[str, Any] = {"reviews": None, "rank": None, "customer_support": None, "good_delivery": None}
-            tmp: List[str] = re.split('[ \t]{2,}', advertise["user_medals"])
-
-            if str(tmp[0].strip()).isdigit() and "opini" in tmp[1]:
-                tmp_dict["reviews"]: int = int(tmp[0].strip())
-
-            tmp = Parser.remove_noise_terms(tmp, noise_terms)
-
-            for term in tmp:
-
-                if "vendas" in term.lower():  # Seller frequency per month
-                    seller_freq_term = term
-                    seller_freq_ls = re.split("\D+", seller_freq_term)
-                    if '' in seller_freq_ls:
-                        seller_freq_ls.remove('')
-                    if len(seller_freq_ls) == 2 and seller_freq_ls[0].isdigit() and seller_freq_ls[1].isdigit():
-                        if "anos" in seller_freq_term:
-                            tmp_dict["sell_freq"] = int(seller_freq_ls[0]) / (int(seller_freq_ls[1]) * 12)
-                        else:
-                            tmp_dict["sell_freq"] = int(seller_freq_ls[0]) / int(seller_freq_ls[1])
-
-                if "MercadoLíder" in term:  # TODO: PROCESS BATCH OF FILES TO GET ALL CASES
-                    tmp_dict["rank"] = "mercadolider"
-
-                if "presta um bom atendimento" in term.lower():
-                    tmp_dict["customer_support"] = 1
-
-                if "entrega os produtos dentro" in term.lower():
-                    tmp_dict["good_delivery"] = 1
-
-            return tmp_dict
-
-    @staticmethod
-    def parse_product_full_attributes(advertise: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """
-        Parse 'product_full_attributes' from ML advertise.
-        :param advertise: ML advertise dict
-        :return: None or {"Marca": "LG", "Tipo de tela": "Plasma", "Tamanho da tela": "50 in"}
-        """
-        if "product_full_attributes" in advertise.keys():
-
-            tmp_dict: Dict[str, Any] = dict()
-            tmp: List[str] = re.split('[ \t]{3,}', advertise["product_full_attributes"])
-
-            for term in tmp:
-                key_val: List[str] = re.split('[ \t]{2,}', term)
-                if '' in key_val:
-                    key_val.remove('')
-                if len(key_val) == 2:
-                    tmp_dict[re.sub(r'[^\w\s]', '', key_val[0]).strip()] = key_val[1]
-
-            return tmp_dict
-
-    @staticmethod
-    def parse_comments_html(advertise: Dict[str, Any]) -> Optional[List[str]]:
-        """
-        Parse 'comments_html' field from ML advertise.
-        :param advertise: ML advertise dict
-        :return: List<str>
-        """
-        if "comments_html" in advertise.keys():
-
-            filtred_comments: str = advertise["comments_html"][200::]
-
-            tmp: List[str] = re.split("[ \n\t]{2,}", filtred_comments)
-            if '' in tmp:
-                tmp.remove('')
-
-            # Breaking comments
-            master: List[List[str]] = []
-            tmp_vec: List[str] = []
-            for line in tmp:
-
-                if re.search("de \d{4,}", line):  # matches 'de 2018' that signals the end of comment
-                    master.append(tmp_vec)
-                    tmp_vec = []
-                else:
-                    tmp_vec.append(line)
-
-            # Cleaning comments
-            for comment in master:
-                if "..." in comment:
-                    comment.remove("...")
-                if "O usuário contratou o serviço em" in comment:
-                    comment.remove("O usuário contratou o serviço em")
-
-            return [" ".join(m) for m in master]
-
-    @staticmethod
-    def parse_product_installment(advertise: Dict[str, Any]) -> Optional[Dict[str, Union[float, int]]]:
-        """
-        Parses product installment field from ML ads.
-        :param advertise: dict(ad)
-        :return: {"price":333.2, "parcell": 12, "no_interest": 1}
-        """
-        if "product_installment" in advertise.keys():
-
-            tmp_dict = {"parcell": None, "price": None, "no_interest": None}
-            tmp: List[str] = re.split("[ \t]{2,}", advertise["product_installment"])
-
-            for term in tmp:
-                if "x" in term:
-                    tmp_vec = term.split()
-                    if tmp_vec[0].isnumeric():
-                        tmp_dict["parcell"] = int(tmp_vec[0])
-                    continue
-                if "R$" in term:
-                    tmp_vec = term.split()
-                    if "R$" in tmp_vec:
-                        tmp_vec.remove("R$")
-                    if all([term.isnumeric() for term in tmp_vec]):
-                        tmp_dict["price"] = float(".".join(tmp_vec))
-                    continue
-                if "sem juros" in term:
-                    tmp_dict["no_interest"] = 1
-                    continue
-            return tmp_dict
-
-    @staticmethod
-    def parse_questions_text(advertise: Dict[str, Any]) -> Optional[List[str]]:
-        """
-        Parses 'questions_text' field from ML advertise.
-        :param advertise: ML advertise dict.
-        :return: List of string from questions/answers
-        """
-        if "questions_text" in advertise.keys():
-
-            tmp: List[str] = advertise["questions_text"].split("Denunciar")
-            excepts: List[str] = []
-
-            for part in tmp:
-
-                tmp_vec: List[str] = re.split("[ \t\n]{2,}", part)
-                if '' in tmp_vec:
-                    tmp_vec.remove('')
-
-                excepts.extend(tmp_vec)
-
-            excepts = set(excepts)
-
-            if '' in excepts:
-                excepts.remove('')
-
-            return list(excepts)
-
-    @staticmethod
-    def parse_ml_advertise(advertise: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Parses relevant fields from ML advertise.
-        :param advertise: ML advertise dict.
-        :return: (parsed) ML advertise dict.
-        """
-        parsers = [(Parser.parse_post_category, "post_category"),
-                   (Parser.parse_user_medals, "user_medals"),
-                   (Parser.parse_product_full_attributes, "product_full_attributes"),
-                   (Parser.parse_comments_html, "comments_html"),
-                   (Parser.parse_product_installment, "product_installment"),
-                   (Parser.parse_questions_text, "questions_text")]
-
-        tmp_ad: Dict[str, Any] = advertise.copy()
-        for parser, field in parsers:
-            if field in tmp_ad.keys():
-                tmp_ad[field] = parser(tmp_ad)
-
-        return tmp_ad
+        market_parser = get_market_by_name(market) or UNKNOWN_MARKET
+        return market_parser.date(datestr)
 
     @staticmethod
     def limit_field_size(field_value: str, char_limit: int = 500):
@@ -283,37 +94,72 @@ class Parser:
                 return field_value
 
     def get_detail_field(self, advertise):
-        return self.get_field_from_ad(advertise, "detail", ["detail", "post_description"])
+        return self.get_field_from_ad(advertise, "detail")
 
     def get_price_field(self, advertise):
-        return self.get_field_from_ad(advertise, "price", ["product_price", "price"])
+        return self.get_field_from_ad(advertise, "price")
 
     def get_title_field(self, advertise):
-        return self.get_field_from_ad(advertise, "title", ["post_title","title"])
+        return self.get_field_from_ad(advertise, "title")
 
     def get_region_field(self, advertise):
-        return self.get_field_from_ad(advertise, "region", ["geo_city", "city"], default_value="brasil")
+        return self.get_field_from_ad(advertise, "region", default_value="brasil")
 
     def get_date_field(self, advertise):
-        return self.get_field_from_ad(advertise, "datetime", ["post_dt_publish", "dt_publish"])
+        return self.get_field_from_ad(advertise, "datetime")
 
-    def get_field_from_ad(self, advertise: Dict[str, Any], field_name: str, alias: List[str], default_value: Optional[str] = None):
-        for key in advertise.keys():
-            if any([key in field for field in alias]):
-                return advertise[key]
+    def get_field_from_ad(self, advertise: Dict[str, Any], field_name: str, default_value: Optional[str] = None):
+        source_key = self.resolve_shape(advertise)[field_name]
+        if source_key is not None:
+            return advertise[source_key]
         if self.debug:
             sc.message("No {0} column found @ advertise {1}".format(field_name, advertise))
         return default_value
 
-    def get_general_schema(self, adv_dict: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    @staticmethod
+    def find_source_key(keys: Tuple[str, ...], alias: Tuple[str, ...]) -> Optional[str]:
+        for key in keys:
+            if any([key in field for field in alias]):
+                return key
+        return None
+
+    def resolve_shape(self, advertise: Dict[str, Any]) -> Dict[str, Optional[str]]:
+        """
+        Resolves the source key of each target field for the advertise key set.
+        Scraps from the same spider share their keys, so the resolution is cached by shape
+        (least recently used shapes are evicted first).
+        :param advertise: raw advertise dict
+        :return: {"title": "post_title", "detail": "post_description", ...}
+        """
+        shape = tuple(advertise.keys())
+        sources = self.shape_cache.get(shape)
+        if sources is None:
+            self.shape_misses += 1
+            sources = {field: self.find_source_key(shape, alias) for field, alias in FIELD_ALIASES.items()}
+            if self.shape_cache and len(self.shape_cache) >= self.shape_cache_size:
+                self.shape_cache.popitem(last=False)
+            self.shape_cache[shape] = sources
+        else:
+            self.shape_hits += 1
+            self.shape_cache.move_to_end(shape)
+        return sources
+
+    def shape_cache_info(self) -> Dict[str, Any]:
+        total = self.shape_hits + self.shape_misses
+        return {"hits": self.shape_hits, "misses": self.shape_misses,
+                "hit_rate": round(self.shape_hits / total, 4) if total else 0.0,
+                "size": len(self.shape_cache), "max_size": self.shape_cache_size}
+
+    def get_general_schema(self, adv_dict: Dict[str, Any]) -> Optional[Advertise]:
         """
         Formats scrapped item dict into SolrSchema basic - without category and tags.
+        The scrapped item is owned by the parser and may be updated in place.
         :param adv_dict: (dict) scrapped item
-        :return: (dict/None) solr ready dict
+        :return: (Advertise/None) solr ready record
         """
 
-        schema = {}
-        advertise = adv_dict.copy()
+        schema = Advertise()
+        advertise = adv_dict
         schema["url"] = adv_dict["url"]
         hash_object = hashlib.sha1(schema['url'].encode()).hexdigest()
         schema['id'] = hash_object
@@ -325,26 +171,23 @@ class Parser:
             else:
                 self.seen_ids.add(schema['id'])
 
-        if 'olx' in schema['url']:
-            schema['market'] = 'OLX'
-        elif 'mercadolivre' in schema['url']:
-            schema['market'] = 'MercadoLivre'
-            advertise = Parser.parse_ml_advertise(adv_dict)
-            ml_fields = ["post_category", "user_medals", "product_full_attributes", "comments_html", "product_installment", "questions_text"]
-            for field in ml_fields:
-                if field in advertise.keys():
+        market_parser = get_market_parser(schema['url'])
+        if market_parser:
+            schema['market'] = market_parser.name
+            advertise = market_parser.parse_advertise(adv_dict, self.fields)
+            for field in market_parser.extra_fields:
+                if field in self.fields and field in advertise.keys():
                     schema[field] = advertise[field]
-        elif 'enjoei' in schema['url']:
-            schema['market'] = 'Enjoei'
         else:
             schema['market'] = None
+            market_parser = UNKNOWN_MARKET
 
         schema['region'] = self.get_region_field(advertise)
         schema['title'] = self.get_title_field(advertise)
         schema['detail'] = self.limit_field_size(self.get_detail_field(advertise))
         schema['price'] = self.price_parser(self.get_price_field(advertise))
         schema['dt_publish'] = self.get_date_field(advertise)
-        schema['datetime'] = self.date_parser(schema['market'], schema["dt_publish"])
+        schema['datetime'] = market_parser.date(schema["dt_publish"])
         schema['category'] = self.infer_category(dc.build_model_input(schema))
 
         return schema
@@ -0,0 +1,95 @@
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+Span = Tuple[int, int]
+
+
+class AhoCorasick(object):
+    """
+    Aho-Corasick automaton over literal phrases: finds every occurrence of every phrase in a single
+    linear pass over the text (time independent of the number of phrases).
+    """
+
+    def __init__(self, phrases: Iterable[str] = ()):
+        self.goto: List[Dict[str, int]] = [dict()]
+        self.fail: List[int] = [0]
+        # Lengths of the phrases ending at each node (own phrase and its suffix links)
+        self.out: List[Tuple[int, ...]] = [()]
+        for phrase in phrases:
+            self.add(phrase)
+        self.build()
+
+    def add(self, phrase: str) -> None:
+        if not phrase:
+            return
+        node = 0
+        for char in phrase:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append(dict())
+                self.fail.append(0)
+                self.out.append(())
+            node = child
+        if len(phrase) not in self.out[node]:
+            self.out[node] += (len(phrase),)
+
+    def build(self) -> None:
+        """
+        Sets the failure links (breadth first) and merges the outputs of the suffix links.
+        """
+        goto, fail, out = self.goto, self.fail, self.out
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                link = fail[node]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                fail[child] = goto[link].get(char, 0)
+                out[child] += tuple(length for length in out[fail[child]] if length not in out[child])
+                queue.append(child)
+
+    def __len__(self) -> int:
+        return len(self.goto) - 1
+
+    def finditer(self, text: str) -> Iterator[Span]:
+        """
+        (start, end) of every phrase occurrence in @text, overlapping ones included.
+        """
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for end, char in enumerate(text, start=1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length in out[node]:
+                yield end - length, end
+
+
+def leftmost_longest(spans: Iterable[Span]) -> List[Span]:
+    """
+    Non overlapping spans picked leftmost first, the longest one among spans starting at the same position.
+    """
+    selected: List[Span] = []
+    last_end = 0
+    for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+        if start >= last_end:
+            selected.append((start, end))
+            last_end = end
+    return selected
+
+
+def mark_spans(text: str, spans: List[Span], marker: str = "**") -> str:
+    """
+    Wraps each of the sorted non overlapping @spans of @text with @marker.
+    """
+    parts: List[str] = []
+    last_end = 0
+    for start, end in spans:
+        parts.append(text[last_end:start])
+        parts.append(marker + text[start:end] + marker)
+        last_end = end
+    parts.append(text[last_end:])
+    return "".join(parts)
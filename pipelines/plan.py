@@ -0,0 +1,158 @@
+import copy
+import functools
+import inspect
+from typing import Any, Callable, Dict, List, Optional
+
+import gin
+
+import pipelines.cleaner as dc
+import pipelines.text_processors as tp
+import pipelines.utils as sc
+import pipelines.validation as val
+
+_UNBOUND = object()
+
+
+def bind_configurable(fn: Callable, selector: Optional[str] = None) -> Callable:
+    """
+    Resolves the gin bindings of a configurable function once and returns the undecorated
+    function bound to them, so calling it never goes through gin again.
+    Callables bound to its parameters (i.e. process pipelines) are resolved recursively.
+    :param fn: gin configurable function
+    :param selector: gin selector of the configurable (defaults to the function name)
+    :return: plain callable
+    """
+    selector = selector or fn.__name__
+    raw_fn = getattr(fn, "__wrapped__", fn)
+
+    bound_kwargs: Dict[str, Any] = dict()
+    for arg_name in inspect.signature(raw_fn).parameters:
+        value = query_binding(selector, arg_name, default=_UNBOUND)
+        if value is not _UNBOUND:
+            bound_kwargs[arg_name] = value
+
+    if bound_kwargs:
+        return functools.update_wrapper(functools.partial(raw_fn, **bound_kwargs), raw_fn)
+    return raw_fn
+
+
+def query_binding(selector: str, arg_name: str, default: Any = None) -> Any:
+    """
+    Returns the resolved value gin bound to @selector.@arg_name or @default when unbound.
+    """
+    try:
+        value = gin.query_parameter("{0}.{1}".format(selector, arg_name))
+    except ValueError:
+        return default
+    return resolve_binding(value)
+
+
+def resolve_binding(value: Any) -> Any:
+    """
+    Converts a gin bound value into a plain python value, binding configurable references.
+    Scoped references (@scope/fn) keep calling through gin, which applies their scope on each call,
+    and evaluated references (@fn()) are replaced by their result.
+    """
+    if isinstance(value, gin.config.ConfigurableReference):
+        if not value.evaluate and not value.scopes:
+            return bind_configurable(value.configurable.fn_or_cls, value.configurable.selector)
+        scoped_fn = value.scoped_configurable_fn
+        return resolve_binding(scoped_fn()) if value.evaluate else scoped_fn
+    if type(value) in (list, tuple):
+        return type(value)(resolve_binding(item) for item in value)
+    return copy.deepcopy(value)
+
+
+def filter_stage(predicate: Callable) -> Callable:
+    def stage(advertise):
+        if predicate(advertise):
+            return advertise
+    stage.__name__ = "filter_{}".format(getattr(predicate, "__name__", "stage"))
+    return stage
+
+
+class ExecutionPlan(object):
+    """
+    Pre-bound list of stage callables applied to each record. A stage returning None drops the record.
+    @record_stages (parsing, validation) always run record by record while @clean_stages also have
+    batch versions used by @run_batch.
+    """
+
+    def __init__(self, record_stages: List[Callable], clean_stages: List[Callable] = ()):
+        self.record_stages = list(record_stages)
+        self.clean_stages = list(clean_stages)
+        self.stages = self.record_stages + self.clean_stages
+        self.batch_stages = [dc.batch_stage(stage) for stage in self.clean_stages]
+
+    @staticmethod
+    def apply(stages: List[Callable], advertise):
+        for stage in stages:
+            advertise = stage(advertise)
+            if advertise is None:
+                return None
+        return advertise
+
+    def run(self, advertise):
+        return self.apply(self.stages, advertise)
+
+    def run_batch(self, advertises: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Runs the plan over a batch of records. Records failing a stage are dropped without
+        affecting the rest of the batch.
+        :param advertises: list of raw records
+        :return: list of clean records
+        """
+        tmp_advertises = []
+        for advertise in advertises:
+            try:
+                advertise = self.apply(self.record_stages, advertise)
+            except Exception as err:
+                sc.message(err)
+                continue
+            if advertise is not None:
+                tmp_advertises.append(advertise)
+
+        try:
+            clean_advertises = tmp_advertises
+            for stage in self.batch_stages:
+                clean_advertises = stage(clean_advertises)
+            return clean_advertises
+        except Exception as err:
+            sc.message("Batch cleaning failed ({}), cleaning record by record...".format(err))
+
+        clean_advertises = []
+        for advertise in tmp_advertises:
+            try:
+                advertise = self.apply(self.clean_stages, advertise)
+            except Exception as err:
+                sc.message(err)
+                continue
+            if advertise is not None:
+                clean_advertises.append(advertise)
+        return clean_advertises
+
+    def __repr__(self):
+        return "ExecutionPlan({})".format(" -> ".join(getattr(stage, "__name__", repr(stage))
+                                                       for stage in self.stages))
+
+
+def build_clean_plan(parser: "pipelines.parser.Parser" = None) -> ExecutionPlan:
+    """
+    Compiles the gin configured cleaning pipeline (@clean_raw_advertise without the gin calls)
+    into an ExecutionPlan. To be called once at worker start.
+    :param parser: Parser instance, when raw data has to be parsed first
+    :return: ExecutionPlan
+    """
+    tp.setup_token_cache()
+
+    record_stages: List[Callable] = []
+    if parser:
+        record_stages.append(parser.get_general_schema)
+    record_stages.append(filter_stage(bind_configurable(val.valid_advertise)))
+
+    clean_stages = query_binding(dc.clean_base_advertise.__name__, "process_pipeline") or ()
+    for stage in clean_stages:
+        if not callable(stage):
+            raise TypeError("clean_base_advertise.process_pipeline stage {} is not callable!".format(stage))
+
+    return ExecutionPlan(record_stages, clean_stages)
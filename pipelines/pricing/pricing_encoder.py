@@ -1,95 +1,142 @@
 from datetime import datetime
 
-from pipelines.encoder import BaseEncoder
+from pipelines.encoder import BaseEncoder, build_dataset_writer
+from pipelines.sinks import AsyncLineSink
 import numpy as np
 from typing import List, Dict, Union, Any, Optional, Tuple
 import gin
 import os
 from pipelines import utils as sc
+from pipelines.vocabulary import Vocabulary, WordCache, encode_word_batch, encode_char_batch, load_vocabulary
 import json
-from keras.preprocessing.sequence import pad_sequences
 
 
 @gin.configurable
 class PricingEncoder(BaseEncoder):
-    def __init__(self, seq_max_len: int = 50, max_len_char: int = 10, model_folder: str = None, maps_folder: str = None, update_maps: bool = False):
+    schema_fields = ()
+
+    def __init__(self, seq_max_len: int = 50, max_len_char: int = 10, model_folder: str = None, maps_folder: str = None,
+                 update_maps: bool = False, output_format: str = "jsonl", word_cache_size: int = 1 << 20):
         super().__init__()
         self.seq_max_len = seq_max_len
         self.max_len_char = max_len_char
         self.model_folder = sc.check_folder(os.path.join(model_folder, str(datetime.date(datetime.utcnow()))))
         self.model_folder = sc.check_folder(os.path.join(self.model_folder, self.id))
+        self.update_maps = update_maps
         self.preload_maps(maps_folder)
+        self.word_cache = None
+        if word_cache_size:
+            self.word_cache = WordCache(self.maps["word2idx"], self.maps["char2idx"], max_len_char, word_cache_size)
         self.advertise_counter = 0
         self.processed_counter = 0
-        self.update_maps = update_maps
+        self.output_format = self.check_output_format(output_format)
+        self.shards = build_dataset_writer(self.output_format, self.model_folder,
+                                           {"x_word": ("int32", (seq_max_len,)),
+                                            "x_char": ("int32", (seq_max_len, max_len_char)),
+                                            "y_price": ("float32", ())})
+        self.sink = None
+        if self.shards is None:
+            self.sink = AsyncLineSink(os.path.join(self.model_folder, "dataset.jsonl"))
 
     def encode_advertise(self, advertise):
-        x_char, x_word, y_price = [], [], []
-        char2idx = self.maps["char2idx"]
-        word2idx = self.maps["word2idx"]
-
-        terms = advertise["clean_text"]
-        tmp_seq = self.pad_term_sequence(self.tokenize_sentence(terms), max_len=self.seq_max_len)
-
-        w_rep, word2idx = self.build_word_representations(tmp_seq, word2idx)
-        x_word.append(pad_sequences(maxlen=self.seq_max_len, sequences=[w_rep], value=word2idx["__PAD__"],
-                                    padding='post', truncating='post').tolist())
-        representation, char2idx = self.build_char_representations(tmp_seq, char2idx)
-        x_char.append(representation)
-        y_price.append(np.log(float(advertise["price"])))
-
-        # Translate position of title and detail
-        terms = advertise["clean_text_invert"]
-        tmp_seq = self.pad_term_sequence(self.tokenize_sentence(terms), max_len=self.seq_max_len)
-
-        w_rep, word2idx = self.build_word_representations(tmp_seq, word2idx)
-        x_word.append(pad_sequences(maxlen=self.seq_max_len, sequences=[w_rep], value=word2idx["__PAD__"],
-                                    padding='post', truncating='post').tolist())
-        representation, char2idx = self.build_char_representations(tmp_seq, char2idx)
-        x_char.append(representation)
-        y_price.append(np.log(float(advertise["price"])))
-
+        sequences, y_price = self.build_sequences(advertise)
+        x_word, x_char = self.encode_sequences(sequences)
         self.save_encoded_data(x_word, x_char, y_price)
 
-        # Update maps
-        if self.update_maps:
-            self.maps["char2idx"] = char2idx
-            self.maps["word2idx"] = word2idx
-
         self.advertise_counter += 1
         sc.get_notice(self.advertise_counter, 5000, msg_text="ads processed!")
 
+    def encode_batch(self, advertises: List[Dict[str, Any]]) -> int:
+        """
+        Vectorized encoding of a batch of advertises (single kernel call and dataset write).
+        Advertises with invalid fields are skipped without dropping the rest of the batch, and the
+        batch falls back to record by record encoding if its encoding or writing fails.
+        :param advertises: list of clean advertises
+        :return: number of encoded advertises
+        """
+        sequences, y_price, batch = [], [], []
+        for advertise in advertises:
+            try:
+                ad_sequences, ad_price = self.build_sequences(advertise)
+            except Exception as err:
+                sc.message(err)
+                continue
+            sequences.extend(ad_sequences)
+            y_price.extend(ad_price)
+            batch.append(advertise)
+
+        if not batch:
+            return 0
+        try:
+            x_word, x_char = self.encode_sequences(sequences)
+            self.save_encoded_data(x_word, x_char, y_price)
+        except Exception as err:
+            sc.message("Batch encoding failed ({}), encoding record by record...".format(err))
+            return super().encode_batch(batch)
+
+        self.advertise_counter += len(batch)
+        sc.get_notice_step(self.advertise_counter - len(batch), self.advertise_counter, 5000, msg_text="ads processed!")
+        return len(batch)
+
+    def build_sequences(self, advertise) -> Tuple[List[List[str]], List[float]]:
+        """
+        Padded term sequences of an advertise, in both title/detail orders, and their log price targets.
+        """
+        y_price = np.log(float(advertise["price"]))
+        sequences = [self.pad_term_sequence(self.tokenize_sentence(advertise[field]), max_len=self.seq_max_len)
+                     for field in ("clean_text", "clean_text_invert")]
+        return sequences, [y_price, y_price]
+
+    def encode_sequences(self, sequences: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Encodes padded term sequences with the encoder maps.
+        :param sequences: pad_term_sequence outputs
+        :return: x_word (batch, seq_max_len) and x_char (batch, seq_max_len, max_len_char) int32 arrays
+        """
+        if self.word_cache:
+            return self.word_cache.encode_batch(sequences, self.seq_max_len)
+        x_word = encode_word_batch(sequences, self.maps["word2idx"], self.seq_max_len)
+        x_char = encode_char_batch(sequences, self.maps["char2idx"], self.seq_max_len, self.max_len_char)
+        return x_word, x_char
+
+    def cache_info(self) -> Dict[str, Any]:
+        return {"word_cache": self.word_cache.cache_info()} if self.word_cache else dict()
+
     def save_maps(self, *maps):
+        if self.shards:
+            self.shards.close()
+        if self.sink:
+            self.sink.close()
         sc.message("Saving Maps...")
         if self.model_folder:
             for k, map in self.maps.items():
                 # TODO: may get too big, write as txt
-                sc.save_dict_2json(os.path.join(self.model_folder, "{}.json".format(k)), map)
+                map.to_json(os.path.join(self.model_folder, "{}.json".format(k)))
         else:
             # TODO: implement saving in DataStorage
             raise NotImplementedError("Saving outside a local folder path is not implemented yet!")
 
     def save_encoded_data(self, *data):
-        if self.model_folder:
-            dataset_name = "dataset.jsonl"
-            dataset_path = os.path.join(self.model_folder, dataset_name)
-
-            with open(dataset_path, "a", encoding="utf-8") as js:
-                x_word, x_char, y_price = data
-                for word, char, price in zip(x_word, x_char, y_price):
-                    js.write(json.dumps({"x_word": word, "x_char": char, "y_price": price}) + "\n")
-                    self.processed_counter += 1
-                    sc.get_notice(self.processed_counter, msg_text="training obs processed!")
+        x_word, x_char, y_price = data
+        previous = self.processed_counter
+        if self.shards:
+            self.processed_counter += self.shards.write(x_word=x_word, x_char=x_char, y_price=y_price)
         else:
-            # TODO: implement saving in DataStorage
-            raise NotImplementedError("Saving outside a local folder path is not implemented yet!")
+            # x_word rows keep the [[...]] nesting of the former keras pad_sequences output.
+            # Rows are serialized before any is written, so a failing batch writes nothing.
+            lines = [json.dumps({"x_word": [word], "x_char": char, "y_price": price}) + "\n"
+                     for word, char, price in zip(x_word.tolist(), x_char.tolist(), y_price)]
+            self.sink.write_lines(lines)
+            self.processed_counter += len(lines)
+        sc.get_notice_step(previous, self.processed_counter, msg_text="training obs processed!")
 
     def preload_maps(self, folder: str= None):
+        frozen = not self.update_maps
         if not folder:
-            self.maps = {"char2idx": {"__PAD__": 0, "UNK": 1}, "word2idx": {"__PAD__": 0, "UNK": 1}}
+            self.maps = {"char2idx": Vocabulary.base(frozen=frozen), "word2idx": Vocabulary.base(frozen=frozen)}
         else:
-            self.maps = {"char2idx": sc.load_json(os.path.join(folder, "char2idx.json")),
-                         "word2idx": sc.load_json(os.path.join(folder, "word2idx.json"))}
+            self.maps = {"char2idx": load_vocabulary(folder, "char2idx", frozen=frozen),
+                         "word2idx": load_vocabulary(folder, "word2idx", frozen=frozen)}
 
     @staticmethod
     def tokenize_sentence(sentence: str):
@@ -111,45 +158,3 @@ class PricingEncoder(BaseEncoder):
                 padded_sequence.append("__PAD__")
 
         return padded_sequence
-
-    def build_char_representations(self, sentence: List[str], charidx: Dict[str, int]):
-        charidxer = charidx.copy()
-
-        while '' in sentence:
-            sentence.remove('')
-
-        sent_seq = []
-        for i in range(self.seq_max_len):
-            word_seq = []
-            for j in range(self.max_len_char):
-                try:
-                    idx = charidxer.get(sentence[i][j])
-                    if idx:
-                        word_seq.append(idx)
-                    else:
-                        if self.update_maps:
-                            charidxer[sentence[i][j]] = len(charidxer.keys()) + 1
-                            word_seq.append(charidxer.get(sentence[i][j]))
-                        else:
-                            word_seq.append(charidxer.get("UNK"))
-                except:
-                    word_seq.append(charidxer.get("__PAD__"))
-            sent_seq.append(word_seq)
-
-        return sent_seq, charidxer
-
-    def build_word_representations(self, sentence: List[str], wordidx: Dict[str, int]):
-        wordidxer = wordidx.copy()
-        sentence_w = []
-
-        for w in sentence:
-            if w in wordidxer.keys():
-                sentence_w.append(wordidxer[w])
-            else:
-                if self.update_maps:
-                    wordidxer[w] = len(wordidxer.keys()) + 1
-                    sentence_w.append(wordidxer[w])
-                else:
-                    sentence_w.append(wordidxer["UNK"])
-
-        return sentence_w, wordidxer
@@ -0,0 +1,240 @@
+import atexit
+import glob
+import os
+import struct
+from shutil import copy
+from typing import Dict, List, Tuple, Optional
+
+import gin
+import numpy as np
+
+from pipelines import utils as sc
+from pipelines.reducer import Reducer
+
+try:
+    from keras.utils import Sequence
+except ImportError:
+    Sequence = object
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# Fixed header size, so the row count can be rewritten in place when the shard grows
+NPY_HEADER_SIZE = 128
+NPY_CHUNK_ROWS = 65536
+
+# Field name -> (dtype, row shape)
+ShardFields = Dict[str, Tuple[str, Tuple[int, ...]]]
+
+
+def npy_header(dtype: np.dtype, shape: Tuple[int, ...]) -> bytes:
+    """
+    Builds a .npy (v1.0) header padded to NPY_HEADER_SIZE bytes.
+    :param dtype: array dtype
+    :param shape: array shape
+    :return: header bytes
+    """
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(np.dtype(dtype).str, tuple(shape))
+    header_len = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2
+    if len(header) + 1 > header_len:
+        raise ValueError("Shard header for shape {} does not fit in {} bytes!".format(shape, NPY_HEADER_SIZE))
+    return NPY_MAGIC + struct.pack("<H", header_len) + (header.ljust(header_len - 1) + "\n").encode("latin1")
+
+
+class NpyShardWriter(object):
+    """
+    Appendable .npy file of fixed row shape. The file stays open and the header row count is
+    rewritten on flush and when the shard is finalised (close, leaving the `with` block or at exit),
+    so the shard is a regular .npy that np.load can memory-map.
+    Rows appended after the last flush are not visible to readers (and are dropped on reopen).
+    """
+
+    def __init__(self, path: str, dtype: str, row_shape: Tuple[int, ...]):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.row_bytes = int(np.prod(self.row_shape, dtype=np.int64)) * self.dtype.itemsize
+
+        if os.path.exists(path):
+            self.rows = self.read_rows(path)
+            self.file = open(path, "r+b")
+            self.file.truncate(NPY_HEADER_SIZE + self.rows * self.row_bytes)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.rows = 0
+            self.file = open(path, "w+b")
+            self.file.write(npy_header(self.dtype, self.shape))
+        atexit.register(self.close)
+
+    def __enter__(self) -> "NpyShardWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return (self.rows,) + self.row_shape
+
+    def read_rows(self, path: str) -> int:
+        with open(path, "rb") as fl:
+            version = np.lib.format.read_magic(fl)
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fl)
+            if version != (1, 0) or fl.tell() != NPY_HEADER_SIZE or fortran_order:
+                raise ValueError("{} is not an appendable shard!".format(path))
+        if dtype != self.dtype or tuple(shape[1:]) != self.row_shape:
+            raise ValueError("Shard {} holds {} rows of {}, expected {} of {}!".format(
+                path, dtype, tuple(shape[1:]), self.dtype, self.row_shape))
+        return shape[0]
+
+    def append(self, array: np.ndarray) -> None:
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        if array.shape[1:] != self.row_shape:
+            raise ValueError("Cannot append rows of shape {} to shard {} of rows {}!".format(
+                array.shape[1:], self.path, self.row_shape))
+        self.file.write(array.data)
+        self.rows += array.shape[0]
+
+    def flush(self) -> None:
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, self.shape))
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+
+    def close(self) -> None:
+        atexit.unregister(self.close)
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class NpyDataset(object):
+    """
+    Set of aligned shards (one .npy per field, i.e. x_word.npy, x_char.npy, y_price.npy) in a folder.
+    """
+
+    def __init__(self, folder: str, fields: ShardFields):
+        self.folder = folder
+        self.writers = {name: NpyShardWriter(shard_path(folder, name), dtype, row_shape)
+                        for name, (dtype, row_shape) in fields.items()}
+
+    def __enter__(self) -> "NpyDataset":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self, **arrays: np.ndarray) -> int:
+        """
+        Appends the same number of rows to every field shard.
+        :return: number of rows written
+        """
+        rows = {len(arrays[name]) for name in self.writers}
+        if len(rows) != 1:
+            raise ValueError("Unaligned rows for shards {}!".format({name: len(arr) for name, arr in arrays.items()}))
+        for name, writer in self.writers.items():
+            writer.append(arrays[name])
+        return rows.pop()
+
+    def close(self) -> None:
+        for writer in self.writers.values():
+            writer.close()
+
+
+def shard_path(folder: str, field: str) -> str:
+    return os.path.join(folder, "{}.npy".format(field))
+
+
+def shard_fields(folder: str) -> List[str]:
+    return sorted(os.path.basename(path)[:-len(".npy")] for path in glob.glob(os.path.join(folder, "*.npy")))
+
+
+def load_npy_dataset(folder: str, fields: Optional[List[str]] = None, mmap_mode: str = "r") -> Dict[str, np.ndarray]:
+    """
+    Memory-maps the field shards of a dataset folder.
+    :param folder: dataset folder
+    :param fields: fields to be loaded (None means every .npy in the folder)
+    :param mmap_mode: np.load memory-map mode
+    :return: {"x_word": memmap, "x_char": memmap, ...}
+    """
+    if fields is None:
+        fields = shard_fields(folder)
+    dataset = {field: np.load(shard_path(folder, field), mmap_mode=mmap_mode) for field in fields}
+    rows = {len(arr) for arr in dataset.values()}
+    if len(rows) > 1:
+        raise ValueError("Unaligned shards @ {}: {}".format(folder, {field: len(arr) for field, arr in dataset.items()}))
+    return dataset
+
+
+class NpyBatchSequence(Sequence):
+    """
+    Keras Sequence over a memory-mapped dataset folder. Batches are slices (views) of the shards.
+    """
+
+    def __init__(self, folder: str, inputs: Tuple[str, ...] = ("x_word", "x_char"),
+                 targets: Tuple[str, ...] = ("y_price",), batch_size: int = 32):
+        self.dataset = load_npy_dataset(folder, list(inputs) + list(targets))
+        self.inputs = inputs
+        self.targets = targets
+        self.batch_size = batch_size
+        self.rows = len(self.dataset[inputs[0]])
+
+    def __len__(self):
+        return (self.rows + self.batch_size - 1) // self.batch_size
+
+    def __getitem__(self, idx: int):
+        batch = slice(idx * self.batch_size, (idx + 1) * self.batch_size)
+        x = [self.dataset[field][batch] for field in self.inputs]
+        y = [self.dataset[field][batch] for field in self.targets]
+        return (x[0] if len(x) == 1 else x), (y[0] if len(y) == 1 else y)
+
+
+def concatenate_shards(paths: List[str], output_path: str, start: int = 0, stop: Optional[int] = None) -> int:
+    """
+    Appends rows [start, stop) of the concatenation of @paths to the shard @output_path.
+    Rows are copied in raw chunks from memory-mapped shards (no decoding).
+    :param paths: shard paths (same dtype and row shape)
+    :param output_path: output shard path
+    :param start: first global row
+    :param stop: last global row (exclusive, None means all)
+    :return: number of rows copied
+    """
+    shards = [np.load(path, mmap_mode="r") for path in paths]
+    if not shards:
+        return 0
+    copied, offset = 0, 0
+    with NpyShardWriter(output_path, shards[0].dtype, shards[0].shape[1:]) as writer:
+        for shard in shards:
+            begin = max(start - offset, 0)
+            end = len(shard) if stop is None else min(stop - offset, len(shard))
+            for chunk in range(begin, end, NPY_CHUNK_ROWS):
+                writer.append(shard[chunk:min(chunk + NPY_CHUNK_ROWS, end)])
+                copied += min(chunk + NPY_CHUNK_ROWS, end) - chunk
+            offset += len(shard)
+    return copied
+
+
+@gin.configurable
+class NpyShardReducer(Reducer):
+    """
+    Concatenates the workers' .npy shards into a single dataset folder and copies the maps.
+    """
+
+    def __init__(self, main_folder: str, output_folder: str, dataset_name: str = "encoded", debug: bool = False):
+        super().__init__(main_folder, output_folder, debug)
+        self.dataset_name = dataset_name
+
+    def reduce_process(self):
+        workers_folder = [os.path.join(self.main_folder, folder) for folder in os.listdir(self.main_folder)]
+        reduced_folder = sc.check_folder(os.path.join(self.output_folder, self.dataset_name))
+
+        sc.message("Concatenating shards")
+        for field in shard_fields(workers_folder[0]):
+            rows = concatenate_shards([shard_path(folder, field) for folder in workers_folder],
+                                      shard_path(reduced_folder, field))
+            sc.message("{}: {} rows".format(field, rows))
+
+        # Copy maps
+        for file_name in os.listdir(workers_folder[0]):
+            if file_name.endswith(".json"):
+                copy(os.path.join(workers_folder[0], file_name), reduced_folder)
+
+        sc.message("DONE! Save @{}".format(reduced_folder))
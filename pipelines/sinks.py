@@ -0,0 +1,110 @@
+import atexit
+import queue
+import threading
+from typing import Iterable, Optional
+
+import gin
+
+
+@gin.configurable
+class AsyncLineSink(object):
+    """
+    Append-only text file shared by the encoders' outputs (i.e. dataset.jsonl).
+    The file is kept open and serialized lines are buffered in memory, then handed in blocks of
+    about @buffer_size chars to a background writer thread. The queue holds at most @max_pending
+    blocks, so the encoder only blocks when the disk falls behind.
+    close() (or leaving the `with` block) writes the remaining lines. The writer thread is not a daemon:
+    if the sink is never closed, it drains the buffer once the main thread ends, and close() runs at exit.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1 << 20, max_pending: int = 8):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.lines = 0
+        self.error: Optional[Exception] = None
+        self.file = open(path, "a", encoding="utf-8")
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.writer = threading.Thread(target=self.write_blocks, name="sink-{}".format(path), daemon=False)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def __enter__(self) -> "AsyncLineSink":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self, line: str) -> None:
+        self.buffer.append(line)
+        self.buffered += len(line)
+        self.lines += 1
+        if self.buffered >= self.buffer_size:
+            self.flush_buffer()
+
+    def write_lines(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self.write(line)
+
+    def flush_buffer(self) -> None:
+        self.check()
+        if self.buffer:
+            self.queue.put("".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def write_blocks(self) -> None:
+        while True:
+            try:
+                block = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if not threading.main_thread().is_alive():
+                    # Unclosed sink: the main thread is gone, so its buffer is no longer touched
+                    self.drain()
+                    return None
+                continue
+            try:
+                if block is None:
+                    return None
+                if self.error is None:
+                    self.file.write(block)
+            except Exception as err:
+                self.error = err
+            finally:
+                self.queue.task_done()
+
+    def drain(self) -> None:
+        try:
+            if self.error is None:
+                self.file.write("".join(self.buffer))
+            self.buffer = []
+            self.file.close()
+        except Exception as err:
+            self.error = err
+
+    def flush(self) -> None:
+        """
+        Blocks until every line written so far is on the file.
+        """
+        self.flush_buffer()
+        self.queue.join()
+        self.file.flush()
+        self.check()
+
+    def close(self) -> None:
+        atexit.unregister(self.close)
+        if self.writer.is_alive():
+            # Stops the writer even after a failed write (failures are raised by check below)
+            if self.buffer:
+                self.queue.put("".join(self.buffer))
+                self.buffer = []
+            self.queue.put(None)
+            self.writer.join()
+        if not self.file.closed:
+            self.file.close()
+        self.check()
+
+    def check(self) -> None:
+        if self.error is not None:
+            raise IOError("Writing @{0} failed: {1}".format(self.path, self.error))
@@ -0,0 +1,94 @@
+from collections import Counter
+from heapq import heapify, heappop, heappush
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving heavy hitters sketch (Metwally et al.) with a Counter like interface.
+    Keeps at most @capacity tokens: a new token evicts the least frequent one and inherits its
+    count, so counts are overestimated by at most error(token) <= total / capacity.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("SpaceSaving capacity must be positive!")
+        self.capacity = capacity
+        self.counts: Dict[str, int] = dict()
+        self.errors: Dict[str, int] = dict()
+        # Lazy min-heap of (count, token), stale entries are skipped on pop
+        self.heap: List[Tuple[int, str]] = []
+        self.total = 0
+
+    def add(self, token: str, count: int = 1) -> None:
+        self.total += count
+        counts = self.counts
+        if token in counts:
+            counts[token] += count
+        elif len(counts) < self.capacity:
+            counts[token] = count
+            self.errors[token] = 0
+        else:
+            min_count, min_token = self.pop_min()
+            del counts[min_token]
+            del self.errors[min_token]
+            counts[token] = min_count + count
+            self.errors[token] = min_count
+        heappush(self.heap, (counts[token], token))
+        if len(self.heap) > 4 * self.capacity:
+            self.compact()
+
+    def update(self, tokens: Union[Iterable[str], Dict[str, int]]) -> None:
+        """
+        Counts @tokens, or adds a {token: count} mapping (as Counter.update).
+        """
+        if hasattr(tokens, "items"):
+            for token, count in tokens.items():
+                self.add(token, count)
+        else:
+            for token in tokens:
+                self.add(token)
+
+    def pop_min(self) -> Tuple[int, str]:
+        while True:
+            count, token = heappop(self.heap)
+            if self.counts.get(token) == count:
+                return count, token
+
+    def compact(self) -> None:
+        self.heap = [(count, token) for token, count in self.counts.items()]
+        heapify(self.heap)
+
+    def error(self, token: str) -> int:
+        return self.errors.get(token, 0)
+
+    def items(self):
+        return self.counts.items()
+
+    def most_common(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        ranked = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return ranked if n is None else ranked[:n]
+
+    def __getitem__(self, token: str) -> int:
+        return self.counts.get(token, 0)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.counts
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __iter__(self):
+        return iter(self.counts)
+
+
+TokenCounter = Union[Counter, SpaceSaving]
+
+
+def build_counter(sketch_size: Optional[int] = None) -> TokenCounter:
+    """
+    Exact Counter, or a SpaceSaving sketch of @sketch_size tokens when memory is bounded.
+    """
+    if sketch_size:
+        return SpaceSaving(sketch_size)
+    return Counter()
@@ -1,8 +1,15 @@
+import functools
+import json
 import string
 import unicodedata
+from typing import Callable, List, Optional
+
 import gin
 import re
 
+NUMBERS_RGX = re.compile(r'\b[0-9]+\b')
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
 
 def strip_accents(s):
     return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
@@ -16,7 +23,7 @@ def clean_text(text):
     """
     text = strip_accents(text)
     text = text.lower().strip()
-    text = text.translate(str.maketrans("", "", string.punctuation))
+    text = text.translate(PUNCTUATION_TABLE)
     return text
 
 
@@ -52,18 +59,33 @@ def tokenize(data, sep=None):
         return data.split(sep)
     return data.split()
 
+def chained_default_process(data, dedup=False):
+    """
+    Reference (unfused) chain of @full_default_process [+ @remove_same_info].
+    """
+    sw = StopWords()
+    tokens = sw.filter_tokens(tokenize(remove_numbers(clean_text(data))))
+    if dedup:
+        unique = set()
+        tokens = [token for token in tokens if not (token in unique or unique.add(token))]
+    return " ".join(tokens)
+
+
 @gin.configurable
 def full_default_process(data):
-    sw = StopWords()
-    return " ".join(
-        sw.filter_tokens(
-            tokenize(
-                remove_numbers(
-                    clean_text(data)))))
+    return DEFAULT_NORMALIZER(data)
+
+
+@gin.configurable
+def full_default_process_dedup(data):
+    """
+    Same as (@full_default_process, @remove_same_info) in a single pass.
+    """
+    return DEDUP_NORMALIZER(data)
 
 
 def remove_numbers(text):
-    return re.sub(r'\b[0-9]+\b', '', text)
+    return NUMBERS_RGX.sub('', text)
 
 
 def normalize_compose_terms(term):
@@ -115,3 +137,198 @@ class StopWords:
         """
         clean_tokens = [token.strip() for token in text_tokens if token not in self.words and len(token) > 1]
         return clean_tokens
+
+
+class UnfoldableText(Exception):
+    pass
+
+
+class FoldTable(dict):
+    """
+    Lazy str.translate table that strips accents, lower cases and drops punctuation
+    char by char, as @clean_text does for the whole string.
+    Chars whose folding depends on their neighbours (non spacing combining marks left after NFD,
+    final sigma lower casing) cannot be folded alone and raise UnfoldableText.
+    """
+
+    def __init__(self):
+        super().__init__()
+        for codepoint in range(128):
+            self[codepoint] = self.fold(chr(codepoint))
+
+    @staticmethod
+    def fold(char):
+        folded = strip_accents(char)
+        if "\u03a3" in folded or any(unicodedata.combining(c) for c in folded):
+            raise UnfoldableText(char)
+        return folded.lower().translate(PUNCTUATION_TABLE)
+
+    def __missing__(self, codepoint):
+        folded = self.fold(chr(codepoint))
+        self[codepoint] = folded
+        return folded
+
+
+class TokenCache(dict):
+    """
+    Bounded raw token -> normalized token cache shared by the TextNormalizers.
+    Its dict entries are a frozen table preloaded from an earlier run's vocabulary and
+    misses go through an LRU cache of @maxsize tokens. Dropped tokens normalize to '' and
+    tokens that cannot be folded alone to None.
+    """
+
+    def __init__(self, normalize, maxsize: int = 2 ** 16):
+        super().__init__()
+        self.normalize = normalize
+        self.lru = functools.lru_cache(maxsize=maxsize)(normalize)
+        self.lookups = 0
+
+    def __missing__(self, token):
+        return self.lru(token)
+
+    def lookup(self, tokens: List[str]) -> List[Optional[str]]:
+        """
+        Normalizes @tokens through the cache, counting a lookup per token.
+        """
+        self.lookups += len(tokens)
+        return list(map(self.__getitem__, tokens))
+
+    def preload(self, tokens):
+        for token in tokens:
+            self[token] = self.normalize(token)
+
+    def cache_info(self):
+        lru_info = self.lru.cache_info()
+        hits = self.lookups - lru_info.misses
+        return {"lookups": self.lookups, "frozen_size": len(self),
+                "frozen_hits": self.lookups - lru_info.hits - lru_info.misses,
+                "lru_hits": lru_info.hits, "lru_misses": lru_info.misses,
+                "lru_size": lru_info.currsize, "lru_max_size": lru_info.maxsize,
+                "hit_rate": round(hits / self.lookups, 4) if self.lookups else 0.0}
+
+
+def normalize_token(token):
+    """
+    Normalizes a single whitespace free token as @full_default_process does.
+    :return: normalized token, '' when dropped or None when it cannot be folded alone
+    """
+    try:
+        folded = NUMBERS_RGX.sub('', token.translate(TextNormalizer.fold_table))
+    except UnfoldableText:
+        return None
+    if len(folded) > 1 and folded not in STOPWORDS:
+        return folded
+    return ''
+
+
+class TextNormalizer:
+    """
+    Compiled version of @full_default_process: raw tokens are normalized (accent folding, lower casing and
+    punctuation removal through one translate table, number stripping, stopword/short token filtering)
+    through the shared TokenCache, with optional dedup of repeated tokens (@remove_same_info).
+    Output is identical to the chained processes.
+    """
+    fold_table = FoldTable()
+
+    def __init__(self, dedup: bool = False):
+        self.dedup = dedup
+
+    def __call__(self, text):
+        tokens = TOKEN_CACHE.lookup(text.split())
+        if None in tokens:
+            return chained_default_process(text, dedup=self.dedup)
+        return self.join_tokens(tokens)
+
+    def join_tokens(self, tokens: List[str]) -> str:
+        tokens = [token for token in tokens if token]
+        if self.dedup:
+            return remove_repeated_tokens(tokens)
+        return " ".join(tokens)
+
+    def batch(self, texts: List[str]) -> List[str]:
+        """
+        Normalizes a batch of texts at once: texts are joined by a separator token into a single buffer
+        that is split, normalized and joined back in one go.
+        :param texts: list of raw texts
+        :return: list of normalized texts
+        """
+        if not texts:
+            return []
+
+        buffer = BATCH_SEPARATOR.join(texts)
+        if buffer.count(SEPARATOR_TOKEN) != len(texts) - 1:
+            return [self(text) for text in texts]
+
+        raw_tokens = buffer.split()
+        tokens = TOKEN_CACHE.lookup(raw_tokens)
+        if None in tokens:
+            return self.split_batch(texts, raw_tokens, tokens)
+
+        clean_texts = " ".join([token for token in tokens if token]).split(SEPARATOR_TOKEN)
+        if self.dedup:
+            return [remove_repeated_tokens(text.split()) for text in clean_texts]
+        return [text.strip() for text in clean_texts]
+
+
+    def split_batch(self, texts: List[str], raw_tokens: List[str], tokens: List[Optional[str]]) -> List[str]:
+        """
+        Normalizes each text of a batch from its tokens already looked up in the batch buffer, so no token
+        is looked up twice. Texts with a token that cannot be folded alone go through the chained process.
+        """
+        clean_texts = []
+        start = 0
+        for text in texts:
+            try:
+                end = raw_tokens.index(SEPARATOR_TOKEN, start)
+            except ValueError:
+                end = len(raw_tokens)
+            text_tokens = tokens[start:end]
+            if None in text_tokens:
+                clean_texts.append(chained_default_process(text, dedup=self.dedup))
+            else:
+                clean_texts.append(self.join_tokens(text_tokens))
+            start = end + 1
+        return clean_texts
+
+
+def remove_repeated_tokens(tokens: List[str]) -> str:
+    unique = set()
+    return " ".join([token for token in tokens if not (token in unique or unique.add(token))])
+
+
+def batch_process(texts: List[str], process: Callable[[str], str]) -> List[str]:
+    """
+    Applies a text process to a batch of texts, using its batch version when there is one.
+    """
+    normalizer = BATCH_PROCESSES.get(getattr(process, "__wrapped__", process))
+    if normalizer:
+        return normalizer.batch(texts)
+    return [process(text) for text in texts]
+
+
+@gin.configurable
+def setup_token_cache(cache_size: int = 2 ** 16, vocab_path: str = None):
+    """
+    (Re)builds the token normalization cache. To be called once at worker start.
+    :param cache_size: maximum number of tokens kept by the LRU cache
+    :param vocab_path: word2idx.json (or any json with tokens as keys/items) from an earlier run to preload
+    """
+    global TOKEN_CACHE
+    TOKEN_CACHE = TokenCache(normalize_token, cache_size)
+    if vocab_path:
+        with open(vocab_path, "r", encoding="utf-8") as js:
+            TOKEN_CACHE.preload(json.load(js))
+
+
+def token_cache_info():
+    return TOKEN_CACHE.cache_info()
+
+
+STOPWORDS = frozenset(StopWords.words)
+SEPARATOR_TOKEN = "\ue000\ue000"
+BATCH_SEPARATOR = " {} ".format(SEPARATOR_TOKEN)
+TOKEN_CACHE = TokenCache(normalize_token)
+DEFAULT_NORMALIZER = TextNormalizer()
+DEDUP_NORMALIZER = TextNormalizer(dedup=True)
+BATCH_PROCESSES = {getattr(full_default_process, "__wrapped__", full_default_process): DEFAULT_NORMALIZER,
+                   getattr(full_default_process_dedup, "__wrapped__", full_default_process_dedup): DEDUP_NORMALIZER}
@@ -0,0 +1,131 @@
+import os
+from typing import Dict, Tuple, Optional
+
+import gin
+import numpy as np
+import tensorflow as tf
+
+from pipelines.shards import ShardFields
+
+COMPRESSION_TYPES = {None: tf.python_io.TFRecordCompressionType.NONE,
+                     "GZIP": tf.python_io.TFRecordCompressionType.GZIP,
+                     "ZLIB": tf.python_io.TFRecordCompressionType.ZLIB}
+
+
+@gin.configurable
+class TFRecordShardWriter(object):
+    """
+    Writes aligned field rows (x_word, x_char, y_...) as tf.train.Example records split into
+    shards of @shard_size records: <folder>/<prefix>-00000.tfrecord, <prefix>-00001.tfrecord, ...
+    """
+
+    def __init__(self, folder: str, fields: ShardFields, prefix: str = "dataset", shard_size: int = 100000,
+                 compression: Optional[str] = None):
+        if compression not in COMPRESSION_TYPES:
+            raise ValueError("Unknown compression {0}! Known types: {1}".format(compression, list(COMPRESSION_TYPES)))
+        self.folder = folder
+        self.fields = fields
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.options = tf.python_io.TFRecordOptions(COMPRESSION_TYPES[compression])
+        self.shard = 0
+        self.shard_records = 0
+        self.writer = None
+
+    def shard_path(self, shard: int) -> str:
+        return os.path.join(self.folder, "{0}-{1:05d}.tfrecord".format(self.prefix, shard))
+
+    def build_example(self, row: Dict[str, np.ndarray]) -> tf.train.Example:
+        feature = dict()
+        for name, (dtype, _) in self.fields.items():
+            values = np.asarray(row[name]).ravel()
+            if np.issubdtype(np.dtype(dtype), np.floating):
+                feature[name] = tf.train.Feature(float_list=tf.train.FloatList(value=values.tolist()))
+            else:
+                feature[name] = tf.train.Feature(int64_list=tf.train.Int64List(value=values.tolist()))
+        return tf.train.Example(features=tf.train.Features(feature=feature))
+
+    def write(self, **arrays: np.ndarray) -> int:
+        """
+        Appends the same number of rows of every field, one tf.train.Example per row.
+        :return: number of rows written
+        """
+        rows = {len(arrays[name]) for name in self.fields}
+        if len(rows) != 1:
+            raise ValueError("Unaligned rows for records {}!".format({name: len(arr) for name, arr in arrays.items()}))
+        rows = rows.pop()
+
+        for i in range(rows):
+            if self.writer is None:
+                self.writer = tf.python_io.TFRecordWriter(self.shard_path(self.shard), options=self.options)
+            example = self.build_example({name: arrays[name][i] for name in self.fields})
+            self.writer.write(example.SerializeToString())
+            self.shard_records += 1
+            if self.shard_records >= self.shard_size:
+                self.rotate()
+        return rows
+
+    def rotate(self) -> None:
+        self.writer.close()
+        self.writer = None
+        self.shard += 1
+        self.shard_records = 0
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def feature_spec(fields: ShardFields) -> Dict[str, tf.FixedLenFeature]:
+    spec = dict()
+    for name, (dtype, row_shape) in fields.items():
+        tf_dtype = tf.float32 if np.issubdtype(np.dtype(dtype), np.floating) else tf.int64
+        spec[name] = tf.FixedLenFeature(list(row_shape), tf_dtype)
+    return spec
+
+
+@gin.configurable
+def build_input_fn(file_pattern: str, fields: ShardFields, inputs: Tuple[str, ...] = ("x_word", "x_char"),
+                   targets: Tuple[str, ...] = ("y_price",), batch_size: int = 32, epochs: Optional[int] = None,
+                   shuffle_buffer: int = 10000, cycle_length: int = 4, num_parallel_calls: int = 4,
+                   compression: Optional[str] = None):
+    """
+    Builds a tf.data input_fn over TFRecordShardWriter shards.
+    Shards are read in parallel (interleave), shuffled, batched and parsed per batch.
+    :param file_pattern: shards glob (i.e. "reduced/2019-02-13/ner_encoded/*/dataset-*.tfrecord")
+    :param fields: {name: (dtype, row shape)} used when the shards were written
+    :param inputs: fields returned as features dict
+    :param targets: fields returned as labels (a single tensor for one target)
+    :param batch_size: batch size
+    :param epochs: number of passes over the shards (None repeats forever)
+    :param shuffle_buffer: shuffle buffer size in records (0 disables shuffling)
+    :param cycle_length: number of shards read concurrently
+    :param num_parallel_calls: parallel parse calls
+    :param compression: None, "GZIP" or "ZLIB"
+    :return: input_fn returning (features, labels)
+    """
+    spec = feature_spec({name: fields[name] for name in tuple(inputs) + tuple(targets)})
+    compression_type = compression or ""
+
+    def parse_batch(serialized):
+        parsed = tf.parse_example(serialized, spec)
+        parsed = {name: tf.cast(tensor, tf.int32) if tensor.dtype == tf.int64 else tensor
+                  for name, tensor in parsed.items()}
+        features = {name: parsed[name] for name in inputs}
+        labels = [parsed[name] for name in targets]
+        return features, (labels[0] if len(labels) == 1 else tuple(labels))
+
+    def input_fn():
+        files = tf.data.Dataset.list_files(file_pattern, shuffle=bool(shuffle_buffer))
+        dataset = files.apply(tf.data.experimental.parallel_interleave(
+            lambda path: tf.data.TFRecordDataset(path, compression_type=compression_type),
+            cycle_length=cycle_length, sloppy=bool(shuffle_buffer)))
+        if shuffle_buffer:
+            dataset = dataset.shuffle(shuffle_buffer)
+        dataset = dataset.repeat(epochs)
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.map(parse_batch, num_parallel_calls=num_parallel_calls)
+        return dataset.prefetch(1)
+
+    return input_fn
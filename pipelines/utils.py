@@ -3,6 +3,7 @@ import logging
 import os
 import pickle
 import sys
+import zlib
 from datetime import datetime
 from typing import Any, Dict, List
 
@@ -51,6 +52,22 @@ def get_notice(perc: int, base: int=10000, msg_text: str = None) -> None:
         message("Time: {}".format(datetime.ctime(datetime.now())))
 
 
+def get_notice_step(previous: int, current: int, base: int=10000, msg_text: str = None) -> None:
+    """
+    get_notice for a counter that moved from @previous to @current in one step (i.e. a batch).
+    """
+    if current // base > previous // base:
+        get_notice((current // base) * base, base, msg_text)
+
+
+def hash_split(key: str, test_perc: float) -> bool:
+    """
+    Stable random train/test assignment of a record: True (test) for a @test_perc fraction of the keys,
+    the same in every process and run.
+    """
+    return zlib.crc32(key.encode("utf-8")) < test_perc * (1 << 32)
+
+
 def get_notice_full(perc: int, process_num: str, base: int=10000) -> None:
     if perc % base == 0:
         message("{0} data points processed @ {1}!".format(perc, process_num))
@@ -0,0 +1,191 @@
+import json
+import os
+import tempfile
+from heapq import merge
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import gin
+
+from pipelines import utils as sc
+from pipelines.reducer import Reducer
+from pipelines.vocabulary import Vocabulary, write_sorted_binary_vocabulary
+
+TokenCount = Tuple[str, int]
+
+
+def counts_path(folder: str, map_name: str) -> str:
+    return os.path.join(folder, "{}.counts.jsonl".format(map_name))
+
+
+def rank_key(item: TokenCount) -> Tuple[int, str]:
+    """
+    Deterministic id order: decreasing count, ties broken lexicographically.
+    """
+    return -item[1], item[0]
+
+
+def write_counts_shard(path: str, counts: Iterable[TokenCount], key=itemgetter(0)) -> None:
+    """
+    Writes (token, count) pairs sorted by @key (token by default), one json [token, count] per line.
+    """
+    with open(path, "w", encoding="utf-8") as js:
+        for token, count in sorted(counts, key=key):
+            js.write(json.dumps([token, count]) + "\n")
+
+
+def read_counts_shard(path: str) -> Iterator[TokenCount]:
+    with open(path, "r", encoding="utf-8") as js:
+        for line in js:
+            token, count = json.loads(line)
+            yield token, count
+
+
+def worker_counts(folder: str, map_name: str) -> Iterator[TokenCount]:
+    """
+    Token sorted counts of a worker map. Folders written before counts were kept only have the
+    {map_name}.json ids map, whose tokens are counted once.
+    """
+    if os.path.exists(counts_path(folder, map_name)):
+        return read_counts_shard(counts_path(folder, map_name))
+    tokens = sc.load_json(os.path.join(folder, "{}.json".format(map_name)))
+    return iter(sorted((token, 1) for token in tokens))
+
+
+def merge_counts(shards: List[Iterable[TokenCount]]) -> Iterator[TokenCount]:
+    """
+    Streaming k-way merge of token sorted shards, summing the counts of equal tokens.
+    Memory is bounded by the number of shards.
+    """
+    for token, group in groupby(merge(*shards, key=itemgetter(0)), key=itemgetter(0)):
+        yield token, sum(count for _, count in group)
+
+
+def external_sort(pairs: Iterable[TokenCount], folder: str, run_size: int = 1000000, key=itemgetter(0),
+                  prefix: str = "run") -> Iterator[TokenCount]:
+    """
+    External sort of @pairs by @key: sorted runs of @run_size pairs are spilled to @folder
+    and merged back, so memory is bounded by @run_size. @pairs are fully consumed before it returns.
+    """
+    pairs = iter(pairs)
+    runs = []
+    while True:
+        run = list(islice(pairs, run_size))
+        if not run:
+            break
+        path = os.path.join(folder, "{0}-{1:05d}.jsonl".format(prefix, len(runs)))
+        write_counts_shard(path, run, key=key)
+        runs.append(path)
+    return merge(*[read_counts_shard(path) for path in runs], key=key)
+
+
+def rank_counts(counts: Iterable[TokenCount], folder: str, run_size: int = 1000000) -> Iterator[TokenCount]:
+    """
+    External sort of @counts by rank_key.
+    """
+    return external_sort(counts, folder, run_size, key=rank_key)
+
+
+def vocabulary_entries(vocabulary: Vocabulary, ranked: Iterable[TokenCount], min_count: int = 1,
+                       max_vocab: Optional[int] = None) -> Iterator[Tuple[str, int]]:
+    """
+    (token, id) pairs of @vocabulary (reserved tokens) followed by @ranked tokens with contiguous ids.
+    :param vocabulary: reserved tokens (i.e. Vocabulary.base())
+    :param ranked: (token, count) pairs by rank_key
+    :param min_count: minimum count of a token
+    :param max_vocab: maximum number of tokens besides the reserved ones (None means no limit)
+    """
+    yield from vocabulary.items()
+    size = len(vocabulary)
+    for token, count in ranked:
+        if count < min_count or (max_vocab is not None and size - len(vocabulary) >= max_vocab):
+            break
+        if token in vocabulary:
+            continue
+        yield token, size
+        size += 1
+
+
+def tee_json_map(path: str, entries: Iterable[Tuple[str, int]]) -> Iterator[Tuple[str, int]]:
+    """
+    Passes (token, id) @entries through while streaming them as the json map @path.
+    """
+    with open(path, "w", encoding="utf-8") as js:
+        js.write("{")
+        for i, (token, idx) in enumerate(entries):
+            js.write("{0}{1}: {2}".format(", " if i else "", json.dumps(token), idx))
+            yield token, idx
+        js.write("}")
+
+
+def write_vocabulary(path: str, vocabulary: Vocabulary, ranked: Iterable[TokenCount], min_count: int = 1,
+                     max_vocab: Optional[int] = None) -> int:
+    """
+    Streams the json map of vocabulary_entries(@vocabulary, @ranked, @min_count, @max_vocab) to @path.
+    :return: map size
+    """
+    return sum(1 for _ in tee_json_map(path, vocabulary_entries(vocabulary, ranked, min_count, max_vocab)))
+
+
+def tee_counts(counts: Iterable[TokenCount], path: str) -> Iterator[TokenCount]:
+    """
+    Passes @counts through while writing them to the shard @path.
+    """
+    with open(path, "w", encoding="utf-8") as js:
+        for token, count in counts:
+            js.write(json.dumps([token, count]) + "\n")
+            yield token, count
+
+
+@gin.configurable
+class VocabularyReducer(Reducer):
+    """
+    Merges the workers' token sorted counts ({map_name}.counts.jsonl) with a streaming k-way merge
+    and writes the final {map_name}.json maps with deterministic ids (by frequency, then lexicographic).
+    Maps in @cutoff_maps keep only tokens seen @min_count times, up to the @max_vocab most frequent.
+    With @binary_maps each map is also written as {map_name}.vocab, memory-mapped by the encoders.
+    """
+
+    def __init__(self, main_folder: str, output_folder: str, dataset_name: str,
+                 maps: Tuple[str, ...] = ("char2idx", "word2idx"), unk_maps: Tuple[str, ...] = ("char2idx", "word2idx"),
+                 cutoff_maps: Tuple[str, ...] = ("word2idx",), min_count: int = 1, max_vocab: Optional[int] = None,
+                 run_size: int = 1000000, binary_maps: bool = True, debug: bool = False):
+        super().__init__(main_folder, output_folder, debug=debug)
+        self.dataset_name = dataset_name
+        self.maps = maps
+        self.unk_maps = unk_maps
+        self.cutoff_maps = cutoff_maps
+        self.min_count = min_count
+        self.max_vocab = max_vocab
+        self.run_size = run_size
+        self.binary_maps = binary_maps
+
+    def reduce_process(self):
+        workers_folder = sorted(os.path.join(self.main_folder, folder) for folder in os.listdir(self.main_folder))
+
+        if self.debug:
+            print("Paths being aggregated...")
+            print(workers_folder)
+
+        reduced_folder = sc.check_folder(os.path.join(self.output_folder, self.dataset_name))
+
+        sc.message("Processing files...")
+        for map_name in self.maps:
+            cutoff = map_name in self.cutoff_maps
+            with tempfile.TemporaryDirectory(dir=reduced_folder) as runs_folder:
+                merged = merge_counts([worker_counts(folder, map_name) for folder in workers_folder])
+                merged = tee_counts(merged, counts_path(reduced_folder, map_name))
+                entries = tee_json_map(os.path.join(reduced_folder, "{}.json".format(map_name)),
+                                       vocabulary_entries(Vocabulary.base(unk=map_name in self.unk_maps),
+                                                          rank_counts(merged, runs_folder, self.run_size),
+                                                          min_count=self.min_count if cutoff else 1,
+                                                          max_vocab=self.max_vocab if cutoff else None))
+                if self.binary_maps:
+                    # The json is written while the entries are spilled to token sorted runs
+                    size = write_sorted_binary_vocabulary(
+                        os.path.join(reduced_folder, "{}.vocab".format(map_name)),
+                        external_sort(entries, runs_folder, self.run_size, prefix="vocab"))
+                else:
+                    size = sum(1 for _ in entries)
+            sc.message("Saved {0}: {1} ids".format(map_name, size))
@@ -0,0 +1,452 @@
+import glob
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from itertools import islice
+from shutil import copyfileobj
+from typing import List, Dict, Tuple, Any, Optional, Iterable
+
+import numpy as np
+
+from pipelines import utils as sc
+
+PAD_TOKEN = "__PAD__"
+UNK_TOKEN = "UNK"
+VOCAB_MAGIC = b"UNVOCAB1"
+VOCAB_HEADER_SIZE = len(VOCAB_MAGIC) + 16
+
+
+class Vocabulary(dict):
+    """
+    Append-only token -> id map shared by an encoder across advertises (no per advertise copy).
+    New tokens get id len(vocabulary) + 1, as in the original word2idx/char2idx/tag2idx json maps.
+    A frozen vocabulary (update_maps=False) never grows: unknown tokens map to UNK.
+    """
+
+    def __init__(self, *args, frozen: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frozen = frozen
+
+    @classmethod
+    def base(cls, unk: bool = True, frozen: bool = False) -> "Vocabulary":
+        base_map = {PAD_TOKEN: 0, UNK_TOKEN: 1} if unk else {PAD_TOKEN: 0}
+        return cls(base_map, frozen=frozen)
+
+    @classmethod
+    def from_json(cls, json_file: str, frozen: bool = False) -> "Vocabulary":
+        return cls(sc.load_json(json_file), frozen=frozen)
+
+    def to_json(self, json_file: str) -> None:
+        sc.save_dict_2json(json_file, self)
+
+    def freeze(self) -> "Vocabulary":
+        self.frozen = True
+        return self
+
+    def __setitem__(self, token: str, idx: int) -> None:
+        if self.frozen:
+            raise TypeError("Vocabulary is frozen! Cannot add '{}'.".format(token))
+        super().__setitem__(token, idx)
+
+    def lookup_or_add(self, token: str) -> int:
+        """
+        Amortized O(1) lookup of @token id, inserting it when the vocabulary is not frozen.
+        """
+        idx = self.get(token)
+        if idx is None:
+            if self.frozen:
+                return self[UNK_TOKEN]
+            idx = len(self) + 1
+            super().__setitem__(token, idx)
+        return idx
+
+    def encode(self, tokens: List[str]) -> List[int]:
+        if self.frozen:
+            if UNK_TOKEN in self:
+                unk = self[UNK_TOKEN]
+                return [self.get(token, unk) for token in tokens]
+            return [self[token] for token in tokens]
+        return [self.lookup_or_add(token) for token in tokens]
+
+    def update_from(self, tokens: List[str]) -> None:
+        for token in tokens:
+            self.lookup_or_add(token)
+
+    def to_binary(self, vocab_file: str) -> None:
+        write_binary_vocabulary(vocab_file, self)
+
+
+def write_binary_vocabulary(vocab_file: str, vocabulary: Dict[str, int]) -> None:
+    """
+    Writes @vocabulary in the binary format read by MappedVocabulary:
+    header (magic, size, blob size), uint64 offsets[size + 1], int32 ids[size] and the utf-8 blob of
+    the tokens sorted by bytes (so lookups are a binary search over the mapped file).
+    """
+    write_sorted_binary_vocabulary(vocab_file, sorted(vocabulary.items()))
+
+
+def write_sorted_binary_vocabulary(vocab_file: str, items: Iterable[Tuple[str, int]], chunk_size: int = 65536) -> int:
+    """
+    Streams token sorted (token, id) @items to the binary vocabulary @vocab_file in bounded memory:
+    offsets, ids and blob are spilled to temporary files and assembled once the size is known.
+    (str order is the utf-8 bytes order, so token sorted items are byte sorted)
+    :return: vocabulary size
+    """
+    size, blob_size = 0, 0
+    items = iter(items)
+    with tempfile.TemporaryFile() as offsets_file, tempfile.TemporaryFile() as ids_file, \
+            tempfile.TemporaryFile() as blob_file:
+        offsets_file.write(array_bytes(array("Q", [0])))
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                break
+            offsets, ids = array("Q"), array("i")
+            for token, idx in chunk:
+                token = token.encode("utf-8")
+                blob_size += len(token)
+                offsets.append(blob_size)
+                ids.append(idx)
+                blob_file.write(token)
+            offsets_file.write(array_bytes(offsets))
+            ids_file.write(array_bytes(ids))
+            size += len(chunk)
+
+        with open(vocab_file, "wb") as vf:
+            vf.write(VOCAB_MAGIC + struct.pack("<QQ", size, blob_size))
+            for part in (offsets_file, ids_file, blob_file):
+                part.seek(0)
+                copyfileobj(part, vf)
+    return size
+
+
+def array_bytes(values: array) -> bytes:
+    """
+    Little endian bytes of @values (the binary vocabulary byte order).
+    """
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+class MappedVocabulary(object):
+    """
+    Read-only vocabulary over a memory-mapped binary file (see write_binary_vocabulary).
+    Nothing is deserialized on load: lookups binary search the mapped offsets/blob, so processes
+    mapping the same file share its pages. Hot tokens are memoized up to @memo_size entries.
+    Behaves as a frozen Vocabulary (unknown tokens map to UNK).
+    """
+    frozen = True
+
+    def __init__(self, vocab_file: str, memo_size: int = 65536):
+        self.vocab_file = vocab_file
+        with open(vocab_file, "rb") as vf:
+            self.mm = mmap.mmap(vf.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(VOCAB_MAGIC)] != VOCAB_MAGIC:
+            raise ValueError("{} is not a binary vocabulary!".format(vocab_file))
+        self.size, blob_size = struct.unpack_from("<QQ", self.mm, len(VOCAB_MAGIC))
+        view = memoryview(self.mm)
+        start = VOCAB_HEADER_SIZE
+        self.offsets = view[start:start + 8 * (self.size + 1)].cast("Q")
+        start += 8 * (self.size + 1)
+        self.ids = view[start:start + 4 * self.size].cast("i")
+        self.blob_start = start + 4 * self.size
+        self.memo: Dict[str, Optional[int]] = dict()
+        self.memo_size = memo_size
+        self.unk = self.get(UNK_TOKEN)
+
+    def find(self, token: str) -> Optional[int]:
+        key = token.encode("utf-8")
+        mm, offsets, blob_start = self.mm, self.offsets, self.blob_start
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = mm[blob_start + offsets[mid]:blob_start + offsets[mid + 1]]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return self.ids[mid]
+        return None
+
+    def get(self, token: str, default: Optional[int] = None) -> Optional[int]:
+        try:
+            idx = self.memo[token]
+        except KeyError:
+            idx = self.find(token)
+            if len(self.memo) >= self.memo_size:
+                self.memo.clear()
+            self.memo[token] = idx
+        return default if idx is None else idx
+
+    def __getitem__(self, token: str) -> int:
+        idx = self.get(token)
+        if idx is None:
+            raise KeyError(token)
+        return idx
+
+    def __contains__(self, token: str) -> bool:
+        return self.get(token) is not None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def lookup_or_add(self, token: str) -> int:
+        idx = self.get(token)
+        return self[UNK_TOKEN] if idx is None else idx
+
+    def encode(self, tokens: List[str]) -> List[int]:
+        if self.unk is not None:
+            return [self.get(token, self.unk) for token in tokens]
+        return [self[token] for token in tokens]
+
+    def items(self):
+        """
+        (token, id) pairs in id order (the insertion order of the original json map).
+        """
+        mm, offsets, blob_start = self.mm, self.offsets, self.blob_start
+        for i in sorted(range(self.size), key=self.ids.__getitem__):
+            yield mm[blob_start + offsets[i]:blob_start + offsets[i + 1]].decode("utf-8"), self.ids[i]
+
+    def to_vocabulary(self, frozen: bool = True) -> Vocabulary:
+        return Vocabulary(self.items(), frozen=frozen)
+
+    def to_json(self, json_file: str) -> None:
+        sc.save_dict_2json(json_file, dict(self.items()))
+
+
+def is_fresh_binary(json_file: str, vocab_file: str) -> bool:
+    """
+    Checks that @vocab_file exists and is not older than the json map it was written from.
+    """
+    return os.path.exists(vocab_file) and \
+        (not os.path.exists(json_file) or os.path.getmtime(vocab_file) >= os.path.getmtime(json_file))
+
+
+def load_vocabulary(folder: str, map_name: str, frozen: bool = False):
+    """
+    Loads the {map_name} map of @folder. Frozen maps are memory-mapped from {map_name}.vocab when it
+    is up to date with {map_name}.json, other maps are parsed from the json.
+    :param folder: maps folder
+    :param map_name: i.e. word2idx
+    :param frozen: the encoder does not update the map
+    :return: Vocabulary or MappedVocabulary
+    """
+    json_file = os.path.join(folder, "{}.json".format(map_name))
+    vocab_file = os.path.join(folder, "{}.vocab".format(map_name))
+    if frozen and is_fresh_binary(json_file, vocab_file):
+        return MappedVocabulary(vocab_file)
+    return Vocabulary.from_json(json_file, frozen=frozen)
+
+
+def export_binary_maps(folder: str) -> List[str]:
+    """
+    Writes the binary {map_name}.vocab of every {map_name}.json map in @folder (up to date ones are kept).
+    :return: written .vocab paths
+    """
+    written = []
+    for json_file in sorted(glob.glob(os.path.join(folder, "*2idx.json"))):
+        vocab_file = json_file[:-len(".json")] + ".vocab"
+        if is_fresh_binary(json_file, vocab_file):
+            continue
+        write_binary_vocabulary(vocab_file, sc.load_json(json_file))
+        written.append(vocab_file)
+    return written
+
+
+class HashedVocabulary(object):
+    """
+    Feature hashing token -> id map: reserved tokens (__PAD__, UNK) keep their ids and every other
+    token gets len(reserved) + crc32(token) % @buckets. Ids are stable across processes and runs,
+    so workers encode in a single pass without building or synchronizing maps.
+    With @track_collisions the distinct tokens are kept to report how many share a bucket.
+    """
+    frozen = True
+
+    def __init__(self, buckets: int, unk: bool = True, track_collisions: bool = False):
+        if buckets < 1:
+            raise ValueError("Number of hash buckets must be positive!")
+        self.buckets = buckets
+        self.reserved = Vocabulary.base(unk=unk, frozen=True)
+        self.offset = len(self.reserved)
+        self.tokens: Optional[Dict[str, int]] = dict() if track_collisions else None
+
+    def hash_token(self, token: str) -> int:
+        return self.offset + zlib.crc32(token.encode("utf-8")) % self.buckets
+
+    def __getitem__(self, token: str) -> int:
+        idx = self.reserved.get(token)
+        if idx is None:
+            idx = self.hash_token(token)
+            if self.tokens is not None:
+                self.tokens[token] = idx
+        return idx
+
+    def get(self, token: str, default: Optional[int] = None) -> int:
+        return self[token]
+
+    def __contains__(self, token: str) -> bool:
+        return True
+
+    def __len__(self) -> int:
+        return self.offset + self.buckets
+
+    def lookup_or_add(self, token: str) -> int:
+        return self[token]
+
+    def encode(self, tokens: List[str]) -> List[int]:
+        return [self[token] for token in tokens]
+
+    def collision_report(self) -> Dict[str, Any]:
+        """
+        Distinct hashed tokens, used buckets and the share of tokens colliding with another token
+        (None if collisions are not tracked).
+        """
+        if self.tokens is None:
+            return None
+        used = len(set(self.tokens.values()))
+        return {"buckets": self.buckets, "tokens": len(self.tokens), "used_buckets": used,
+                "load_factor": round(len(self.tokens) / self.buckets, 4),
+                "collision_rate": round(1 - used / len(self.tokens), 4) if self.tokens else 0.0}
+
+    def to_json(self, json_file: str) -> None:
+        """
+        Saves the hashing spec (the id of a token is reproduced from it, there is no token map).
+        """
+        sc.save_dict_2json(json_file, {"hash": "crc32", "buckets": self.buckets, "reserved": dict(self.reserved),
+                                       "size": len(self)})
+
+
+def encode_word_batch(sequences: List[List[str]], wordidx: Vocabulary, seq_max_len: int) -> np.ndarray:
+    """
+    Encodes a batch of token sequences into a post padded/truncated (batch, seq_max_len) int32 array.
+    Same output as keras pad_sequences(..., padding='post', truncating='post') over wordidx ids.
+    :param sequences: token sequences (i.e. pad_term_sequence output)
+    :param wordidx: vocabulary (grows with new tokens unless frozen)
+    :param seq_max_len: sequence length
+    :return: int32 array
+    """
+    batch = np.full((len(sequences), seq_max_len), wordidx[PAD_TOKEN], dtype=np.int32)
+    flat_idx: List[int] = []
+    flat_ids: List[int] = []
+    for i, sentence in enumerate(sequences):
+        ids = wordidx.encode(sentence[:seq_max_len])
+        base = i * seq_max_len
+        flat_idx.extend(range(base, base + len(ids)))
+        flat_ids.extend(ids)
+    batch.reshape(-1)[flat_idx] = flat_ids
+    return batch
+
+
+def encode_char_batch(sequences: List[List[str]], charidx: Vocabulary, seq_max_len: int,
+                      max_len_char: int) -> np.ndarray:
+    """
+    Encodes a batch of token sequences into a (batch, seq_max_len, max_len_char) int32 array of char ids.
+    Empty tokens are skipped, words are truncated to max_len_char and missing positions are __PAD__.
+    :param sequences: token sequences (i.e. pad_term_sequence output)
+    :param charidx: vocabulary (grows with new chars unless frozen)
+    :param seq_max_len: sequence length
+    :param max_len_char: chars per word
+    :return: int32 array
+    """
+    batch = np.full((len(sequences), seq_max_len, max_len_char), charidx[PAD_TOKEN], dtype=np.int32)
+    flat_idx: List[int] = []
+    flat_ids: List[int] = []
+    for i, sentence in enumerate(sequences):
+        words = [word for word in sentence if word != ''][:seq_max_len]
+        for j, word in enumerate(words):
+            ids = charidx.encode(word[:max_len_char])
+            base = (i * seq_max_len + j) * max_len_char
+            flat_idx.extend(range(base, base + len(ids)))
+            flat_ids.extend(ids)
+    batch.reshape(-1)[flat_idx] = flat_ids
+    return batch
+
+
+class WordCache(object):
+    """
+    Word -> (word id, char id row) table backed by int32 arrays, so encoding a batch is a gather
+    over cached rows instead of max_len_char char lookups per word.
+    Row 0 is the padding row (__PAD__ word id and a __PAD__ char row).
+    Rows stay valid while the vocabularies are append-only (or frozen). The table is cleared before
+    a batch once it holds @max_size words.
+    """
+
+    def __init__(self, wordidx: Vocabulary, charidx: Vocabulary, max_len_char: int, max_size: int = 1 << 20,
+                 capacity: int = 4096):
+        self.wordidx = wordidx
+        self.charidx = charidx
+        self.max_len_char = max_len_char
+        self.max_size = max_size
+        self.index: Dict[str, int] = dict()
+        self.word_ids = np.empty(capacity, dtype=np.int32)
+        self.char_rows = np.empty((capacity, max_len_char), dtype=np.int32)
+        self.word_ids[0] = wordidx[PAD_TOKEN]
+        self.char_rows[0] = charidx[PAD_TOKEN]
+        self.size = 1
+        self.hits = 0
+        self.misses = 0
+        self.clears = 0
+
+    def add(self, word: str) -> int:
+        if self.size == len(self.word_ids):
+            self.word_ids = np.resize(self.word_ids, 2 * self.size)
+            self.char_rows = np.resize(self.char_rows, (2 * self.size, self.max_len_char))
+
+        row = self.size
+        chars = self.charidx.encode(word[:self.max_len_char])
+        self.word_ids[row] = self.wordidx.lookup_or_add(word)
+        self.char_rows[row, :len(chars)] = chars
+        self.char_rows[row, len(chars):] = self.charidx[PAD_TOKEN]
+        self.index[word] = row
+        self.size += 1
+        return row
+
+    def rows(self, sentence: List[str]) -> List[int]:
+        index = self.index
+        rows = []
+        for word in sentence:
+            row = index.get(word)
+            if row is None:
+                self.misses += 1
+                row = self.add(word)
+            else:
+                self.hits += 1
+            rows.append(row)
+        return rows
+
+    def encode_batch(self, sequences: List[List[str]], seq_max_len: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same output (and vocabulary updates) as encode_word_batch/encode_char_batch over @sequences.
+        :param sequences: token sequences (i.e. pad_term_sequence output)
+        :param seq_max_len: sequence length
+        :return: x_word (batch, seq_max_len) and x_char (batch, seq_max_len, max_len_char) int32 arrays
+        """
+        # Cleared between batches only, rows of the current batch must stay valid
+        if len(self.index) >= self.max_size:
+            self.index.clear()
+            self.size = 1
+            self.clears += 1
+
+        word_rows = np.zeros((len(sequences), seq_max_len), dtype=np.int64)
+        char_rows = np.zeros((len(sequences), seq_max_len), dtype=np.int64)
+        for i, sentence in enumerate(sequences):
+            sentence = sentence[:seq_max_len]
+            rows = self.rows(sentence)
+            word_rows[i, :len(rows)] = rows
+            # Char rows skip empty tokens
+            rows = [row for word, row in zip(sentence, rows) if word != '']
+            char_rows[i, :len(rows)] = rows
+        return self.word_ids[word_rows], self.char_rows[char_rows]
+
+    def cache_info(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self.index), "max_size": self.max_size, "clears": self.clears,
+                "nbytes": self.word_ids.nbytes + self.char_rows.nbytes}
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from pipelines.advertise import Advertise
+
+
+def parsed_items():
+    """
+    (key, value) pairs in the order Parser.get_general_schema and the cleaner stages set them.
+    """
+    return [("url", "https://produto.mercadolivre.com.br/MLB-1"), ("id", "abc"), ("market", "MercadoLivre"),
+            ("post_category", ["Celulares"]), ("product_full_attributes", {"Marca": "Apple"}),
+            ("region", "sp"), ("title", "Iphone 8"), ("detail", "novo"), ("price", 1200.0),
+            ("dt_publish", None), ("datetime", "2019-01-01T00:00:00Z"), ("category", "celular-e-telefone"),
+            ("clean_text", "iphone 8 novo"), ("clean_text_invert", "novo iphone 8"), ("NER", [["iphone", "O"]])]
+
+
+def test_iteration_matches_dict_order():
+    advertise, expected = Advertise(), dict()
+    for key, value in parsed_items():
+        advertise[key] = value
+        expected[key] = value
+        assert list(advertise) == list(expected)
+        assert len(advertise) == len(expected)
+    assert json.dumps(advertise.to_dict()) == json.dumps(expected)
+    assert Advertise(expected).to_dict() == expected
+    assert list(Advertise(title="a", url="b", extra=1)) == ["url", "extra", "title"]
+    assert not hasattr(advertise, "__dict__")
+
+
+def test_deletion():
+    advertise = Advertise(parsed_items())
+    del advertise["title"]
+    del advertise["post_category"]
+    assert "title" not in advertise and "post_category" not in advertise
+    assert len(advertise) == len(parsed_items()) - 2
+    assert list(advertise) == [key for key, _ in parsed_items() if key not in ("title", "post_category")]
+    for key in ("title", "post_category", "missing"):
+        with pytest.raises(KeyError):
+            del advertise[key]
+        with pytest.raises(KeyError):
+            advertise[key]
+    assert advertise.get("title") is None
+    # A deleted extra is added back at the end of the extras
+    advertise["post_category"] = []
+    assert list(advertise)[3:5] == ["product_full_attributes", "post_category"]
+
+
+def test_copy():
+    advertise = Advertise(parsed_items())
+    tmp_ad = advertise.copy()
+    assert tmp_ad.to_dict() == advertise.to_dict() and list(tmp_ad) == list(advertise)
+    tmp_ad["title"] = "Moto G5"
+    tmp_ad["post_category"] = []
+    tmp_ad["new_extra"] = 1
+    del tmp_ad["price"]
+    assert advertise["title"] == "Iphone 8" and advertise["post_category"] == ["Celulares"]
+    assert "new_extra" not in advertise and advertise["price"] == 1200.0
+    assert Advertise().copy().to_dict() == {}
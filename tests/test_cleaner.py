@@ -0,0 +1,120 @@
+import functools
+
+import gin
+import pandas as pd
+import pytest
+
+import pipelines.cleaner as dc
+import pipelines.text_processors as tp
+from pipelines.advertise import Advertise
+from pipelines.plan import ExecutionPlan, build_clean_plan
+
+DETAIL = "Aparelho novo, na caixa, com nota fiscal. Acompanha carregador original e capinha. " * 4
+
+
+@gin.configurable
+def fragile_process(text):
+    if "quebrado" in text:
+        raise ValueError("Cannot process {}".format(text))
+    return text
+
+
+@pytest.fixture(autouse=True)
+def clear_gin():
+    gin.clear_config()
+    yield
+    gin.clear_config()
+
+
+def build_advertises():
+    fields = [{"title": "Iphone 8 Plus 64GB", "detail": "Novo novo!"},
+              {"title": "Iphone 8 Plus 64GB " * 6, "detail": DETAIL},
+              {"title": "Moto G5", "detail": DETAIL},
+              {"title": "Galaxy S8", "detail": DETAIL[:150]},
+              {"title": "Galaxy S8", "detail": ""},
+              {"title": "Galaxy S8", "detail": None},
+              {"title": "Galaxy S8 quebrado"},
+              {"title": "", "detail": DETAIL},
+              {"title": None, "detail": "Novo"},
+              {"detail": "Novo"},
+              {}]
+    return [Advertise(id=str(i), **field) for i, field in enumerate(fields)]
+
+
+def per_record(process, advertises):
+    """
+    Per record results of @process, skipping the records it raises on.
+    """
+    results = []
+    for advertise in advertises:
+        try:
+            advertise = process(advertise)
+        except Exception:
+            continue
+        if advertise is not None:
+            results.append(advertise.to_dict())
+    return results
+
+
+@pytest.mark.parametrize("invert", [False, True])
+def test_build_model_input_batch_matches_single_records(invert):
+    advertises = build_advertises()
+    expected = []
+    for advertise in advertises:
+        try:
+            expected.append(dc.build_model_input(advertise, invert=invert))
+        except Exception:
+            expected.append(None)
+    assert dc.build_model_input_batch(advertises, invert=invert) == expected
+    assert dc.build_model_input_batch([], invert=invert) == []
+
+
+@pytest.mark.parametrize("as_frame", [False, True])
+def test_clean_base_advertise_batch_matches_single_records(as_frame):
+    pipeline = (functools.partial(dc.create_clean_text_field, text_process_pipeline=(tp.full_default_process_dedup,)),
+                functools.partial(dc.create_clean_text_field_inverted, text_process_pipeline=(tp.full_default_process,)),
+                lambda advertise: None if advertise["id"] == "3" else advertise)
+    assert [dc.batch_stage(process).func for process in pipeline[:2]] == \
+           [dc.create_clean_text_field_batch, dc.create_clean_text_field_inverted_batch]
+    assert dc.batch_stage(pipeline[2]) is not pipeline[2]
+
+    expected = per_record(functools.partial(dc.clean_base_advertise, process_pipeline=pipeline), build_advertises())
+    advertises = build_advertises()
+    if as_frame:
+        advertises = pd.DataFrame([advertise.to_dict() for advertise in advertises])
+    clean_advertises = dc.clean_base_advertise_batch(advertises, process_pipeline=pipeline)
+    if as_frame:
+        # Missing DataFrame cells come back as NaN
+        expected = [{key: value for key, value in advertise.items() if key != "detail" or value is not None}
+                    for advertise in expected]
+        clean_advertises = [{key: value for key, value in advertise.items() if key != "detail" or value == value}
+                            for advertise in clean_advertises]
+        assert clean_advertises == expected
+    else:
+        assert [advertise.to_dict() for advertise in clean_advertises] == expected
+    assert [advertise["id"] for advertise in expected] == ["0", "1", "2", "4", "5", "6"]
+
+
+def clean_plan():
+    """
+    The configured clean stages, without the validation of the records.
+    """
+    return ExecutionPlan([], build_clean_plan().clean_stages)
+
+
+def test_failed_batch_falls_back_to_single_records():
+    gin.parse_config("""
+        clean_base_advertise.process_pipeline = (@create_clean_text_field, @create_clean_text_field_inverted)
+        create_clean_text_field.text_process_pipeline = (@fragile_process, @full_default_process)
+        create_clean_text_field_inverted.text_process_pipeline = (@full_default_process_dedup, )
+    """)
+    plan = clean_plan()
+    expected = per_record(dc.clean_base_advertise, build_advertises())
+    assert [advertise["id"] for advertise in expected] == ["0", "1", "2", "3", "4", "5"]
+    assert [advertise.to_dict() for advertise in plan.run_batch(build_advertises())] == expected
+
+    gin.parse_config("create_clean_text_field.text_process_pipeline = (@full_default_process, )")
+    plan = clean_plan()
+    expected = per_record(dc.clean_base_advertise, build_advertises())
+    assert [advertise["id"] for advertise in expected] == ["0", "1", "2", "3", "4", "5", "6"]
+    assert [advertise.to_dict() for advertise in plan.run_batch(build_advertises())] == expected
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from pipelines.encoder import BaseEncoder
+
+# main imports the parser, which loads the category model with keras
+main = pytest.importorskip("main")
+
+
+class FragileEncoder(BaseEncoder):
+    """
+    Records the batches it is given and fails on the advertises marked as broken.
+    """
+    instances = []
+
+    def __init__(self):
+        super().__init__()
+        self.batches, self.saved = [], False
+        FragileEncoder.instances.append(self)
+
+    def encode_advertise(self, advertise):
+        self.encode_batch([advertise])
+
+    def encode_batch(self, advertises):
+        if any(advertise.get("broken") for advertise in advertises):
+            raise ValueError("broken batch")
+        self.batches.append([advertise["id"] for advertise in advertises])
+        return len(advertises)
+
+    def save_encoded_data(self):
+        pass
+
+    def preload_maps(self, folder=None):
+        pass
+
+    def save_maps(self):
+        self.saved = True
+
+
+def test_clean_pipeline_survives_failed_batches(tmp_path):
+    path = str(tmp_path / "ads.jsonl")
+    with open(path, "w", encoding="utf-8") as fl:
+        for i in range(7):
+            fl.write(json.dumps({"id": i, "broken": i == 3}) + "\n")
+    main.clean([path], encoder=FragileEncoder, batch_size=2)
+    encoder = FragileEncoder.instances[-1]
+    assert encoder.batches == [[0, 1], [4, 5], [6]]
+    assert encoder.saved
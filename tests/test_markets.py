@@ -0,0 +1,67 @@
+import datetime
+
+import pytest
+
+from pipelines.markets import UNKNOWN_MARKET, extra_fields, get_market_by_name, get_market_parser
+from pipelines.markets.mercadolivre import ML_FIELDS
+from pipelines.markets.registry import SOLR_DATE_FORMAT, get_market_by_keyword
+
+
+def substring_market(url):
+    """
+    Market names of the former url substring dispatch.
+    """
+    for keyword, name in (("olx", "OLX"), ("mercadolivre", "MercadoLivre"), ("enjoei", "Enjoei")):
+        if keyword in url:
+            return name
+    return None
+
+
+@pytest.mark.parametrize("url,market", [
+    ("https://sp.olx.com.br/celulares/iphone-8-123", "OLX"),
+    ("http://olx.com.br/anuncio/1", "OLX"),
+    ("https://produto.mercadolivre.com.br/MLB-1019-iphone", "MercadoLivre"),
+    ("https://www.enjoei.com.br/p/iphone-8", "Enjoei"),
+    ("https://enjoei.com/p/iphone-8", "Enjoei"),
+    # The host wins over keywords elsewhere in the url
+    ("https://produto.mercadolivre.com.br/MLB-1-capa-olx", "MercadoLivre"),
+    ("https://www.enjoei.com.br/p/capa-mercadolivre", "Enjoei"),
+])
+def test_dispatch_by_host(url, market):
+    assert get_market_parser(url).name == market
+
+
+@pytest.mark.parametrize("url", [
+    "https://m.olx.pt/anuncio/1", "https://mercadolivre.mirror.net/MLB-1", "https://cdn.example.com/enjoei/1",
+    "https://olx-mercadolivre.example.com/", "https://www.example.com/iphone", "olx.com.br/sem-esquema", "",
+])
+def test_keyword_fallback_matches_substring_dispatch(url):
+    market = get_market_parser(url)
+    assert (market.name if market else None) == substring_market(url)
+    assert get_market_by_keyword(url) is market
+
+
+def test_market_lookup_and_fields():
+    assert get_market_by_name("MercadoLivre").extra_fields == ML_FIELDS
+    assert get_market_by_name("Unknown") is None
+    assert extra_fields() == ML_FIELDS
+
+
+def test_market_dates():
+    year = datetime.datetime.utcnow().year
+    olx = get_market_by_name("OLX")
+    assert olx.date("Inserido em: 15 Março às 09:41") == "{}-03-15T09:41:00Z".format(year)
+    for market, datestr in ((olx, "sem data"), (UNKNOWN_MARKET, "15 Março às 09:41")):
+        parsed = datetime.datetime.strptime(market.date(datestr), SOLR_DATE_FORMAT)
+        assert abs((datetime.datetime.utcnow() - parsed).total_seconds()) < 60
+
+
+def test_mercadolivre_projects_extra_fields():
+    market = get_market_by_name("MercadoLivre")
+    advertise = {"url": "https://produto.mercadolivre.com.br/MLB-1", "user_medals": "<div></div>",
+                 "post_category": "Celulares e Telefones     Celulares e Smartphones     Voltar     iPhone"}
+    parsed = market.parse_advertise(advertise, ("post_category",))
+    assert parsed is advertise
+    assert "user_medals" not in parsed
+    assert parsed["post_category"] == ["Celulares e Telefones", "Celulares e Smartphones", "iPhone"]
+    assert UNKNOWN_MARKET.parse_advertise({"a": 1}, ML_FIELDS) == {"a": 1}
@@ -0,0 +1,172 @@
+import glob
+import json
+import os
+import random
+
+import pytest
+
+from pipelines import utils as sc
+from pipelines.ner.encoder import NEREncoder, NERReducer
+from pipelines.shards import load_npy_dataset
+
+SEQ_MAX_LEN, MAX_LEN_CHAR = 8, 4
+
+
+def fixture_ads(count: int = 40, seed: int = 5):
+    rnd = random.Random(seed)
+    words = ["samsung", "galaxy", "s8", "64gb", "preto", "novo", "iphone", "ç", "", "UNK", "__PAD__", "moto", "g5"]
+    tags = ["O", "MARCA", "MODELO", "MEMORIA", "COR"]
+    return [{"id": "ad-{}".format(i),
+             "NER": [[rnd.choice(words), rnd.choice(tags)] for _ in range(rnd.randint(1, SEQ_MAX_LEN + 2))]}
+            for i in range(count)]
+
+
+def legacy_word_ids(sentence, wordidx, update_maps):
+    ids = []
+    for word in sentence:
+        if word not in wordidx:
+            if not update_maps:
+                ids.append(wordidx["UNK"])
+                continue
+            wordidx[word] = len(wordidx) + 1
+        ids.append(wordidx[word])
+    return ids
+
+
+def legacy_char_ids(sentence, charidx, update_maps):
+    sentence = [word for word in sentence if word != ""]
+    rows = []
+    for i in range(SEQ_MAX_LEN):
+        row = []
+        for j in range(MAX_LEN_CHAR):
+            try:
+                char = sentence[i][j]
+            except IndexError:
+                row.append(charidx["__PAD__"])
+                continue
+            if char not in charidx and update_maps:
+                charidx[char] = len(charidx) + 1
+            row.append(charidx.get(char, charidx["UNK"]))
+        rows.append(row)
+    return rows
+
+
+def legacy_encode(ads, maps, update_maps):
+    """
+    Reference rows and maps of the former per advertise encoder (map copies and keras padding).
+    """
+    rows = []
+    for ad in ads:
+        words = NEREncoder.pad_term_sequence([term[0] for term in ad["NER"]], SEQ_MAX_LEN)
+        tags = NEREncoder.pad_term_sequence([term[1] for term in ad["NER"]], SEQ_MAX_LEN)
+        rows.append({"x_word": [legacy_word_ids(words, maps["word2idx"], update_maps)],
+                     "x_char": legacy_char_ids(words, maps["char2idx"], update_maps),
+                     "y_tag": [legacy_word_ids(tags, maps["tag2idx"], update_maps)]})
+    return rows
+
+
+def run_encoder(folder, ads, batch: bool, **kwargs):
+    encoder = NEREncoder(seq_max_len=SEQ_MAX_LEN, max_len_char=MAX_LEN_CHAR, model_folder=folder, debug=False,
+                         test_perc=None, **kwargs)
+    if batch:
+        for start in range(0, len(ads), 16):
+            encoder.encode_batch(ads[start:start + 16])
+    else:
+        for ad in ads:
+            encoder.encode_advertise(ad)
+    encoder.save_maps()
+    with open(os.path.join(encoder.model_folder, "dataset.jsonl"), "r", encoding="utf-8") as js:
+        rows = [json.loads(line) for line in js]
+    maps = {name: sc.load_json(os.path.join(encoder.model_folder, "{}.json".format(name)))
+            for name in ("word2idx", "char2idx", "tag2idx")}
+    return rows, maps
+
+
+@pytest.mark.parametrize("batch", [False, True])
+@pytest.mark.parametrize("word_cache_size", [0, 1 << 20, 8])
+def test_encoder_matches_legacy_encoding(tmp_path, batch, word_cache_size):
+    ads = fixture_ads()
+    expected_maps = {"char2idx": {"__PAD__": 0, "UNK": 1}, "word2idx": {"__PAD__": 0, "UNK": 1},
+                     "tag2idx": {"__PAD__": 0}}
+    expected_rows = legacy_encode(ads, expected_maps, update_maps=True)
+
+    rows, maps = run_encoder(str(tmp_path / "update"), ads, batch, update_maps=True, word_cache_size=word_cache_size)
+    assert rows == expected_rows
+    assert {name: list(m.items()) for name, m in maps.items()} == \
+           {name: list(m.items()) for name, m in expected_maps.items()}
+
+    # Frozen maps from the first pass, with words and chars they do not know
+    maps_folder = glob.glob(str(tmp_path / "update" / "*" / "*"))[0]
+    unknown_ads = [{"NER": [[word + "x€", tag] for word, tag in ad["NER"]]} for ad in ads[:10]]
+    expected_rows = legacy_encode(ads + unknown_ads, expected_maps, update_maps=False)
+    rows, frozen_maps = run_encoder(str(tmp_path / "frozen"), ads + unknown_ads, batch, maps_folder=maps_folder,
+                                    word_cache_size=word_cache_size)
+    assert rows == expected_rows
+    assert frozen_maps == maps
+
+
+def read_split(folder, output_format):
+    """
+    Sorted x_word rows of a split folder.
+    """
+    if output_format == "npy":
+        return sorted(load_npy_dataset(folder)["x_word"].tolist())
+    with open(os.path.join(folder, "dataset.jsonl"), "r", encoding="utf-8") as js:
+        return sorted(json.loads(line)["x_word"][0] for line in js)
+
+
+def encode_workers(main_folder, output_format):
+    """
+    Two workers, the second without test rows (and without test files, as a lazily created output).
+    """
+    ads = fixture_ads(60)
+    folders = []
+    for worker_ads in (ads, [ad for ad in ads if not sc.hash_split(ad["id"], 0.3)][:5]):
+        encoder = NEREncoder(seq_max_len=SEQ_MAX_LEN, max_len_char=MAX_LEN_CHAR, model_folder=main_folder, debug=False,
+                             test_perc=0.3, output_format=output_format, update_maps=True)
+        encoder.encode_batch(worker_ads)
+        encoder.save_maps()
+        folders.append(encoder.model_folder)
+    for path in glob.glob(os.path.join(folders[1], "test", "*")):
+        os.remove(path)
+    return folders
+
+
+@pytest.mark.parametrize("output_format", ["jsonl", "npy"])
+def test_reducer_merges_splits_with_empty_worker_splits(tmp_path, output_format):
+    folders = encode_workers(str(tmp_path / "workers"), output_format)
+    reducer = NERReducer(str(tmp_path / "workers"), str(tmp_path / "reduced"))
+    reducer.reduce_process()
+
+    reduced_folder = os.path.join(reducer.output_folder, "ner_encoded")
+    assert not os.listdir(os.path.join(folders[1], "test"))
+    for split in ("train", "test"):
+        expected = sorted(sum([read_split(os.path.join(folder, split), output_format)
+                               for folder in folders if os.listdir(os.path.join(folder, split))], []))
+        assert expected and read_split(os.path.join(reduced_folder, split), output_format) == expected
+    assert os.path.isfile(os.path.join(reduced_folder, "word2idx.json"))
+
+
+def test_reducer_copies_tfrecord_shards_of_every_worker(tmp_path):
+    reducer = NERReducer(str(tmp_path / "workers"), str(tmp_path / "reduced"))
+    # TFRecord shards are copied without being decoded, so any bytes do
+    for worker, shards in (("w0", {"train": 2, "test": 0}), ("w1", {"train": 1, "test": 1})):
+        for split, count in shards.items():
+            folder = sc.check_folder(os.path.join(reducer.main_folder, worker, split))
+            for shard in range(count):
+                with open(os.path.join(folder, "dataset-{0:05d}.tfrecord".format(shard)), "wb") as fl:
+                    fl.write("{0}/{1}/{2}".format(worker, split, shard).encode())
+    reducer.reduce_process()
+
+    reduced_folder = os.path.join(reducer.output_folder, "ner_encoded")
+    assert sorted(os.listdir(os.path.join(reduced_folder, "train"))) == \
+        ["w0-dataset-00000.tfrecord", "w0-dataset-00001.tfrecord", "w1-dataset-00000.tfrecord"]
+    assert os.listdir(os.path.join(reduced_folder, "test")) == ["w1-dataset-00000.tfrecord"]
+    with open(os.path.join(reduced_folder, "test", "w1-dataset-00000.tfrecord"), "rb") as fl:
+        assert fl.read() == b"w1/test/0"
+
+
+def test_reducer_rejects_unsplit_workers(tmp_path):
+    run_encoder(str(tmp_path / "workers"), fixture_ads(), batch=True)
+    with pytest.raises(ValueError):
+        NERReducer(str(tmp_path / "workers"), str(tmp_path / "reduced")).reduce_process()
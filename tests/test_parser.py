@@ -0,0 +1,41 @@
+import pytest
+
+# The parser loads the category model with keras
+Parser = pytest.importorskip("pipelines.parser").Parser
+
+
+def scrap(*keys):
+    return {key: "{} value".format(key) for key in keys}
+
+
+def test_shape_resolution_is_cached():
+    parser = Parser(shape_cache_size=4)
+    ml = scrap("url", "post_title", "post_description", "product_price", "geo_city", "post_dt_publish")
+    olx = scrap("url", "title", "detail", "price", "city", "dt_publish")
+    assert parser.get_title_field(ml) == "post_title value"
+    assert parser.get_title_field(olx) == "title value"
+    assert parser.get_region_field(ml) == "geo_city value"
+    assert parser.get_date_field(olx) == "dt_publish value"
+    assert parser.get_region_field(scrap("url")) == "brasil"
+    info = parser.shape_cache_info()
+    assert (info["hits"], info["misses"], info["size"], info["max_size"]) == (2, 3, 3, 4)
+
+
+def test_shape_cache_evicts_least_recently_used():
+    parser = Parser(shape_cache_size=3)
+    shapes = [scrap("url", "title{}".format(i)) for i in range(3)]
+    for shape in shapes:
+        parser.resolve_shape(shape)
+    # shapes[0] is used again, so shapes[1] is the one evicted by a new shape
+    parser.resolve_shape(shapes[0])
+    parser.resolve_shape(scrap("url", "title3"))
+    assert list(parser.shape_cache) == [tuple(shapes[2]), tuple(shapes[0]), ("url", "title3")]
+    parser.resolve_shape(shapes[0])
+    assert parser.shape_cache_info()["hits"] == 2
+    parser.resolve_shape(shapes[1])
+    info = parser.shape_cache_info()
+    assert (info["hits"], info["misses"], info["size"]) == (2, 5, 3)
+
+    for i in range(100):
+        parser.resolve_shape(scrap("url", "detail{}".format(i)))
+    assert parser.shape_cache_info()["size"] == 3
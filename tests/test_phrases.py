@@ -0,0 +1,49 @@
+import random
+
+from pipelines.phrases import AhoCorasick, leftmost_longest, mark_spans
+
+PHRASES = ["moto g", "moto g5", "g5 plus", "galaxy s", "galaxy s8", "s8 plus", "iphone x", "x", "aa", "aaa", "a a"]
+
+
+def naive_spans(text, phrases):
+    return sorted((start, start + len(phrase)) for phrase in set(phrases) if phrase
+                  for start in range(len(text)) if text.startswith(phrase, start))
+
+
+def naive_leftmost_longest(text, phrases):
+    spans, pos = [], 0
+    while pos < len(text):
+        lengths = [len(phrase) for phrase in phrases if phrase and text.startswith(phrase, pos)]
+        if lengths:
+            spans.append((pos, pos + max(lengths)))
+            pos += max(lengths)
+        else:
+            pos += 1
+    return spans
+
+
+def random_texts(count: int = 300, seed: int = 2):
+    rnd = random.Random(seed)
+    words = "moto g g5 plus galaxy s s8 iphone x a aa novo".split()
+    return [" ".join(rnd.choice(words) for _ in range(rnd.randint(0, 15))) for _ in range(count)]
+
+
+def test_finditer_matches_naive_scan():
+    matcher = AhoCorasick(PHRASES + [""])
+    assert len(matcher) > 0
+    for text in random_texts() + ["aaaa", "", "moto g5 plus galaxy s8 plus"]:
+        assert sorted(matcher.finditer(text)) == naive_spans(text, PHRASES), text
+
+
+def test_leftmost_longest_matches_naive_scan():
+    matcher = AhoCorasick(PHRASES)
+    for text in random_texts(seed=4):
+        assert leftmost_longest(matcher.finditer(text)) == naive_leftmost_longest(text, PHRASES), text
+
+
+def test_mark_spans():
+    text = "moto g5 plus galaxy s8 plus"
+    spans = leftmost_longest(AhoCorasick(PHRASES).finditer(text))
+    assert mark_spans(text, spans) == "**moto g5** plus **galaxy s8** plus"
+    assert mark_spans(text, []) == text
+    assert list(AhoCorasick().finditer(text)) == []
@@ -0,0 +1,98 @@
+import gin
+import pytest
+
+import pipelines.cleaner as dc
+import pipelines.text_processors  # registers the text processes of the configs
+import pipelines.validation as val
+from pipelines.advertise import Advertise
+from pipelines.plan import bind_configurable, build_clean_plan
+
+
+@gin.configurable
+def upper_title_stage(suffix: str = ""):
+    def stage(advertise):
+        advertise["title"] = advertise["title"].upper() + suffix
+        return advertise
+    return stage
+
+
+CONFIGS = {
+    "no stages": "clean_base_advertise.process_pipeline = ()",
+    "text pipes": """
+        valid_advertise.category = "celular-e-telefone"
+        clean_base_advertise.process_pipeline = (@create_clean_text_field, @create_clean_text_field_inverted)
+        create_clean_text_field.text_process_pipeline = (@full_default_process_dedup, )
+        create_clean_text_field_inverted.text_process_pipeline = (@full_default_process, )
+    """,
+    "scoped and evaluated references": """
+        clean_base_advertise.process_pipeline = (@upper_title_stage(), @dedup/create_clean_text_field,
+                                                 @create_clean_text_field_inverted)
+        upper_title_stage.suffix = " X"
+        dedup/create_clean_text_field.text_process_pipeline = (@full_default_process_dedup, )
+        create_clean_text_field.text_process_pipeline = ()
+        create_clean_text_field_inverted.text_process_pipeline = (@full_default_process, )
+    """,
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_gin():
+    gin.clear_config()
+    yield
+    gin.clear_config()
+
+
+def build_advertises():
+    advertises = []
+    for i, (category, price) in enumerate([("celular-e-telefone", 1200.0), ("celular-e-telefone", 350.0),
+                                           ("outros", 900.0), ("celular-e-telefone", None)]):
+        advertises.append(Advertise(url="https://produto.mercadolivre.com.br/MLB-{}".format(i), id=str(i),
+                                    market="MercadoLivre", category=category, price=price, region="sp",
+                                    title="Iphone 8 Plus 64GB Dourado {}".format(i),
+                                    detail="Aparelho novo, na caixa, com nota fiscal. Novo novo!"))
+    return advertises
+
+
+def gin_path(advertise):
+    if val.valid_advertise(advertise):
+        return dc.clean_base_advertise(advertise)
+
+
+def as_dicts(advertises):
+    return [advertise.to_dict() for advertise in advertises if advertise is not None]
+
+
+@pytest.mark.parametrize("config", sorted(CONFIGS))
+def test_plan_matches_gin_path(config):
+    gin.parse_config(CONFIGS[config])
+    plan = build_clean_plan()
+    expected = [gin_path(advertise) for advertise in build_advertises()]
+    assert [advertise is None for advertise in expected] == [False, False, config == "text pipes", True]
+
+    assert [None if advertise is None else advertise.to_dict() for advertise in expected] == \
+           [None if advertise is None else advertise.to_dict()
+            for advertise in map(plan.run, build_advertises())]
+    assert as_dicts(plan.run_batch(build_advertises())) == as_dicts(expected)
+
+
+def test_scoped_reference_keeps_its_scope():
+    gin.parse_config(CONFIGS["scoped and evaluated references"])
+    advertise = build_clean_plan().run(build_advertises()[0])
+    assert advertise["title"] == "IPHONE 8 PLUS 64GB DOURADO 0 X"
+    assert advertise["clean_text"] == pipelines.text_processors.full_default_process_dedup(
+        "IPHONE 8 PLUS 64GB DOURADO 0 X Aparelho novo, na caixa, com nota fiscal. Novo novo!")
+
+
+def test_non_callable_stage_raises():
+    gin.parse_config("clean_base_advertise.process_pipeline = (@create_clean_text_field, 'stage')")
+    with pytest.raises(TypeError):
+        build_clean_plan()
+
+
+def test_bind_configurable():
+    gin.parse_config("upper_title_stage.suffix = '!'")
+    bound = bind_configurable(upper_title_stage)
+    assert bound.keywords == {"suffix": "!"}
+    assert bound()({"title": "a"}) == {"title": "A!"}
+    gin.clear_config()
+    assert bind_configurable(upper_title_stage) is upper_title_stage.__wrapped__
@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+from pipelines.pricing.pricing_encoder import PricingEncoder
+
+SEQ_MAX_LEN, MAX_LEN_CHAR = 6, 4
+
+
+def fixture_ads():
+    ads = [{"clean_text": "iphone {} 64gb novo".format(i), "clean_text_invert": "novo 64gb iphone {}".format(i),
+            "price": 1000.0 + i} for i in range(9)]
+    # Invalid fields: skipped by both paths
+    ads[3] = {"clean_text": "sem preco", "clean_text_invert": "preco sem"}
+    ads[6]["price"] = "R$ 1.200"
+    return ads
+
+
+def encode(encoder, ad):
+    try:
+        encoder.encode_advertise(ad)
+    except Exception:
+        return False
+    return True
+
+
+def run_encoder(folder, ads, batch_size=None, fail=None):
+    encoder = PricingEncoder(seq_max_len=SEQ_MAX_LEN, max_len_char=MAX_LEN_CHAR, model_folder=folder,
+                             update_maps=True, word_cache_size=0)
+    failures = []
+    if fail:
+        # The batch kernel or the batch write fails on anything longer than a single advertise
+        method = getattr(encoder, fail)
+
+        def fragile(*args):
+            if len(args[-1]) > 2:
+                failures.append(len(args[-1]))
+                raise ValueError("{} failed".format(fail))
+            return method(*args)
+        setattr(encoder, fail, fragile)
+
+    if batch_size:
+        encoded = sum(encoder.encode_batch(ads[start:start + batch_size]) for start in range(0, len(ads), batch_size))
+    else:
+        encoded = sum(encode(encoder, ad) for ad in ads)
+    encoder.save_maps()
+    with open(os.path.join(encoder.model_folder, "dataset.jsonl"), "r", encoding="utf-8") as js:
+        rows = [json.loads(line) for line in js]
+    return encoded, rows, failures
+
+
+@pytest.mark.parametrize("fail", [None, "encode_sequences", "save_encoded_data"])
+def test_batch_matches_record_by_record(tmp_path, fail):
+    expected_encoded, expected_rows, _ = run_encoder(str(tmp_path / "single"), fixture_ads())
+    assert expected_encoded == 7 and len(expected_rows) == 14
+    encoded, rows, failures = run_encoder(str(tmp_path / "batch"), fixture_ads(), batch_size=4, fail=fail)
+    assert encoded == expected_encoded
+    assert rows == expected_rows
+    # Batches of 4, 4 and 1 advertises, with one invalid advertise in each of the first two
+    assert failures == ([] if fail is None else [6, 6])
@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from pipelines import utils as sc
+from pipelines.ner.sequence import MeasureGrammar, MeasureRules, SequenceEncoder
+
+SCHEMA = {"NUMBER_OF_PROPERTIES": 4,
+          "MEMORIA": ["16 gb", "32 gb", "64 gb", "4 gb", "44 gb"],
+          "BATERIA": ["3000 mah", "4000 mah"],
+          "MARCA": ["Samsung", "Apple", "moto g"],
+          "MODELO": ["galaxy s8", "moto g", "g5"]}
+
+
+@pytest.fixture
+def build_encoder(tmp_path):
+    properties_path = str(tmp_path / "parsed_properties.json")
+    sc.save_dict_2json(properties_path, SCHEMA)
+    encoders = []
+
+    def build(**kwargs):
+        encoders.append(SequenceEncoder(str(tmp_path / "out"), properties_path, [], **kwargs))
+        return encoders[-1]
+
+    yield build
+    for encoder in encoders:
+        encoder.save_maps()
+
+
+def ner_tags(encoder, text):
+    random.seed(0)
+    return [tuple(term) for term in encoder.ner_tag_advertise({"clean_text": text})["NER"]]
+
+
+def test_measure_rules_count_every_matching_rule():
+    rules = MeasureRules({"gb"}, {"4", "44", "64"})
+    assert rules.count(" 64 gb ") == 1
+    assert rules.count(" 64gb ") == 1
+    # '{val}+{unit}' repeats the last digit: 444gb matches the 4 and 44 rules
+    assert rules.count(" 444gb ") == 2
+    assert rules.count(" 644gb ") == 1
+    assert rules.count(" 16gb ") == 0
+    assert rules.count("64gb ") == 0
+    assert MeasureRules({"gb"}, set()).count(" 64gb ") == 0
+
+
+def test_measure_grammar_counts_once():
+    grammar = MeasureGrammar({"gb", "g"}, {"4", "44", "64"})
+    assert grammar.count(" 64 gb ") == grammar.count(" 64gb ") == grammar.count(" 64g ") == 1
+    assert grammar.count(" 444gb ") == grammar.count(" 644gb ") == grammar.count(" 16gb ") == 0
+    assert MeasureGrammar({"gb"}).count(" 16gb ") == 1
+
+
+@pytest.mark.parametrize("legacy_measure_rules", [False, True])
+def test_back_to_back_measures_are_tagged(build_encoder, legacy_measure_rules):
+    encoder = build_encoder(legacy_measure_rules=legacy_measure_rules)
+    assert ner_tags(encoder, "novo s8 64gb 16gb samsung g5") == \
+        [("novo", "O"), ("s8", "O"), ("64gb", "MEMORIA"), ("16gb", "MEMORIA"), ("samsung", "MARCA"), ("g5", "MODELO")]
+    assert ner_tags(encoder, "galaxy s8 32 gb 3000 mah 4000mah novo") == \
+        [("galaxy s8", "MODELO"), ("32 gb", "MEMORIA"), ("3000 mah", "BATERIA"), ("4000mah", "BATERIA"),
+         ("novo", "O")]
+
+
+def test_measure_grammar_by_default(build_encoder):
+    grammar = build_encoder()
+    assert all(isinstance(measure, MeasureGrammar) for measure in grammar.tagger.measure_map.values())
+    assert grammar.tagger.tags(" 444gb") == ()
+    assert grammar.tagger.tags(" 44gb") == ("MEMORIA",)
+    assert ner_tags(grammar, "novo 644gb 16 gb x") == [("novo", "O"), ("644gb", "O"), ("16 gb", "MEMORIA"),
+                                                       ("x", "O")]
+    assert build_encoder(measure_whitelist=False).tagger.tags(" 644gb") == ("MEMORIA",)
+
+    legacy = build_encoder(legacy_measure_rules=True)
+    assert all(isinstance(measure, MeasureRules) for measure in legacy.tagger.measure_map.values())
+    assert legacy.tagger.tags(" 444gb") == ("MEMORIA", "MEMORIA")
+    assert ner_tags(legacy, "novo 644gb 16 gb x") == [("novo", "O"), ("644gb", "MEMORIA"), ("16 gb", "MEMORIA"),
+                                                      ("x", "O")]
+
+
+def test_phrases_and_measures_are_marked(build_encoder):
+    encoder = build_encoder()
+    assert encoder.splitting_marking("vendo moto g 64gb ") == "vendo **moto g**** 64gb** "
+    assert encoder.tagger.tags("moto g") == ("MARCA", "MODELO")
+    # Leading/trailing measures have no surrounding space to match
+    tags = ner_tags(encoder, "64gb moto g novo 32gb")
+    assert [term for term, _ in tags] == ["64gb", "moto g", "novo", "32gb"]
+    assert tags[0][1] == tags[2][1] == tags[3][1] == "O" and tags[1][1] in ("MARCA", "MODELO")
@@ -0,0 +1,134 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+
+from pipelines.shards import NpyBatchSequence, NpyDataset, NpyShardWriter, concatenate_shards, load_npy_dataset, \
+    shard_fields
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rows(start: int, stop: int) -> np.ndarray:
+    return np.arange(start * 6, stop * 6, dtype=np.int32).reshape(-1, 2, 3)
+
+
+def test_appended_shard_reloads(tmp_path):
+    path = str(tmp_path / "x_char.npy")
+    writer = NpyShardWriter(path, "int32", (2, 3))
+    writer.append(rows(0, 4))
+    writer.flush()
+    assert np.array_equal(np.load(path), rows(0, 4))
+    writer.append(rows(4, 5).tolist())
+    writer.close()
+    assert np.array_equal(np.load(path), rows(0, 5))
+    assert np.array_equal(np.load(path, mmap_mode="r"), rows(0, 5))
+
+    # Reopening appends after the rows of the header
+    writer = NpyShardWriter(path, "int32", (2, 3))
+    assert writer.shape == (5, 2, 3)
+    writer.append(rows(5, 7))
+    writer.close()
+    assert np.array_equal(np.load(path), rows(0, 7))
+
+
+def test_empty_shard_reloads(tmp_path):
+    path = str(tmp_path / "y_price.npy")
+    NpyShardWriter(path, "float32", ()).close()
+    assert np.load(path).shape == (0,)
+
+
+def test_unflushed_rows_are_dropped_on_reopen(tmp_path):
+    path = str(tmp_path / "x_word.npy")
+    writer = NpyShardWriter(path, "int32", (2, 3))
+    writer.append(rows(0, 2))
+    writer.flush()
+    writer.append(rows(2, 3))
+    writer.file.flush()
+    reopened = NpyShardWriter(path, "int32", (2, 3))
+    assert reopened.rows == 2
+    reopened.close()
+    assert np.array_equal(np.load(path), rows(0, 2))
+    writer.file.close()
+
+
+def test_shard_mismatches_raise(tmp_path):
+    path = str(tmp_path / "x_word.npy")
+    writer = NpyShardWriter(path, "int32", (2, 3))
+    with pytest.raises(ValueError):
+        writer.append(np.zeros((1, 3), dtype=np.int32))
+    writer.close()
+    with pytest.raises(ValueError):
+        NpyShardWriter(path, "int64", (2, 3))
+    np.save(str(tmp_path / "fortran.npy"), np.asfortranarray(rows(0, 2)))
+    with pytest.raises(ValueError):
+        NpyShardWriter(str(tmp_path / "fortran.npy"), "int32", (2, 3))
+
+
+def test_shard_writers_close_on_exit_of_with_blocks(tmp_path):
+    path = str(tmp_path / "single.npy")
+    with NpyShardWriter(path, "int32", (2, 3)) as writer:
+        writer.append(rows(0, 3))
+    assert writer.file.closed
+    assert np.array_equal(np.load(path), rows(0, 3))
+    with NpyDataset(str(tmp_path), {"x_word": ("int32", (2, 3))}) as dataset:
+        dataset.write(x_word=rows(0, 2))
+    assert np.array_equal(load_npy_dataset(str(tmp_path), ["x_word"])["x_word"], rows(0, 2))
+
+
+def test_unclosed_shard_is_finalised_at_exit(tmp_path):
+    path = str(tmp_path / "x_word.npy")
+    script = textwrap.dedent("""
+        import numpy as np
+        from pipelines.shards import NpyShardWriter
+        writer = NpyShardWriter({!r}, "int32", (3,))
+        writer.append(np.arange(30).reshape(10, 3))
+    """).format(path)
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
+    assert np.array_equal(np.load(path), np.arange(30, dtype=np.int32).reshape(10, 3))
+
+
+def test_dataset_shards(tmp_path):
+    folder = str(tmp_path)
+    fields = {"x_word": ("int32", (4,)), "y_price": ("float32", ())}
+    dataset = NpyDataset(folder, fields)
+    assert dataset.write(x_word=np.ones((3, 4)), y_price=np.arange(3)) == 3
+    assert dataset.write(x_word=np.zeros((2, 4)), y_price=np.arange(3, 5)) == 2
+    with pytest.raises(ValueError):
+        dataset.write(x_word=np.ones((3, 4)), y_price=np.arange(2))
+    dataset.close()
+
+    assert shard_fields(folder) == ["x_word", "y_price"]
+    loaded = load_npy_dataset(folder)
+    assert loaded["x_word"].tolist() == [[1] * 4] * 3 + [[0] * 4] * 2
+    assert loaded["y_price"].dtype == np.float32 and loaded["y_price"].tolist() == [0, 1, 2, 3, 4]
+
+    sequence = NpyBatchSequence(folder, inputs=("x_word",), targets=("y_price",), batch_size=2)
+    assert len(sequence) == 3
+    x, y = sequence[2]
+    assert x.shape == (1, 4) and y.tolist() == [4]
+
+
+def test_unaligned_dataset_raises(tmp_path):
+    np.save(str(tmp_path / "x_word.npy"), np.zeros((3, 4)))
+    np.save(str(tmp_path / "y_price.npy"), np.zeros(2))
+    with pytest.raises(ValueError):
+        load_npy_dataset(str(tmp_path))
+
+
+@pytest.mark.parametrize("start,stop", [(0, None), (3, 9), (0, 0), (7, 100)])
+def test_concatenate_shards(tmp_path, start, stop, monkeypatch):
+    monkeypatch.setattr("pipelines.shards.NPY_CHUNK_ROWS", 2)
+    paths = []
+    for i, (begin, end) in enumerate([(0, 4), (4, 5), (5, 10)]):
+        paths.append(str(tmp_path / "part{}.npy".format(i)))
+        np.save(paths[-1], rows(begin, end))
+    output = str(tmp_path / "out" / "x_char.npy")
+    os.makedirs(os.path.dirname(output))
+    expected = rows(0, 10)[start:stop]
+    assert concatenate_shards(paths, output, start, stop) == len(expected)
+    assert np.array_equal(np.load(output), expected)
+    assert concatenate_shards([], output) == 0
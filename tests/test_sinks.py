@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from pipelines.sinks import AsyncLineSink
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_lines(path):
+    with open(path, "r", encoding="utf-8") as fl:
+        return fl.read().splitlines()
+
+
+def test_sink_writes_lines_in_order(tmp_path):
+    path = str(tmp_path / "dataset.jsonl")
+    lines = ["{}\n".format(i) for i in range(5000)]
+    sink = AsyncLineSink(path, buffer_size=64, max_pending=2)
+    sink.write_lines(lines[:10])
+    sink.flush()
+    assert read_lines(path) == [line.strip() for line in lines[:10]]
+    sink.write_lines(lines[10:])
+    assert sink.lines == len(lines)
+    sink.close()
+    assert not sink.writer.is_alive()
+    assert read_lines(path) == [line.strip() for line in lines]
+    sink.close()
+
+
+def test_sink_closes_on_exit_of_with_block(tmp_path):
+    path = str(tmp_path / "dataset.jsonl")
+    with AsyncLineSink(path, buffer_size=2) as sink:
+        sink.write_lines(["a\n", "b\n", "c\n"])
+    assert not sink.writer.is_alive() and not sink.writer.daemon
+    assert read_lines(path) == ["a", "b", "c"]
+
+
+def test_sink_appends(tmp_path):
+    path = str(tmp_path / "dataset.jsonl")
+    for chunk in ("a", "b"):
+        sink = AsyncLineSink(path)
+        sink.write(chunk + "\n")
+        sink.close()
+    assert read_lines(path) == ["a", "b"]
+
+
+def test_sink_reports_write_errors(tmp_path):
+    path = str(tmp_path / "dataset.jsonl")
+    sink = AsyncLineSink(path, buffer_size=1)
+    # A handle the writer thread cannot write to
+    sink.file.close()
+    sink.file = open(path, "r", encoding="utf-8")
+    sink.write("line\n")
+    with pytest.raises(IOError):
+        sink.flush()
+    with pytest.raises(IOError):
+        sink.close()
+
+
+def test_sink_close_stops_writer_after_failed_write(tmp_path):
+    path = str(tmp_path / "dataset.jsonl")
+    sink = AsyncLineSink(path, buffer_size=1)
+    sink.file.close()
+    sink.file = open(path, "r", encoding="utf-8")
+    sink.write("line\n")
+    with pytest.raises(IOError):
+        sink.flush()
+    with pytest.raises(IOError):
+        sink.close()
+    assert not sink.writer.is_alive()
+
+
+def test_unclosed_sink_is_drained_at_exit(tmp_path):
+    path = str(tmp_path / "dataset.jsonl")
+    script = textwrap.dedent("""
+        from pipelines.sinks import AsyncLineSink
+        sink = AsyncLineSink({!r}, buffer_size=100)
+        for i in range(1000):
+            sink.write("{{}}\\n".format(i))
+    """).format(path)
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True, timeout=60)
+    assert read_lines(path) == [str(i) for i in range(1000)]
@@ -0,0 +1,55 @@
+import random
+from collections import Counter
+
+import pytest
+
+from pipelines.sketches import SpaceSaving, build_counter
+
+
+def zipf_tokens(count: int = 20000, vocabulary: int = 2000, seed: int = 1):
+    rnd = random.Random(seed)
+    weights = [1 / rank for rank in range(1, vocabulary + 1)]
+    return ["t{}".format(rank) for rank in rnd.choices(range(vocabulary), weights=weights, k=count)]
+
+
+def test_space_saving_is_exact_under_capacity():
+    tokens = zipf_tokens(5000, vocabulary=50)
+    sketch = SpaceSaving(50)
+    sketch.update(tokens)
+    assert dict(sketch.items()) == Counter(tokens)
+    assert all(sketch.error(token) == 0 for token in sketch)
+
+
+@pytest.mark.parametrize("capacity", [10, 100, 500])
+def test_space_saving_error_bound(capacity):
+    tokens = zipf_tokens()
+    exact = Counter(tokens)
+    sketch = SpaceSaving(capacity)
+    sketch.update(tokens)
+
+    assert len(sketch) == capacity
+    assert sketch.total == len(tokens) == sum(count for _, count in sketch.items())
+    bound = len(tokens) / capacity
+    for token, count in sketch.items():
+        # Overestimates by at most its error, which is at most total / capacity
+        assert exact[token] <= count <= exact[token] + sketch.error(token)
+        assert sketch.error(token) <= bound
+    # Every token more frequent than the bound is kept
+    assert all(token in sketch for token, count in exact.items() if count > bound)
+
+
+def test_space_saving_weighted_updates():
+    sketch = SpaceSaving(3)
+    sketch.update({"a": 5, "b": 3, "c": 1})
+    sketch.add("d", 2)
+    assert "c" not in sketch
+    assert sketch["d"] == 3 and sketch.error("d") == 1
+    assert sketch.most_common(2) == [("a", 5), ("b", 3)]
+    assert sketch.most_common() == [("a", 5), ("b", 3), ("d", 3)]
+
+
+def test_build_counter():
+    assert isinstance(build_counter(), Counter)
+    assert isinstance(build_counter(8), SpaceSaving)
+    with pytest.raises(ValueError):
+        SpaceSaving(0)
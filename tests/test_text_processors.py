@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+import pipelines.text_processors as tp
+
+TEXTS = ["Celular Samsung Galaxy S8 64GB, NOVO!!! na caixa - R$ 1.500,00",
+         "iPhone 7 Plus 128 gb preto fosco (usado) com nota fiscal",
+         "Moto G5 Plus 32GB Dourado ótimo estado, acompanha carregador e capinha",
+         "   ", "",
+         "ÀÉÎÕÜ àéîõü ç Ç ñ ß ΣΑΣ ﬁ ǅ ① ²",
+         "de da do para com em e o a os as um uma"]
+
+
+def random_texts(count: int = 500, seed: int = 3):
+    rnd = random.Random(seed)
+    alphabet = "abcdeéàçõ ABCÉ 0123456789 .,;!?-()/ ΣσςﬁǅİÍ̧"
+    return ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 60))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("dedup", [False, True])
+def test_normalizer_matches_chained_process(dedup):
+    normalizer = tp.TextNormalizer(dedup=dedup)
+    for text in TEXTS + random_texts():
+        assert normalizer(text) == tp.chained_default_process(text, dedup=dedup), text
+
+
+@pytest.mark.parametrize("dedup", [False, True])
+def test_normalizer_batch_matches_single_texts(dedup):
+    normalizer = tp.TextNormalizer(dedup=dedup)
+    texts = TEXTS + random_texts(200, seed=5)
+    assert normalizer.batch(texts) == [tp.chained_default_process(text, dedup=dedup) for text in texts]
+    assert normalizer.batch([]) == []
+
+
+def test_full_default_processes():
+    for text in TEXTS:
+        assert tp.full_default_process(text) == tp.chained_default_process(text)
+        assert tp.full_default_process_dedup(text) == tp.chained_default_process(text, dedup=True)
+    assert tp.batch_process(TEXTS, tp.full_default_process) == [tp.full_default_process(text) for text in TEXTS]
+
+
+def test_token_cache_counts_each_lookup_once():
+    tp.setup_token_cache(cache_size=64)
+    normalizer = tp.TextNormalizer()
+    normalizer(TEXTS[0])
+    assert tp.token_cache_info()["lookups"] == len(TEXTS[0].split())
+
+    # 'Σ' cannot be folded alone, so its text falls back to the chained process
+    texts = ["novo ΣΑΣ", TEXTS[1], "", TEXTS[0]]
+    assert normalizer.batch(texts) == [tp.chained_default_process(text) for text in texts]
+    info = tp.token_cache_info()
+    separators = len(texts) - 1
+    assert info["lookups"] == len(TEXTS[0].split()) + sum(len(text.split()) for text in texts) + separators
+    assert info["frozen_hits"] == 0
+    assert info["lookups"] == info["lru_hits"] + info["lru_misses"]
+    tp.setup_token_cache()
@@ -0,0 +1,121 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from pipelines import utils as sc
+from pipelines.ner.encoder import NEREncoder, NERReducer
+
+# Skipped without tensorflow
+tfrecords = pytest.importorskip("pipelines.tfrecords")
+tf = tfrecords.tf
+
+FIELDS = {"x_word": ("int32", (4,)), "x_char": ("int32", (4, 3)), "y_price": ("float32", ())}
+
+
+def fixture_rows(rows: int = 5):
+    return {"x_word": np.arange(rows * 4, dtype=np.int32).reshape(rows, 4),
+            "x_char": np.arange(rows * 12, dtype=np.int32).reshape(rows, 4, 3),
+            "y_price": np.linspace(1, 2, rows).astype(np.float32)}
+
+
+def shard_names(folder):
+    return sorted(os.path.basename(path) for path in glob.glob(os.path.join(folder, "*.tfrecord")))
+
+
+def read_examples(folder, compression=None):
+    options = tf.python_io.TFRecordOptions(tfrecords.COMPRESSION_TYPES[compression])
+    rows = []
+    for name in shard_names(folder):
+        for record in tf.python_io.tf_record_iterator(os.path.join(folder, name), options=options):
+            feature = tf.train.Example.FromString(record).features.feature
+            rows.append({"x_word": list(feature["x_word"].int64_list.value),
+                         "x_char": list(feature["x_char"].int64_list.value),
+                         "y_price": list(feature["y_price"].float_list.value)})
+    return rows
+
+
+def read_batches(input_fn):
+    with tf.Graph().as_default():
+        next_batch = input_fn().make_one_shot_iterator().get_next()
+        batches = []
+        with tf.Session() as session:
+            while True:
+                try:
+                    batches.append(session.run(next_batch))
+                except tf.errors.OutOfRangeError:
+                    return batches
+
+
+@pytest.mark.parametrize("compression", [None, "GZIP"])
+def test_writer_round_trip(tmp_path, compression):
+    folder = str(tmp_path)
+    data = fixture_rows()
+    writer = tfrecords.TFRecordShardWriter(folder, FIELDS, shard_size=2, compression=compression)
+    assert writer.write(**{name: rows[:3] for name, rows in data.items()}) == 3
+    assert writer.write(**{name: rows[3:] for name, rows in data.items()}) == 2
+    with pytest.raises(ValueError):
+        writer.write(x_word=data["x_word"][:2], x_char=data["x_char"][:1], y_price=data["y_price"][:2])
+    writer.close()
+
+    assert shard_names(folder) == ["dataset-00000.tfrecord", "dataset-00001.tfrecord", "dataset-00002.tfrecord"]
+    rows = read_examples(folder, compression)
+    assert [row["x_word"] for row in rows] == data["x_word"].tolist()
+    assert [row["x_char"] for row in rows] == data["x_char"].reshape(5, -1).tolist()
+    assert np.allclose([row["y_price"] for row in rows], data["y_price"].reshape(5, 1))
+    with pytest.raises(ValueError):
+        tfrecords.TFRecordShardWriter(folder, FIELDS, compression="LZ4")
+
+
+def test_feature_spec():
+    assert tfrecords.feature_spec(FIELDS) == {"x_word": tf.FixedLenFeature([4], tf.int64),
+                                              "x_char": tf.FixedLenFeature([4, 3], tf.int64),
+                                              "y_price": tf.FixedLenFeature([], tf.float32)}
+
+
+def test_input_fn_reads_every_row(tmp_path):
+    folder = str(tmp_path)
+    data = fixture_rows()
+    writer = tfrecords.TFRecordShardWriter(folder, FIELDS, shard_size=2)
+    writer.write(**data)
+    writer.close()
+
+    input_fn = tfrecords.build_input_fn(os.path.join(folder, "dataset-*.tfrecord"), FIELDS, batch_size=2, epochs=1,
+                                        shuffle_buffer=0, cycle_length=1)
+    batches = read_batches(input_fn)
+    assert [len(labels) for _, labels in batches] == [2, 2, 1]
+    x_word = np.concatenate([features["x_word"] for features, _ in batches])
+    x_char = np.concatenate([features["x_char"] for features, _ in batches])
+    assert x_word.dtype == x_char.dtype == np.int32
+    assert sorted(x_word.tolist()) == data["x_word"].tolist()
+    assert sorted(x_char.tolist()) == data["x_char"].tolist()
+    assert np.allclose(sorted(np.concatenate([labels for _, labels in batches])), data["y_price"])
+
+
+def test_empty_split_has_no_shards_and_is_reduced(tmp_path):
+    writer = tfrecords.TFRecordShardWriter(str(tmp_path), FIELDS)
+    writer.write(**fixture_rows(0))
+    writer.close()
+    assert shard_names(str(tmp_path)) == []
+
+    ads = [{"id": "ad-{}".format(i), "NER": [["samsung", "MARCA"], ["s{}".format(i), "MODELO"]]} for i in range(40)]
+    train_ads = [ad for ad in ads if not sc.hash_split(ad["id"], 0.3)]
+    main_folder = str(tmp_path / "workers")
+    # The second worker has no test rows, so its test/ folder stays empty
+    folders = []
+    for worker_ads in (ads, train_ads[:4]):
+        encoder = NEREncoder(seq_max_len=4, max_len_char=3, model_folder=main_folder, debug=False, test_perc=0.3,
+                             output_format="tfrecord", update_maps=True)
+        encoder.encode_batch(worker_ads)
+        encoder.save_maps()
+        folders.append(encoder.model_folder)
+    assert shard_names(os.path.join(folders[1], "test")) == []
+
+    reducer = NERReducer(main_folder, str(tmp_path / "reduced"))
+    reducer.reduce_process()
+    reduced_folder = os.path.join(reducer.output_folder, "ner_encoded")
+    for split, count in (("train", len(train_ads) + 4), ("test", len(ads) - len(train_ads))):
+        records = sum(1 for name in shard_names(os.path.join(reduced_folder, split))
+                      for _ in tf.python_io.tf_record_iterator(os.path.join(reduced_folder, split, name)))
+        assert records == count
@@ -0,0 +1,110 @@
+import json
+import os
+import random
+from collections import Counter
+
+import pytest
+
+from pipelines import utils as sc
+from pipelines.vocab_shards import VocabularyReducer, counts_path, external_sort, merge_counts, rank_counts, \
+    rank_key, read_counts_shard, vocabulary_entries, write_counts_shard, write_vocabulary
+from pipelines.vocabulary import MappedVocabulary, Vocabulary
+
+
+def random_counters(shards: int = 4, seed: int = 3):
+    rnd = random.Random(seed)
+    tokens = ["w{}".format(i) for i in range(300)] + ["ç", "é", "UNK", "Z", "a b"]
+    return [Counter(rnd.choice(tokens) for _ in range(rnd.randint(0, 2000))) for _ in range(shards)]
+
+
+def expected_ranking(counters):
+    return sorted(sum(counters, Counter()).items(), key=rank_key)
+
+
+def expected_map(counters, min_count):
+    tokens = ["__PAD__", "UNK"]
+    tokens += [token for token, count in expected_ranking(counters) if count >= min_count and token not in tokens]
+    return [(token, i) for i, token in enumerate(tokens)]
+
+
+def test_merge_counts_matches_counter(tmp_path):
+    counters = random_counters()
+    paths = []
+    for i, counter in enumerate(counters):
+        paths.append(str(tmp_path / "shard{}.jsonl".format(i)))
+        write_counts_shard(paths[-1], counter.items())
+    merged = list(merge_counts([read_counts_shard(path) for path in paths]))
+    assert merged == sorted(sum(counters, Counter()).items())
+    assert list(merge_counts([])) == []
+
+
+@pytest.mark.parametrize("run_size", [1, 7, 1000000])
+def test_rank_counts_matches_counter(tmp_path, run_size):
+    counters = random_counters()
+    merged = merge_counts([sorted(counter.items()) for counter in counters])
+    assert list(rank_counts(merged, str(tmp_path), run_size)) == expected_ranking(counters)
+
+
+def test_external_sort(tmp_path):
+    pairs = [("t{}".format(random.Random(i).randint(0, 50)), i) for i in range(200)]
+    assert list(external_sort(iter(pairs), str(tmp_path), run_size=16)) == sorted(pairs, key=lambda pair: pair[0])
+    assert list(external_sort(iter([]), str(tmp_path), run_size=16)) == []
+
+
+def test_vocabulary_entries():
+    ranked = [("a", 9), ("UNK", 8), ("b", 5), ("c", 2), ("d", 1)]
+    assert list(vocabulary_entries(Vocabulary.base(), ranked)) == \
+           [("__PAD__", 0), ("UNK", 1), ("a", 2), ("b", 3), ("c", 4), ("d", 5)]
+    assert list(vocabulary_entries(Vocabulary.base(), ranked, min_count=2)) == \
+           [("__PAD__", 0), ("UNK", 1), ("a", 2), ("b", 3), ("c", 4)]
+    assert list(vocabulary_entries(Vocabulary.base(unk=False), ranked, max_vocab=2)) == \
+           [("__PAD__", 0), ("a", 1), ("UNK", 2)]
+
+
+def test_write_vocabulary(tmp_path):
+    path = str(tmp_path / "word2idx.json")
+    ranked = expected_ranking(random_counters())
+    size = write_vocabulary(path, Vocabulary.base(), ranked, max_vocab=100)
+    written = sc.load_json(path)
+    assert size == len(written) == 102
+    assert list(written.items()) == list(vocabulary_entries(Vocabulary.base(), ranked, max_vocab=100))
+
+
+def write_worker_counts(reducer):
+    counters = random_counters()
+    for i, counter in enumerate(counters):
+        folder = sc.check_folder(os.path.join(reducer.main_folder, "worker{}".format(i)))
+        write_counts_shard(counts_path(folder, "word2idx"), counter.items())
+    # A worker folder written before counts were kept: its tokens count once
+    legacy = sc.check_folder(os.path.join(reducer.main_folder, "worker_legacy"))
+    sc.save_dict_2json(os.path.join(legacy, "word2idx.json"), {"__PAD__": 0, "UNK": 1, "w1": 2, "legacy": 3})
+    counters.append(Counter(["__PAD__", "UNK", "w1", "legacy"]))
+    return counters
+
+
+def test_vocabulary_reducer(tmp_path):
+    reducer = VocabularyReducer(str(tmp_path / "workers"), str(tmp_path / "reduced"), "maps", maps=("word2idx",),
+                                min_count=3, run_size=50)
+    counters = write_worker_counts(reducer)
+
+    reducer.reduce_process()
+
+    reduced_folder = os.path.join(reducer.output_folder, "maps")
+    with open(os.path.join(reduced_folder, "word2idx.json"), "r", encoding="utf-8") as js:
+        assert list(json.load(js).items()) == expected_map(counters, min_count=3)
+    assert list(read_counts_shard(counts_path(reduced_folder, "word2idx"))) == \
+           sorted(sum(counters, Counter()).items())
+
+
+def test_vocabulary_reducer_binary_maps(tmp_path):
+    reducer = VocabularyReducer(str(tmp_path / "workers"), str(tmp_path / "reduced"), "maps", maps=("word2idx",),
+                                min_count=3, run_size=50, binary_maps=True)
+    counters = write_worker_counts(reducer)
+
+    reducer.reduce_process()
+
+    reduced_folder = os.path.join(reducer.output_folder, "maps")
+    expected = expected_map(counters, min_count=3)
+    with open(os.path.join(reduced_folder, "word2idx.json"), "r", encoding="utf-8") as js:
+        assert list(json.load(js).items()) == expected
+    assert list(MappedVocabulary(os.path.join(reduced_folder, "word2idx.vocab")).items()) == expected
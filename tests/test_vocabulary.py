@@ -0,0 +1,154 @@
+import json
+import os
+import random
+import zlib
+
+import numpy as np
+import pytest
+
+from pipelines.vocabulary import Vocabulary, MappedVocabulary, HashedVocabulary, WordCache, PAD_TOKEN, UNK_TOKEN, \
+    write_binary_vocabulary, write_sorted_binary_vocabulary, load_vocabulary, export_binary_maps, \
+    encode_word_batch, encode_char_batch
+
+
+def random_tokens(count: int, seed: int = 7):
+    rnd = random.Random(seed)
+    alphabet = "abcxyz0189çãéü€中😀 _-"
+    return {"".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 12))) for _ in range(count)}
+
+
+def random_vocabulary(count: int = 2000) -> Vocabulary:
+    vocabulary = Vocabulary.base()
+    vocabulary.update_from(sorted(random_tokens(count), key=lambda token: zlib.crc32(token.encode("utf-8"))))
+    return vocabulary
+
+
+def random_sequences(count: int, seq_max_len: int, seed: int = 11):
+    rnd = random.Random(seed)
+    words = sorted(random_tokens(60, seed)) + ["", "UNK"]
+    sequences = []
+    for _ in range(count):
+        sentence = [rnd.choice(words) for _ in range(rnd.randint(0, seq_max_len + 3))][:seq_max_len]
+        sequences.append(sentence + [PAD_TOKEN] * (seq_max_len - len(sentence)))
+    return sequences
+
+
+def test_vocabulary_ids_and_freeze():
+    vocabulary = Vocabulary.base()
+    assert vocabulary.encode(["a", "b", "a"]) == [3, 4, 3]
+    assert vocabulary.lookup_or_add("c") == 5
+    vocabulary.freeze()
+    assert vocabulary.encode(["a", "new"]) == [3, vocabulary[UNK_TOKEN]]
+    assert "new" not in vocabulary
+    with pytest.raises(TypeError):
+        vocabulary["new"] = 6
+
+
+def test_binary_vocabulary_round_trip(tmp_path):
+    vocabulary = random_vocabulary()
+    vocab_file = str(tmp_path / "word2idx.vocab")
+    write_binary_vocabulary(vocab_file, vocabulary)
+
+    mapped = MappedVocabulary(vocab_file, memo_size=16)
+    assert len(mapped) == len(vocabulary)
+    for token, idx in vocabulary.items():
+        assert mapped[token] == idx
+        assert mapped.find(token) == idx
+    for token in random_tokens(200, seed=8) - set(vocabulary):
+        assert token not in mapped
+        assert mapped.get(token) is None
+        assert mapped.lookup_or_add(token) == vocabulary[UNK_TOKEN]
+    assert list(mapped.items()) == list(vocabulary.items())
+    assert mapped.to_vocabulary() == vocabulary
+
+    json_file = str(tmp_path / "exported.json")
+    mapped.to_json(json_file)
+    with open(json_file, "r", encoding="utf-8") as js:
+        assert list(json.load(js).items()) == list(vocabulary.items())
+
+
+def test_streamed_binary_vocabulary_is_byte_identical(tmp_path):
+    vocabulary = random_vocabulary()
+    write_binary_vocabulary(str(tmp_path / "full.vocab"), vocabulary)
+    size = write_sorted_binary_vocabulary(str(tmp_path / "streamed.vocab"), iter(sorted(vocabulary.items())),
+                                          chunk_size=7)
+    assert size == len(vocabulary)
+    assert (tmp_path / "full.vocab").read_bytes() == (tmp_path / "streamed.vocab").read_bytes()
+
+
+def test_binary_vocabulary_rejects_other_files(tmp_path):
+    path = tmp_path / "word2idx.vocab"
+    path.write_bytes(b"not a vocabulary file")
+    with pytest.raises(ValueError):
+        MappedVocabulary(str(path))
+
+
+def test_load_vocabulary_maps_fresh_binaries(tmp_path):
+    vocabulary = random_vocabulary(100)
+    folder = str(tmp_path)
+    vocabulary.to_json(os.path.join(folder, "word2idx.json"))
+    assert isinstance(load_vocabulary(folder, "word2idx", frozen=True), Vocabulary)
+
+    assert export_binary_maps(folder) == [os.path.join(folder, "word2idx.vocab")]
+    assert export_binary_maps(folder) == []
+    frozen = load_vocabulary(folder, "word2idx", frozen=True)
+    assert isinstance(frozen, MappedVocabulary)
+    assert dict(frozen.items()) == vocabulary
+
+    unfrozen = load_vocabulary(folder, "word2idx", frozen=False)
+    assert isinstance(unfrozen, Vocabulary) and not unfrozen.frozen
+    assert unfrozen == vocabulary
+
+
+def test_hashed_vocabulary():
+    hashed = HashedVocabulary(97, track_collisions=True)
+    tokens = sorted(random_tokens(500))
+    ids = hashed.encode([PAD_TOKEN, UNK_TOKEN] + tokens)
+    assert ids[:2] == [0, 1]
+    assert ids[2:] == [2 + zlib.crc32(token.encode("utf-8")) % 97 for token in tokens]
+    assert ids[2:] == HashedVocabulary(97).encode(tokens)
+    assert len(hashed) == 99
+
+    report = hashed.collision_report()
+    assert report["tokens"] == len(tokens)
+    assert report["used_buckets"] == len(set(ids[2:])) <= 97
+    assert HashedVocabulary(97).collision_report() is None
+    with pytest.raises(ValueError):
+        HashedVocabulary(0)
+
+
+@pytest.mark.parametrize("frozen", [False, True])
+def test_batch_kernels_match_sentence_encoding(frozen):
+    seq_max_len, max_len_char = 12, 5
+    sequences = random_sequences(50, seq_max_len)
+    wordidx, charidx = Vocabulary.base(frozen=frozen), Vocabulary.base(frozen=frozen)
+    expected_words, expected_chars = Vocabulary.base(frozen=frozen), Vocabulary.base(frozen=frozen)
+
+    x_word = encode_word_batch(sequences, wordidx, seq_max_len)
+    x_char = encode_char_batch(sequences, charidx, seq_max_len, max_len_char)
+
+    assert x_word.shape == (50, seq_max_len) and x_word.dtype == np.int32
+    assert x_char.shape == (50, seq_max_len, max_len_char) and x_char.dtype == np.int32
+    for i, sentence in enumerate(sequences):
+        assert x_word[i].tolist() == expected_words.encode(sentence)
+        words = [word for word in sentence if word != ""]
+        for j in range(seq_max_len):
+            chars = expected_chars.encode(words[j][:max_len_char]) if j < len(words) else []
+            assert x_char[i, j].tolist() == chars + [0] * (max_len_char - len(chars))
+    assert wordidx == expected_words and charidx == expected_chars
+
+
+@pytest.mark.parametrize("max_size", [1 << 20, 16])
+def test_word_cache_matches_batch_kernels(max_size):
+    seq_max_len, max_len_char = 12, 5
+    cache = WordCache(Vocabulary.base(), Vocabulary.base(), max_len_char, max_size=max_size, capacity=2)
+    wordidx, charidx = Vocabulary.base(), Vocabulary.base()
+    for seed in range(5):
+        sequences = random_sequences(20, seq_max_len, seed=seed)
+        x_word, x_char = cache.encode_batch(sequences, seq_max_len)
+        assert np.array_equal(x_word, encode_word_batch(sequences, wordidx, seq_max_len))
+        assert np.array_equal(x_char, encode_char_batch(sequences, charidx, seq_max_len, max_len_char))
+    assert cache.wordidx == wordidx and cache.charidx == charidx
+    info = cache.cache_info()
+    assert info["hits"] + info["misses"] == 5 * 20 * seq_max_len
+    assert (info["clears"] > 0) == (max_size == 16)